@@ -14,6 +14,36 @@ from mecfunctions import unpickle, round2
 
 
 
+def image_moments(img):
+    ''' computes all the moments of an image, or of a stack of images (3D array, first index is the image number).
+        Uses the x and y projections, so no image sized temporary arrays are made.
+        Returns a dictionary, all in pixels with the first pixel at 1:
+            mx, my   : centroid
+            m2x, m2y : second moments
+            wx, wy   : widths, 2*sqrt(variance)
+            cxy      : covariance of x and y
+    '''
+    img=asarray(img)
+    ypixs,xpixs=img.shape[-2:]
+    x=arange(1,xpixs+1,dtype=float)
+    y=arange(1,ypixs+1,dtype=float)
+    rows=dot(img,column_stack((ones(xpixs),x)))   # per row: sum and sum of x
+    py=rows[...,0]
+    px=img.sum(axis=-2)
+    total=py.sum(axis=-1)
+    mx=dot(px,x)/total
+    my=dot(py,y)/total
+    m2x=dot(px,x**2)/total
+    m2y=dot(py,y**2)/total
+    # variances around the centroid, more accurate than m2-m**2
+    dx=x-expand_dims(mx,-1)
+    dy=y-expand_dims(my,-1)
+    varx=(px*dx**2).sum(axis=-1)/total
+    vary=(py*dy**2).sum(axis=-1)/total
+    cxy=(dy*(rows[...,1]-expand_dims(mx,-1)*py)).sum(axis=-1)/total
+    return {'mx':mx,'my':my,'m2x':m2x,'m2y':m2y,'wx':2*sqrt(varx),'wy':2*sqrt(vary),'cxy':cxy}
+
+
 class Beam(object):
     """ class of a laser beam spot.
 
@@ -185,76 +215,50 @@ class Beam(object):
         '''pushes image to tmp image'''
         self.__tmp=self.__img
 
+    def moments(self):
+        ''' returns a dictionary with all the moments of the image, see image_moments. In pixels '''
+        return image_moments(self.__img)
+
     def mx(self):
         ''' return the mean in x direction of image.In pixels. '''
-        tmp=self.__img        
-        xpixs=self.__img.shape[1] #number of x pixels (columns)
-        ypixs=self.__img.shape[0] # number of y pixels (rows)
-        self.normalize()
-        matx=tile(arange(1,xpixs+1),(ypixs,1)) #make a matrix with all rows = (1,2, .. 780)
-        xfxy=matx*self.__img
-        meanx=xfxy.sum()
-        self.__img=tmp
-        return meanx
+        return self.moments()['mx']
 
-  
-    
     def my(self):
         ''' return the mean in y direction of image. In pixels '''
-        tmp=self.__img
-        xpixs=self.__img.shape[1] #number of x pixels (columns)
-        ypixs=self.__img.shape[0] # number of y pixels (rows)
-        self.normalize()
-        maty=transpose(tile(arange(1,ypixs+1),(xpixs,1))) #make a matrix with all columns = (1,2, .. 780)
-        yfxy=maty*self.__img
-        meany=yfxy.sum()
-        self.__img=tmp
-        return meany
+        return self.moments()['my']
 
     def m2x(self):
         '''returns the second moment in x. In pixels'''
-        tmp=self.__img
-        xpixs=self.__img.shape[1] #number of x pixels (columns)
-        ypixs=self.__img.shape[0] # number of y pixels (rows)
-        self.normalize()
-        matx=tile(arange(1,xpixs+1),(ypixs,1)) #make a matrix with all rows = (1,2, .. 780)
-        x2fxy=self.__img*matx**2
-        m2x=x2fxy.sum()
-        self.__img=tmp
-        return m2x
+        return self.moments()['m2x']
 
     def m2y(self):
         '''returns the second moment in y. In pixels'''
-        tmp=self.__img
-        xpixs=self.__img.shape[1] #number of x pixels (columns)
-        ypixs=self.__img.shape[0] # number of y pixels (rows)
-        self.normalize()
-        maty=transpose(tile(arange(1,ypixs+1),(xpixs,1))) #make a matrix with all columns = (1,2, .. 780)
-        y2fxy=self.__img*maty**2
-        m2y=y2fxy.sum()
-        self.__img=tmp
-        return m2y
+        return self.moments()['m2y']
 
     def wx_d(self,in_pix=False):
         '''return the wx value calculated using the moments.'''
-        w=2*sqrt(self.m2x()-self.mx()**2)
+        w=self.moments()['wx']
         if not in_pix: w=w*self.__cal
         return w
 
     def wy_d(self,in_pix=False):
         '''returns the wy value calculated using the moments.'''
-        w=2*sqrt(self.m2y()-self.my()**2)
+        w=self.moments()['wy']
         if not in_pix: w=w*self.__cal
         return w
 
     def m(self):
         '''returns the means. In pixels'''
-        return (self.mx(),self.my())
+        mom=self.moments()
+        return (mom['mx'],mom['my'])
 
     
     def w_d(self,in_pix=False):
         '''returs the w values, using the moments.'''
-        return (self.wx_d(in_pix=in_pix), self.wy_d(in_pix=in_pix))
+        mom=self.moments()
+        w=(mom['wx'],mom['wy'])
+        if not in_pix: w=(w[0]*self.__cal,w[1]*self.__cal)
+        return w
     
     def cut(self,nw=3,size_in_pix=None):
         """ If size_in_pix=None : cut out everything but nw times the w of the beam.
@@ -513,11 +517,32 @@ class FocalScan(object):
             for im in self._stack:im.normalize()
         else:self._stack[image_number].normalize()
 
+    def moments(self):
+        '''returns the moments of all images in the stack, as a dictionary of arrays (see image_moments).
+           If all images have the same shape they are processed together as one 3D array. In pixels.
+        '''
+        if len(self._stack)==0:return image_moments(zeros((0,1,1)))
+        shapes=set(im.shape() for im in self._stack)
+        if len(shapes)==1:
+            return image_moments(array([im.export() for im in self._stack]))
+        mom=[im.moments() for im in self._stack]
+        return dict((k,array([m[k] for m in mom])) for k in mom[0])
+
     def calc_wx_d(self,clear=True,in_pix=False):
         if clear:self.clear_wx_d()
-        for im in self._stack:
-            self._wx_d[0].append(im.z())
-            self._wx_d[1].append(im.wx_d(in_pix=in_pix))
+        self._append_w_d(self.moments(),in_pix,x=True,y=False)
+
+    def _append_w_d(self,mom,in_pix,x=True,y=True):
+        '''appends z and the moment based widths to the wx/wy lists'''
+        for i,im in enumerate(self._stack):
+            if in_pix: cal=1.0
+            else: cal=im.cal()
+            if x:
+                self._wx_d[0].append(im.z())
+                self._wx_d[1].append(mom['wx'][i]*cal)
+            if y:
+                self._wy_d[0].append(im.z())
+                self._wy_d[1].append(mom['wy'][i]*cal)
 
     def show_wx_d(self,plot_fit=True):
         pyplot.plot(self._wx_d[0],self._wx_d[1])
@@ -537,13 +562,13 @@ class FocalScan(object):
 
     def calc_wy_d(self,clear=True,in_pix=False):
         if clear:self.clear_wy_d()
-        for im in self._stack:
-            self._wy_d[0].append(im.z())
-            self._wy_d[1].append(im.wy_d(in_pix=in_pix))
+        self._append_w_d(self.moments(),in_pix,x=False,y=True)
 
     def calc_w_d(self,clear=True,in_pix=False):
-        self.calc_wx_d(clear=clear,in_pix=in_pix)
-        self.calc_wy_d(clear=clear,in_pix=in_pix)
+        if clear:
+            self.clear_wx_d()
+            self.clear_wy_d()
+        self._append_w_d(self.moments(),in_pix)
 
     def show_wy_d(self,plot_fit=True):
         pyplot.plot(self._wy_d[0],self._wy_d[1])
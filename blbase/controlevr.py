@@ -1,5 +1,6 @@
 import time
 from psp import Pv
+from blutil import snapshot
 from virtualmotor import VirtualMotor
 
 
@@ -126,23 +127,39 @@ class EVRTrigger(object):
       raise Exception('No tick setting pv available, use delay method instead!')
 
   def status(self):
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    pvs = self.pvnames
+    ret = dict( (key,pvs[key]) for key in ("enable","width_rb","width_ticks_rb",
+                "delay_rb","delay_ticks_rb","eventcode_rb") )
+    ret["polarity"] = pvs.get("polarity")
+    ret["prescale"] = pvs.get("prescale")
+    return ret
+
+  def format_status(self,values):
     str  = "IOC: %s (%s)\n"   % (self.ioc,self.name)
     str += " trigger  : %d\n" % self.trigger
-    str += " enabled? : %s\n" % bool(self.isEnable())
-    p = self.polarity();
+    str += " enabled? : %s\n" % bool(values["enable"])
+    p = values["polarity"]
+    if ("polarity" not in self.pvnames):
+      p = 0
     if (p==0):
       ps = "Normal"
     else:
       ps = "Inverted"
     str += " polarity : %s (= %d)\n" % (ps,p)
-    str += " clock (freq,pres): %.7e,%d\n" % (self.clock(),self.prescale())
-    d = self.width()
-    dt = self.widthTicks()
+    prescale = values["prescale"]
+    if ("prescale" not in self.pvnames):
+      prescale = 1
+    str += " clock (freq,pres): %.7e,%d\n" % (self.__evr_clock/prescale,prescale)
+    d = values["width_rb"]/1e9
+    dt = values["width_ticks_rb"]
     str += " width (sec,tics): %.7e,%d\n" % (d,dt)
-    d = self.delay()
-    dt = self.delayTicks()
+    d = values["delay_rb"]/1e9
+    dt = values["delay_ticks_rb"]
     str += " delay (sec,tics): %.7e,%d\n" % (d,dt)
-    ec = self.eventcode()
+    ec = values["eventcode_rb"]
     str += " firing on event code: %d\n" % ec
     return str
 
@@ -174,10 +191,17 @@ class ControlEVR(object):
     self.ioc = ioc
 
 
+  def triggers(self):
+    return [self.__getattribute__("t%d" % i) for i in range(14)]
+
   def status(self,trigger=0):
     t = self.__getattribute__("t%d" % trigger)
     return t.status()
 
+  def status_all(self):
+    """ status of all triggers, read in one batch """
+    return "\n".join(snapshot.snapshot(self.triggers()))
+
   def __call__(self,trigger=0):
     t = self.__getattribute__("t%d" % trigger)
     print t.status()
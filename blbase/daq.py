@@ -1,8 +1,10 @@
 from blutil import notice, guessBeamline
 from blutil import config
+from blutil import scanstore
+from blutil import spans
 from blutil.peakanalysis import PeakAnalysis
 from blutil.plot import Plot2D
-from detectors_pyami import PYAMIdetector
+from detectors_pyami import PYAMIdetector, DetectorGroup
 import beamline
 import pydaq
 import psp.Pv as Pv
@@ -17,8 +19,15 @@ import re
 import glob
 import pyami
 import pylab
-import daqFit
+try:
+  import daqFit
+except ImportError:
+  # fitting needs minuit2
+  daqFit = None
 import socket
+import threading
+import Queue
+import traceback
 import numpy as np
 from datetime import datetime
 import xml.etree.ElementTree as ET
@@ -65,16 +74,23 @@ class Daq:
     self.record=None
     self.scan_in_ext_window=False
     self.settling_time = 0.
+    # span summary of the last scan when blutil.spans is enabled
+    self.spans = None
     self._scanlog_dir = config.scandata_directory
     self._scanlog_mode = config.scandata_mode
     if self._scanlog_mode == "append":
         self._scanlog_file = config.scandata_file
     if self._scanlog_mode not in ("append", "new_files"):
         print "WARNING: scan log files not initialized properly in config."
+    self.scanstore = config.scandata_store
+    self.__store = None
     self.__l3tdir = "/reg/neh/operator/" + guessBeamline() + "opr/l3t"
     self.__l3tdefault = os.path.join(self.__l3tdir, 'amifil.l3t')
     self.__l3tseldefault = os.path.join(self.__l3tdir, 'amisel.l3t')
-    self.fit = daqFit.Fit(self,daqFit.functions)
+    if (daqFit is not None):
+      self.fit = daqFit.Fit(self,daqFit.functions)
+    else:
+      self.fit = None
     self.lcls = lcls
     self.__averaging = False
     if feedbackPVs is None:
@@ -393,12 +409,14 @@ class Daq:
     #t0=time.time()
     ret = ""
     retv=dict()
-    if (self.__monitor is not None):
-      mon = dets[-1].get()
     try:
       if len(dets)!=0:
-        for det in dets:
-          v=det.get()
+        # read every detector in one pass so they all see the same events
+        readout = DetectorGroup(dets).collect()
+        if (self.__monitor is not None):
+          mon = readout[len(dets)-1]
+        for i,det in enumerate(dets):
+          v=readout[i]
           try:
             det.clear()
           except:
@@ -623,6 +641,7 @@ class Daq:
       return self.__daq.record()
     return False
 
+  @spans.timed("daq.calibcycle")
   def calibcycle(self,events=None,controls=[],monitors=[],use_l3t=False,use_sequencer=False):
     #t0=time.time()
     self.__npulses=events
@@ -824,13 +843,19 @@ class Daq:
     controls.append(('goback',goback))
     return controls
 
+  def __new_plot(self,plotid):
+    """ replace the scan plot, stopping the redraw timer of the old one """
+    if (self.plot is not None):
+      self.plot.close()
+    self.plot=Plot2D(plotid)
+
   def timescan(self,sec,*dets):
     """ like spec timescan """
     ## take care of the detectors
     dets=self.__check_dets(dets)
     ## get ready for plot
     plotid=self.__prepare_plot(dets)
-    self.plot=Plot2D(plotid)
+    self.__new_plot(plotid)
     self.__scanstr = "#   integration time per point: %.3f\n" % sec
     line1,line2 = self.__prepare_dets_title(dets)
     self.__scanstr += "#%5s%s\n" % ('',line1)
@@ -858,6 +883,11 @@ class Daq:
     newDAQ = opts.get("newDAQ", False)
     use_sequencer = opts.get("sequencer", False)
     extra_log_data = opts.get("log_data", None)
+    pipeline = opts.get("pipeline", False)
+    writer = None
+    self.__store = None
+    self.__store_meta = None
+    tspans = spans.mark()
 
     if self.__daq is None:
         self.connect()
@@ -930,7 +960,7 @@ class Daq:
 
         if (len(dets) != 0):
           plotid=self.__prepare_plot(dets)
-          self.plot=Plot2D(plotid)
+          self.__new_plot(plotid)
           self.plot.set_xlabel(tMot[0].name)
           if ( self.__monitor is not None ):
             self.plot.set_ylabel(dets[0].name+'/'+self.__monitor.name)
@@ -955,8 +985,19 @@ class Daq:
         for m in tMot: self.__scanstr += "%12s" % ("position")
         self.__scanstr += "%s\n" % (line2)
         print self.__scanstr,
+        if self.scanstore:
+          self.__store_meta = dict(motors=[m.name for m in tMot],
+            pvnames=[m.pvname for m in tMot], detectors=[d.name for d in dets],
+            events_per_point=events_per_point, positions=[[float(x) for x in p] for p in tPosMod],
+            beamline=guessBeamline())
+          if ( self.__monitor is not None ):
+            self.__store_meta["monitor"] = self.__monitor.name
         #snelson
         #debug = 15
+        if pipeline:
+          writer = ScanPointWriter(self.__report_point)
+        deadtimes = []
+        tend = None
         for cycle in range(len(tPos)):
           ### debug ###
           #if debug >= 15: print 'start with step', cycle
@@ -964,26 +1005,36 @@ class Daq:
           pos = tPos[cycle];
           if ( (type(pos) is not tuple) and (type(pos) is not list) ):
             pos=(pos,)
-          for i in range(len(pos)):
-            tMot[i].move_silent(pos[i])
-          for i in range(len(pos)):
-            tMot[i].wait()
+          # in pipeline mode the move was already requested after the
+          # previous calibcycle
+          with spans.span("scan.move"):
+            if not pipeline or cycle == 0:
+              for i in range(len(pos)):
+                tMot[i].move_silent(pos[i])
+            motor.wait_all(tMot[:len(pos)])
           sys.stdout.flush()
           if (self.settling_time != 0):
-            time.sleep(self.settling_time)
+            with spans.span("scan.settle"):
+              time.sleep(self.settling_time)
           if (config.TIMEIT>0):
             print "time needed for moving and settling %.3f" % (time.time()-t0cycle)
           ### debug ###
           if debug >= 15: print 'start to average the detectors, appended to controls', cycle
-          self.__start_av(dets)
+          with spans.span("scan.start_av"):
+            self.__start_av(dets)
           if debug >= 15: print 'started to average the detectors, appended to controls', cycle
-          time.sleep(0.05); # to make sure readback is uptodate (20ms)
-          controls=[]
-          for m in tMot:
-            controls.append( (m.name,m.wm()) )
+          with spans.span("scan.readback"):
+            if not pipeline:
+              time.sleep(0.05); # to make sure readback is uptodate (20ms)
+            controls=[]
+            for m in tMot:
+              controls.append( (m.name,m.wm()) )
           #print "calibcycle, controls=%s" % controls
           ### debug ###
           if debug >= 15: print 'begin cycle', cycle
+          if tend is not None:
+            deadtimes.append(time.time()-tend)
+          tacq = time.time()
           if shotsmovingmotor is not None:
             self.begin(events=events_per_point,controls=controls, use_l3t=use_l3t)
             self.takeshots_runningMotor(shotmot,shotmotint,events_per_point,goback=shotmotgoback)
@@ -994,43 +1045,48 @@ class Daq:
             self.wait()
           else:
             self.calibcycle( events_per_point, controls=controls, use_l3t=use_l3t, use_sequencer=use_sequencer )
+          tend = time.time()
+          spans.add("scan.acquire",tacq,tend-tacq)
           ### debug ###
           #if debug >= 15: print 'daq cycle', cycle, 'ended'
-          ret = self.__stop_av(dets)
+          positions = [m.wm() for m in tMot]
+          if pipeline and cycle+1 < len(tPos):
+            # stage the next move while this point is read out and logged
+            nextpos = tPos[cycle+1]
+            if ( (type(nextpos) is not tuple) and (type(nextpos) is not list) ):
+              nextpos=(nextpos,)
+            for i in range(len(nextpos)):
+              tMot[i].move_silent(nextpos[i])
+          with spans.span("scan.stop_av"):
+            ret = self.__stop_av(dets)
           ### debug ###
           #if debug >= 15: print 'get detector information for cycle:', cycle
-          ostr = "%7d" % (cycle+1)
-          ### debug ###
-          #if debug >= 15: print 'print cycle for motor string:', cycle
-          for m in tMot:
-            ### debug ###
-            #if debug >= 15: print 'motor', m.pvname
-            ostr+="|%12.5e" % (m.wm())
-          ### debug ###
-          #if debug >= 15: 'print motor pos for motor string:', cycle
-          ostr += "%s" % (ret[0])
-          ### debug ###
-          #if debug >= 15: 'appended stuff to motor string in cycle', cycle
-          print ostr
-          sys.stdout.flush()
-          self.__scanstr+="%s\n" % ostr
-          #t0plots=time.time()
-          ### debug ###
-          #if debug >= 15: print 'now update plot in cycle', cycle
-          if ( len(dets) != 0 ):
-            self.__x.append(pos[0])
-            if ( cycle>1 ):
-              self.plot.setdata(self.__x,self.__y[dets[0]])
-          #if (config.TIMEIT>0):
-          #  print "time needed for updating plot %.3f" % (time.time()-t0plots)
+          if pipeline:
+            writer.put(cycle,pos,positions,ret,dets)
+            # the writer thread cannot draw, redraw from here when due
+            if (len(dets) != 0):
+              self.plot.update()
+          else:
+            self.__report_point(cycle,pos,positions,ret,dets)
           #if (config.TIMEIT>0):
           #  print "time needed for complete scan point %.3f" % (time.time()-t0cycle)
           ### debug ###
           #if debug >= 15: print 'now update istep PV in', cycle
           iStep+=1
-          self.write_feedback_step_pvs(iStep)
+          with spans.span("scan.feedback"):
+            self.write_feedback_step_pvs(iStep)
+          spans.add("scan.point",t0cycle,time.time()-t0cycle)
           ### debug ###
           #if debug >= 15: 'done with step', cycle
+        if pipeline:
+          writer.close()
+          writer = None
+        if (len(dets) != 0):
+          self.plot.close()
+        if len(deadtimes) > 0:
+          dead = "#   dead time per point (s): mean %.3f, max %.3f\n" % (np.mean(deadtimes),np.max(deadtimes))
+          self.__scanstr+=dead
+          print dead,
         runn = "#   run number (0 = not saved): %d\n" % self.runnumber()
         self.__scanstr+=runn
         print runn
@@ -1040,22 +1096,98 @@ class Daq:
           #print " ... done"
           #pass
     finally:
+      if writer is not None:
+        writer.close()
       endtime = "# End time: %s\n" % self.getArchiverTimestamp()
       self.__scanstr += endtime
-      self.savelog()
+      with spans.span("scan.savelog"):
+        self.savelog()
+      self.__close_store()
       self.endrun()
+      if spans.enabled:
+        self.spans = spans.summary(since=tspans)
+        print spans.table(since=tspans),
 
-  def savelog(self):
+  @spans.timed("scan.report")
+  def __report_point(self,cycle,pos,positions,ret,dets):
+    """
+    Print and log one finished scan point and update the plot.
+    """
+    ostr = "%7d" % (cycle+1)
+    for p in positions:
+      ostr+="|%12.5e" % (p)
+    ostr += "%s" % (ret[0])
+    print ostr
+    sys.stdout.flush()
+    self.__scanstr+="%s\n" % ostr
+    self.__store_point(cycle,positions,ret[1],dets)
+    if ( len(dets) != 0 ):
+      self.__x.append(pos[0])
+      # the scan loop may already have appended the next point to __y
+      self.plot.append(pos[0],self.__y[dets[0]][len(self.__x)-1])
+
+  def __scanlog_name(self, ext=".dat"):
+    """
+    Name of the scan log file of the current scan, with extension ext.
+    """
     folder = self._scanlog_dir
     if self._scanlog_mode == "append":
-      self.savetxt(folder + self._scanlog_file, "a")
+      return folder + os.path.splitext(self._scanlog_file)[0] + ext
     elif self._scanlog_mode == "new_files":
       t = self.starttime
-      filename = "%04d-%02d-%02d_%02dh%02dm%02ds_run%04d.dat" % (t.year, t.month, t.day, t.hour, t.minute, t.second, self.runnumber())
-      self.savetxt(folder + filename, "w")
+      return folder + "%04d-%02d-%02d_%02dh%02dm%02ds_run%04d%s" % (t.year, t.month, t.day, t.hour, t.minute, t.second, self.runnumber(), ext)
+    return None
+
+  def savelog(self):
+    if self._scanlog_mode == "append":
+      self.savetxt(self._scanlog_dir + self._scanlog_file, "a")
+    elif self._scanlog_mode == "new_files":
+      self.savetxt(self.__scanlog_name(), "w")
     else:
       print "No valid option for scan logging found. Skipping save..."
 
+  @spans.timed("scan.store")
+  def __store_point(self,cycle,positions,retv,dets):
+    """
+    Append one scan point to the binary scan store, opening it on the first
+    point (when the run number is known). A failing store only disables
+    itself, the scan goes on.
+    """
+    if self.__store_meta is None:
+      return
+    try:
+      if self.__store is None:
+        columns = ["point"] + self.__store_meta["motors"]
+        for det in dets:
+          columns += [det.name, det.name+"_err"]
+        columns += ["pulses"]
+        meta = dict(self.__store_meta, run=self.runnumber(),
+                    start_time=time.mktime(self.starttime.timetuple()))
+        self.__store = scanstore.ScanWriter(self.__scanlog_name(scanstore.default_ext()), columns, meta)
+      row = [cycle+1] + list(positions)
+      for det in dets:
+        v = retv.get(det, {})
+        row += [v.get("mean", np.nan), v.get("err", np.nan)]
+      try:
+        row.append(float(retv[dets[-1]]["entries"])/self.__npulses*100)
+      except:
+        row.append(np.nan)
+      self.__store.append(row)
+    except Exception, exc:
+      print "Error writing scan store, disabled for this scan: {0}".format(exc)
+      self.__store_meta = None
+
+  def __close_store(self):
+    if self.__store is None:
+      return
+    try:
+      self.__store.close(run=self.runnumber())
+      print "#   scan data stored in %s (%s)" % (self.__store.path, self.__store.scan)
+    except Exception, exc:
+      print "Error closing scan store: {0}".format(exc)
+    self.__store = None
+    self.__store_meta = None
+
   def scan_data(self, index):
     return self.__y[self.__dets[index]]
   
@@ -1126,7 +1258,10 @@ class Daq:
     self.readout_checks = ['EpicsArch', 'BldEb'] 
 
   def ascan(self,mot,a,b,points,events_per_point,*dets,**opts):
-    """ Scan the motor from a to b (in user coordinates) """ 
+    """ Scan the motor from a to b (in user coordinates)
+        pipeline=True moves to the next point while the previous one is
+        read out; printing and plotting are done in a background thread.
+        This option works for all ascan/a2scan/mesh variants. """ 
     ## take care of the detectors
     dets=self.__check_dets(dets)
     ## take care of the motor first
@@ -1472,6 +1607,41 @@ class Daq:
     os.system('/reg/neh/operator/' + guessBeamline() + 'opr/bin/' +
               guessBeamline() + '_cleanup_windows_daq')
 
+  def loadscan(self,*args,**kw):
+    """
+    Reads scandata saved in the binary scan store, returns (data,meta):
+    a structured array with one field per column and the metadata dict.
+    The argument can either be the store name, a runnumber, or a negative
+    number defining -x scans ago (last saved scan would be -1).
+    With several scans in one store (append mode) scan=n picks one of them,
+    by default the last. mmap=True maps the data instead of reading it.
+    """
+    farg=args[0]
+    ext = scanstore.default_ext()
+    if type(farg)==str:
+      fina=farg
+    elif self._scanlog_mode == "append":
+      fina = self._scanlog_dir + os.path.splitext(self._scanlog_file)[0] + ext
+    else:
+      flist = glob.glob(self._scanlog_dir + '*' + ext)
+      flist.sort()
+      runs = []
+      for file in flist:
+        runs.append(int(file.split('_run')[1].split(ext)[0]))
+      if farg>=0:
+        fina = flist[runs.index(farg)]
+      elif farg<0:
+        fina = flist[farg]
+    scan = kw.get("scan", -1)
+    if type(farg)!=str and self._scanlog_mode == "append":
+      if farg<0:
+        scan = farg
+      else:
+        scans = scanstore.list_scans(fina)
+        runs = [scanstore.read_meta(fina,name).get("run") for name in scans]
+        scan = scans[len(runs)-1-runs[::-1].index(farg)]
+    return scanstore.read_scan(fina, scan, mmap=kw.get("mmap", False))
+
   def loadtxt(self,*args):
     """
     Reads scandata saved py savetxt (NB: daq.py version, not numpy).
@@ -1544,7 +1714,7 @@ class Daq:
     """Plot previous Run"""
     [data,mot,det] = self.loadDaqDat(run)
     plotid=1
-    self.plot=Plot2D(plotid)
+    self.__new_plot(plotid)
     try:
       self.plot.set_xlabel(mot[0])
     except:
@@ -1570,7 +1740,7 @@ class Daq:
       x = np.arange(nPoints)
       y = np.ones(np.shape(x))
     plotid=1
-    self.plot=Plot2D(plotid)
+    self.__new_plot(plotid)
     self.plot.setdata(x,np.random.randn(len(y))*np.std(y)+np.mean(y))
     try:
       self.__x = data[:,1]
@@ -1662,6 +1832,38 @@ class Daq:
 
 ######################################################################
     
+class ScanPointWriter(object):
+  """
+  Background thread that prints, logs and plots finished scan points so the
+  scan loop can go on to the next point. Points are handled in order.
+  """
+  def __init__(self, report):
+    self._report = report
+    self._queue = Queue.Queue()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, *args):
+    self._queue.put(args)
+
+  def _run(self):
+    while True:
+      args = self._queue.get()
+      if args is None:
+        return
+      try:
+        self._report(*args)
+      except Exception:
+        traceback.print_exc()
+
+  def close(self):
+    """
+    Wait until every queued point has been reported.
+    """
+    self._queue.put(None)
+    self._thread.join()
+
 class EpicsFeedback(object):
   def __init__(self,feedbackPVs):
     """
@@ -11,6 +11,7 @@ import pyami
 import numpy
 from numpy import nan,array,sqrt,isfinite
 from blutil.pypslog import logprint
+from blutil import spans
 from time import sleep
 import thread
 
@@ -82,6 +83,7 @@ class PYAMIdetector:
       print "PYAMI: creating initial entry for %s" % self.name
       self.create_ami(type)
 
+  @spans.timed("pyami.get")
   def get(self):
     self.connect(self.__filter_string)
     if (self.type == "Scalar"):
@@ -91,6 +93,7 @@ class PYAMIdetector:
     else:
       print 'detector type unsupported'
 
+  @spans.timed("pyami.getScalar")
   def getScalar(self):
     if (self.pyamiE is None):
       x={}
@@ -111,6 +114,7 @@ class PYAMIdetector:
         x["err"] = numpy.nan
     return x
 
+  @spans.timed("pyami.getImage")
   def getImage(self):
     x={}
     x["entries"]=0
@@ -186,10 +190,11 @@ class PYAMIdetector:
     print 'times: ',times
     return x
 
+  @spans.timed("pyami.getmean")
   def getmean(self,int_time=None):
     self.connect(self.__filter_string)
     if (self.type == "Scalar"):
-      return self.getmeanScalar()
+      return self.getmeanScalar(int_time)
     else:
       print 'detector type unsupported'
 
@@ -205,6 +210,76 @@ class PYAMIdetector:
 
   def clear(self):
     self.pyamiE.clear()
+
+  def reconnect(self):
+    """Make sure the entry exists, keeping the current filter"""
+    self.connect(self.__filter_string)
+
+
+class Readout:
+  """Scalar readout of a group of detectors over one integration window.
+  mean, rms, err and entries are arrays with one value per detector;
+  readout[name] gives the usual dict of a single detector."""
+  def __init__(self,names,values):
+    self.names   = list(names)
+    self.mean    = array([v["mean"] for v in values],dtype=float)
+    self.rms     = array([v["rms"] for v in values],dtype=float)
+    self.err     = array([v["err"] for v in values],dtype=float)
+    self.entries = array([v["entries"] for v in values],dtype=int)
+
+  def __len__(self):
+    return len(self.names)
+
+  def __getitem__(self,name):
+    """dict of one detector, by name or by position"""
+    if isinstance(name,int):
+      i = name
+    else:
+      i = self.names.index(name)
+    return dict(mean=float(self.mean[i]),rms=float(self.rms[i]),err=float(self.err[i]),entries=int(self.entries[i]))
+
+  def __repr__(self):
+    s = " %-20s %11s %11s %8s\n" % ("channel","mean","rms","N")
+    for i,name in enumerate(self.names):
+      s += " %-20s %+11.4e %11.4e %8d\n" % (name,self.mean[i],self.rms[i],self.entries[i])
+    return s
+
+
+class DetectorGroup:
+  """Reads several scalar detectors together: all entries are cleared at
+  once and collected after a single integration window, instead of one
+  window per channel. Accepts PYAMIdetectors and devices with a channels
+  list (IPIMBDetector, Wave8Detector, ...), or a mix of them."""
+  def __init__(self,dets):
+    self.dets = []
+    for det in dets:
+      self.dets.extend(getattr(det,"channels",[det]))
+
+  def start(self):
+    """Create missing entries and clear all of them"""
+    for det in self.dets:
+      det.reconnect()
+    for det in self.dets:
+      if (det.pyamiE is not None):
+        try:
+          det.clear()
+        except RuntimeError:
+          pass
+
+  @spans.timed("pyami.group_collect")
+  def collect(self):
+    """Get every channel accumulated since start"""
+    return Readout([det.name for det in self.dets],[det.getScalar() for det in self.dets])
+
+  def read(self,int_time=0.3):
+    self.start()
+    sleep(int_time)
+    return self.collect()
+
+def readout(dets,int_time=0.3):
+  """Read a list of detectors and/or multi channel devices in a single
+  integration window of int_time seconds"""
+  return DetectorGroup(dets).read(int_time)
       
 class IPIMBDetector:
   """A simple class to handle Pv based detectors"""
@@ -220,19 +295,26 @@ class IPIMBDetector:
     self.sum  = PYAMIdetector( aminame + ":SUM" ,namebase+".sum")
     self.xpos = PYAMIdetector( aminame + ":XPOS",namebase+".xpos")
     self.ypos = PYAMIdetector( aminame + ":YPOS",namebase+".ypos")
+    self.channels = [self.sum,self.xpos,self.ypos,self.ch0,self.ch1,self.ch2,self.ch3]
 
   def __repr__(self):
     return self.status()
 
+  def read(self,int_time=0.3):
+    """Read all channels in one integration window"""
+    return DetectorGroup([self]).read(int_time)
+
   def status(self):
     str=""
     if (self.__kind=="ipm"):
+      m = self.read(0.3).mean
       str  = " %10s %6s %6s %10s %10s %10s %10s\n" % ("sum", "xpos","ypos","ch0(up)","ch1(north)","ch2(down)","ch3(south)")
-      str += "  %+10.3e %+6.3f %+6.3f " % ( self.sum.getmean(0.3),self.xpos.getmean(0.3),self.ypos.getmean(0.3) )
-      str += "%10.3e %10.3e %10.3e %10.3e\n" % ( self.ch0.getmean(0.3),self.ch1.getmean(0.3),self.ch2.getmean(0.3),self.ch3.getmean(0.3) )
+      str += "  %+10.3e %+6.3f %+6.3f " % tuple(m[0:3])
+      str += "%10.3e %10.3e %10.3e %10.3e\n" % tuple(m[3:7])
     if (self.__kind=="pim"):
+      m = DetectorGroup(self.channels[3:]).read(0.3).mean
       str  = " %10s %10s %10s %10s\n" % ("ch0(up)","ch1(north)","ch2(down)","ch3(south)")
-      str += "%10.3e %10.3e %10.3e %10.3e\n" % ( self.ch0.getmean(0.3),self.ch1.getmean(0.3),self.ch2.getmean(0.3),self.ch3.getmean(0.3) )
+      str += "%10.3e %10.3e %10.3e %10.3e\n" % tuple(m)
     return str
 
 #this should be rewritten: not necesarily do we run with all channels (or more than 1-2).
@@ -263,6 +345,7 @@ class ADCDetector:
       self.ch13  = PYAMIdetector( aminame + ":CH13" ,namebase+".ch13" )
       self.ch14  = PYAMIdetector( aminame + ":CH14" ,namebase+".ch14" )
       self.ch15  = PYAMIdetector( aminame + ":CH15" ,namebase+".ch15" )
+    self.channels = [getattr(self,"ch%d"%i) for i in range(16) if hasattr(self,"ch%d"%i)]
 
 
   def __repr__(self):
@@ -271,10 +354,9 @@ class ADCDetector:
   def status(self):
     str=""
     if (self.__kind=="slowAdc"):
-#      str  = " %10s %10s %10s %10s %10s\n" % ("ch0", "ch1","ch2","ch3","ch4")
-#      str += " %10.3e %10.3e %10.3e %10.3e %10.3e\n" % ( self.ch0.getmean(0.3),self.ch1.getmean(0.3),self.ch2.getmean(0.3),self.ch3.getmean(0.3),self.ch4.getmean(0.3) )
-      str  = " %10s %10s %10s %10s %10s\n" % ("ch0", "ch1","ch2")
-      str += " %10.3e %10.3e %10.3e %10.3e %10.3e\n" % ( self.ch0.getmean(0.3),self.ch1.getmean(0.3),self.ch2.getmean(0.3)  )
+      m = DetectorGroup([self]).read(0.3).mean
+      str  = " %10s %10s %10s\n" % ("ch0", "ch1","ch2")
+      str += " %10.3e %10.3e %10.3e\n" % tuple(m)
     return str
 
 
@@ -288,6 +370,7 @@ class EncoderDetector:
     self.ch1  = PYAMIdetector( aminame + ":CH1" ,namebase+".ch1" )
     self.ch2  = PYAMIdetector( aminame + ":CH2" ,namebase+".ch2" )
     self.ch3  = PYAMIdetector( aminame + ":CH3" ,namebase+".ch3" )
+    self.channels = [self.ch0,self.ch1,self.ch2,self.ch3]
 
   def __repr__(self):
     return self.status()
@@ -295,8 +378,9 @@ class EncoderDetector:
   def status(self):
     str=""
     if (self.__kind=="enc"):
-      str  = " %10s %10s %10s %10s %10s\n" % ("ch0", "ch1","ch2","ch3")
-      str += " %10.3e %10.3e %10.3e %10.3e %10.3e\n" % ( self.ch0.getmean(0.3),self.ch1.getmean(0.3),self.ch2.getmean(0.3),self.ch3.getmean(0.3))
+      m = DetectorGroup([self]).read(0.3).mean
+      str  = " %10s %10s %10s %10s\n" % ("ch0", "ch1","ch2","ch3")
+      str += " %10.3e %10.3e %10.3e %10.3e\n" % tuple(m)
     return str
 
 class Wave8Detector:
@@ -334,12 +418,21 @@ class Wave8Detector:
       self.sum  = PYAMIdetector( aminame + ":SUM"  ,namebase+".sum" )
       self.xpos = PYAMIdetector( aminame + ":XPOS" ,namebase+".xpos" )
       self.ypos = PYAMIdetector( aminame + ":yPOS" ,namebase+".ypos" )
+    self.channels = [getattr(self,"ch%d"%i) for i in range(16)]
 
   def __repr__(self):
     return self.status()
 
+  def read(self,int_time=0.3):
+    """Read all 16 channels in one integration window"""
+    return DetectorGroup([self]).read(int_time)
+
   def status(self):
     str=""
     if (self.__kind.find("snd")>=0):
-      str="status printout not yet defined."
+      m = self.read(0.3).mean
+      str  = " %10s"*8 % tuple("ch%d"%i for i in range(8)) + "\n"
+      str += " %10.3e"*8 % tuple(m[:8]) + "\n"
+      str += " %10s"*8 % tuple("ch%d"%i for i in range(8,16)) + "\n"
+      str += " %10.3e"*8 % tuple(m[8:]) + "\n"
     return str
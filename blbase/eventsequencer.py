@@ -1,9 +1,10 @@
-from time  import sleep
+from time  import sleep, time
 from numpy import floor_divide
 from functools import wraps
-from threading import Event
+from threading import Event, Condition
 from psp import Pv
 from blutil import guessBeamline, doctools
+from blutil.threadtools import PycaThread
 
 hutch_dict = dict(
 amo=1,
@@ -44,6 +45,7 @@ class EventSequencer(object):
     self.__beamrate="EVNT:SYS0:1:LCLSBEAMRATE"
     self.define_pvnames()
     self.dictRateToSyncMarker = {0.5:0, 1:1, 5:2, 10:3, 30:4, 60:5, 120:6, 360:7, 0:6}
+    self.dictSyncMarkerToRate = dict((m, r) for r, m in self.dictRateToSyncMarker.items() if r != 0)
 
     self.maxEventCount = 2048
     self.__ec = [0] * self.maxEventCount
@@ -51,8 +53,11 @@ class EventSequencer(object):
     self.__fd = [0] * self.maxEventCount
     self.__bc = [0] * self.maxEventCount
     self.__ns = 0
+    self.__codemap = None
+    self.__total_count = 0
 
     self._init_update_cb()
+    self._init_monitors()
 
   def define_pvnames(self):
     ioc = self.iocbase
@@ -97,11 +102,12 @@ class EventSequencer(object):
 
   def getSyncMarker(self):
     val = Pv.get(self.__pv_syncmarker)
-    return self.dictRateToSyncMarker.keys()[self.dictRateToSyncMarker.values().index(val)]
+    return self.dictSyncMarkerToRate[val]
 
   @if_owner
   def setnsteps(self,nsteps):
     self.__ns = nsteps
+    self.__codemap = None
     Pv.put(self.__pv_nsteps,nsteps)  
 
   def getnsteps(self, internal=False):
@@ -138,6 +144,7 @@ class EventSequencer(object):
     self.__bc[stepn] = delta
 
   def setstep(self, stepn, beamcode, deltabeam, fiducial=0, burst=0, comment="", verbose=False):
+    self.__codemap = None
     if (verbose):
       print "Setting step #%d to beamcode %d, beam delay %d, fid %d, burst %d" % (stepn,beamcode,deltabeam,fiducial,burst)
     self.__beamcode_at_step     (stepn,beamcode)
@@ -199,46 +206,151 @@ class EventSequencer(object):
     else:
       return ret
 
-  def wait(self,verbose=False):
+  def _init_monitors(self):
+    """
+    Keep monitored PVs for the play status and counters and for the
+    sequence arrays, so wait and update don't need a CA round trip per check.
+    """
+    self._cond = Condition()
+    self._updates = 0
+    self._mon = {}
+    names = dict(playstatus=self.__pv_playstatus, playcount=self.__pv_playcount,
+                 total_count=self.__pv_total_count, ec=self.__pv_EC_array,
+                 bd=self.__pv_BD_array, fd=self.__pv_FD_array,
+                 bc=self.__pv_BC_array)
+    for key, pvname in names.items():
+      try:
+        pv = Pv.Pv(pvname, initialize=True, monitor=True)
+        pv.add_monitor_callback(self._monitor_cb)
+        self._mon[key] = pv
+      except Exception, exc:
+        print "EventSequencer: could not monitor %s: %s" % (pvname, exc)
+
+  def _monitor_cb(self, e=None):
+    if e is None:
+      with self._cond:
+        self._updates += 1
+        self._cond.notify_all()
+
+  def _value(self, key, pvname):
+    """
+    Latest value of a monitored PV, or a fresh get if it is not connected.
+    """
+    pv = self._mon.get(key)
+    if pv is not None and pv.isinitialized:
+      return pv.value
+    return Pv.get(pvname)
+
+  def _wait_until(self, done, timeout=None, progress=None):
+    """
+    Wait until done() is True, re-checking whenever a monitor fires.
+    progress() is called after every check. Returns False on timeout.
+    done() and progress() run without the lock held, since they may fall
+    back to a blocking get while the monitor callbacks need the lock.
+    """
+    deadline = None if timeout is None else time() + timeout
+    while True:
+      with self._cond:
+        seen = self._updates
+      if done():
+        return True
+      if progress is not None:
+        progress()
+      if deadline is None:
+        remaining = 0.1
+      else:
+        remaining = deadline - time()
+        if remaining <= 0:
+          return False
+      with self._cond:
+        # skip the wait if a monitor fired while we were checking
+        if self._updates == seen:
+          # the short cap only matters if a monitor is not connected
+          self._cond.wait(min(remaining, 0.1))
+
+  def wait(self,verbose=False,timeout=None,progress=None):
+    """
+    Wait for the sequence to finish playing. progress(n, ntodo) is called
+    with the play count each time it changes. Returns False on timeout.
+    """
     sleep(0.01)
     mode = self.getmode()
     if (mode  == "Repeat N Times"):
       ntodo  = self.__getnrepeats_to_do()
-      while ( (Pv.get(self.__pv_playstatus) != 0) or (Pv.get(self.__pv_total_count) < ntodo) ):
-        n = self.__getnpulses_in_play()
-        if (verbose):
-          print "running (%d of %d) ...\r" % (n,ntodo)
-        sleep(0.01)
-      n = self.__getnpulses_in_play()
-      if (verbose): print "done (%d) ...\r" % n
-      return
+      def done():
+        return ( (self._value("playstatus", self.__pv_playstatus) == 0) and
+                 (self._value("total_count", self.__pv_total_count) >= ntodo) )
     elif (mode == "Once"):
       ntodo = 1
-      while ( (Pv.get(self.__pv_playstatus) != 0) or (Pv.get(self.__pv_total_count) != self.__total_count+1) ):
+      def done():
+        return ( (self._value("playstatus", self.__pv_playstatus) == 0) and
+                 (self._value("total_count", self.__pv_total_count) >= self.__total_count+1) )
+    else:
+      return True
+    last = [None]
+    def report():
+      n = self._value("playcount", self.__pv_playcount)
+      if n != last[0]:
+        last[0] = n
         if (verbose):
-          print "running (%d) ...\r" % (ntodo)
-        sleep(0.01)
-      n = self.__getnpulses_in_play()
-      if (verbose): print "done (%d) ...\r" % n
-      return
+          print "running (%d of %d) ...\r" % (n,ntodo)
+        if progress is not None:
+          progress(n, ntodo)
+    ok = self._wait_until(done, timeout, report)
+    n = self.__getnpulses_in_play()
+    if (verbose): print "done (%d) ...\r" % n
+    return ok
+
+  def codemap(self):
+    """
+    Return (forward, reverse) for the current internal sequence: forward
+    is the list of event codes per step, reverse is a dict of event code
+    to the list of steps using it. Cached until the sequence is changed.
+    """
+    if self.__codemap is None:
+      forward = list(self.__ec[:self.__ns])
+      reverse = {}
+      for step, code in enumerate(forward):
+        reverse.setdefault(code, []).append(step)
+      self.__codemap = (forward, reverse)
+    return self.__codemap
+
+  def steps_with_code(self, eventcode):
+    """
+    Return the list of steps that fire eventcode.
+    """
+    return self.codemap()[1].get(eventcode, [])
 
   @if_owner
-  def update(self, wait=False):
+  def update(self, wait=False, timeout=1):
     # notify the machine EVG of the changes
-    ec = tuple(map(int,self.__ec))
-    bd = tuple(map(int,self.__bd))
-    fd = tuple(map(int,self.__fd))
-    bc = tuple(map(int,self.__bc))
-
-    Pv.put(self.__pv_EC_array, ec)
-    Pv.put(self.__pv_BD_array, bd)
-    Pv.put(self.__pv_FD_array, fd)
-    Pv.put(self.__pv_BC_array, bc)
-
-    Pv.wait_for_value(self.__pv_EC_array, ec, timeout=1)
-    Pv.wait_for_value(self.__pv_BD_array, bd, timeout=1)
-    Pv.wait_for_value(self.__pv_FD_array, fd, timeout=1)
-    Pv.wait_for_value(self.__pv_BC_array, bc, timeout=1)
+    arrays = dict(
+      ec=(self.__pv_EC_array, tuple(map(int,self.__ec))),
+      bd=(self.__pv_BD_array, tuple(map(int,self.__bd))),
+      fd=(self.__pv_FD_array, tuple(map(int,self.__fd))),
+      bc=(self.__pv_BC_array, tuple(map(int,self.__bc))),
+    )
+
+    # put the four arrays at the same time
+    threads = [PycaThread(target=Pv.put, args=(pvname, value))
+               for pvname, value in arrays.values()]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    # one combined check that all four read back
+    def done():
+      for key, (pvname, value) in arrays.items():
+        current = self._value(key, pvname)
+        try:
+          if tuple(map(int, current)) != value:
+            return False
+        except TypeError:
+          return False
+      return True
+    if not self._wait_until(done, timeout):
+      print "WARNING: sequence arrays did not read back within %s s" % timeout
 
     if wait:
       self.reset_update_cb()
@@ -1,14 +1,114 @@
 import os
+import time
+import threading
+import numpy as np
 import psp.Pv as Pv
 import subprocess
 from time import sleep
 
+CONNECT_TIMEOUT = 5.0
+
+
+class ImageRing(object):
+    """
+    Fixed size ring buffer of camera frames. put() copies a frame into the
+    next slot with its time stamp and areaDetector unique id; gaps in the
+    ids are counted as dropped frames.
+    """
+    def __init__(self, shape, size=16, dtype=np.uint16):
+        self.size = size
+        self.shape = tuple(shape)
+        self.frames = np.zeros((size,) + self.shape, dtype=dtype)
+        self.times = np.zeros(size)
+        self.ids = np.zeros(size, dtype=np.int64)
+        self.cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self.cond:
+            self.count = 0
+            self.dropped = 0
+            self.t0 = time.time()
+            self.__last_id = None
+
+    def put(self, data, uid=None, t=None):
+        npix = self.frames[0].size
+        data = np.asarray(data).ravel()[:npix]
+        with self.cond:
+            i = self.count % self.size
+            self.frames[i].flat[:len(data)] = data
+            self.times[i] = time.time() if t is None else t
+            if uid is not None:
+                self.ids[i] = uid
+                if self.__last_id is not None and uid > self.__last_id + 1:
+                    self.dropped += uid - self.__last_id - 1
+                self.__last_id = uid
+            else:
+                self.ids[i] = self.count
+            self.count += 1
+            self.cond.notify_all()
+
+    def wait(self, count, timeout=None):
+        """
+        Wait until count frames have been put in total. Returns True if
+        they were.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.count < count:
+                if deadline is None:
+                    self.cond.wait(1.0)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+        return True
+
+    def latest(self, n=1):
+        """
+        Copies of the last n frames, oldest first: (frames, times, ids).
+        """
+        with self.cond:
+            n = min(n, self.count, self.size)
+            idx = [(self.count - n + k) % self.size for k in range(n)]
+            return self.frames[idx].copy(), self.times[idx].copy(), self.ids[idx].copy()
+
+    def rate(self):
+        """
+        Achieved frame rate over the frames in the buffer.
+        """
+        with self.cond:
+            n = min(self.count, self.size)
+            if n < 2:
+                return 0.
+            first = self.times[(self.count - n) % self.size]
+            last = self.times[(self.count - 1) % self.size]
+        if last <= first:
+            return 0.
+        return (n - 1) / (last - first)
+
+    def stats(self):
+        with self.cond:
+            count = self.count
+            dropped = self.dropped
+            elapsed = time.time() - self.t0
+        return dict(frames=count, dropped=dropped, rate=self.rate(),
+                    mean_rate=count / elapsed if elapsed > 0 else 0.)
+
+
 class GigeCam(object):
-    def __init__(self, pvname, path=None, filename=None, fileformat=None, filenum=None, plugin='JPEG1'):
+    def __init__(self, pvname, path=None, filename=None, fileformat=None, filenum=None, plugin='JPEG1',
+                 image_plugin='IMAGE1', timeout=CONNECT_TIMEOUT):
         self.pvname = pvname
         self.__plugin = plugin
+        self.__image_plugin = image_plugin
         self._next_filenum = -1
         self.__lstr_pv_limit = 256
+        self.__pvs = []
+        self.__conn_cond = threading.Condition()
+        self.__stream_pvs = None
+        self.ring = None
         self.__enable          = self.__create_pv('EnableCallbacks', is_str=True)
         self.__array_port      = self.__create_pv('NDArrayPort')
         self.__array_port_rbv  = self.__create_pv('NDArrayPort_RBV')
@@ -56,6 +156,7 @@ class GigeCam(object):
         self.__roi_min_y       = self.__create_pv('MinY', is_plugin_pv=False)
         self.__roi_size_x      = self.__create_pv('SizeX', is_plugin_pv=False)
         self.__roi_size_y      = self.__create_pv('SizeY', is_plugin_pv=False)
+        self.__connect_all(timeout)
         # initialize PVs with passed parameters
         if path is not None:
             self.put_str(self.__filepath, path)
@@ -68,34 +169,115 @@ class GigeCam(object):
         
 
     def __create_pv(self, name, is_str=False, monitor=False, is_plugin_pv=True):
+        """
+        Create a PV and start connecting it; __connect_all waits for them.
+        """
         if is_plugin_pv:
             pv = Pv.Pv('%s:%s:%s'%(self.pvname, self.__plugin, name),
-                       initialize=True, monitor=monitor)
+                       monitor=monitor)
         else:
             pv = Pv.Pv('%s:%s'%(self.pvname, name),
-                       initialize=True, monitor=monitor)
+                       monitor=monitor)
         if is_str:
             pv.set_string_enum(True)
+        self.__connect_start(pv)
         return pv
 
+    def __connect_start(self, pv):
+        def conn_cb(isconnected=True):
+            with self.__conn_cond:
+                self.__conn_cond.notify()
+        pv.add_connection_callback(conn_cb)
+        pv.do_initialize = True
+        pv.connect()
+        self.__pvs.append(pv)
+
+    def __connect_all(self, timeout, pvs=None):
+        """
+        Wait for all PVs created so far on one deadline of timeout seconds.
+        Returns the names of the PVs that did not connect.
+        """
+        if pvs is None:
+            pvs = self.__pvs
+        deadline = time.time() + timeout
+        with self.__conn_cond:
+            while not all(pv.isconnected for pv in pvs):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__conn_cond.wait(remaining)
+        missing = [pv.name for pv in pvs if not pv.isconnected]
+        if missing:
+            print "WARNING: %d PVs of %s did not connect: %s" % (len(missing), self.pvname, ", ".join(missing))
+        return missing
+
     def put(self, param, val):
         param.put(val)
 
     def put_str(self, param, val):
-        char_arr = [0] * self.__lstr_pv_limit
-        for i, char in enumerate(val):
-            if i >= self.__lstr_pv_limit:
-                raise ValueError('string exceeds max length of %d characters' % self.__lstr_pv_limit)
-            char_arr[i] = ord(char)
-        param.put(tuple(char_arr))
+        char_arr = encode_lstr(val, self.__lstr_pv_limit)
+        param.put(tuple(char_arr.tolist()))
 
     def get(self, param):
         return param.get()
 
     def get_str(self, param):
-        byte_array = self.get(param)
-        char_array = [ chr(char_val) for char_val in byte_array if char_val != 0 ]
-        return ''.join(char_array)
+        return decode_lstr(self.get(param))
+
+    def start_stream(self, size=16, timeout=CONNECT_TIMEOUT):
+        """
+        Subscribe to the ArrayData waveform of the image plugin. Every
+        frame is copied into self.ring, an ImageRing of size frames of the
+        current camera array size.
+        """
+        self.stop_stream()
+        shape = (int(self.__get_rbv('ArraySizeY_RBV')), int(self.__get_rbv('ArraySizeX_RBV')))
+        base = '%s:%s:' % (self.pvname, self.__image_plugin)
+        uid = Pv.Pv(base + 'UniqueId_RBV', monitor=True)
+        data = Pv.Pv(base + 'ArrayData', monitor=True)
+        self.ring = ImageRing(shape, size)
+        ring = self.ring
+        def frame_cb(e=None):
+            if e is None and data.value is not None:
+                ring.put(data.value, uid.value)
+        data.add_monitor_callback(frame_cb)
+        self.__stream_pvs = [uid, data]
+        self.__connect_start(uid)
+        self.__connect_start(data)
+        self.__connect_all(timeout, self.__stream_pvs)
+        # forget the frame that was current when the monitor started
+        ring.reset()
+        return ring
+
+    def stop_stream(self):
+        if self.__stream_pvs is not None:
+            for pv in self.__stream_pvs:
+                pv.disconnect()
+                self.__pvs.remove(pv)
+            self.__stream_pvs = None
+
+    def get_frames(self, n=1, timeout=None):
+        """
+        Return the next n frames from the stream as (frames, times, ids),
+        starting it if needed.
+        """
+        if self.ring is None or self.__stream_pvs is None:
+            self.start_stream(max(n, 16))
+        if not self.ring.wait(self.ring.count + n, timeout):
+            print "WARNING: timeout waiting for %d frames from %s" % (n, self.pvname)
+        return self.ring.latest(n)
+
+    def stream_stats(self):
+        """
+        Frames received, frames dropped (gaps in the unique ids), the rate
+        over the ring and the mean rate since the stream started.
+        """
+        if self.ring is None:
+            return None
+        return self.ring.stats()
+
+    def __get_rbv(self, name):
+        return Pv.get('%s:%s' % (self.pvname, name))
 
     def _prep_gige(self, filepath=None, filename=None, fileformat=None, filenum=None):
         if filepath is not None:
@@ -382,3 +564,23 @@ class GigeCam(object):
 
     def __repr__(self):
         return self.status()        
+
+
+def encode_lstr(val, limit=256):
+    """
+    Encode a string as the zero padded uint8 array of a long string
+    waveform PV.
+    """
+    val = str(val)
+    if len(val) > limit:
+        raise ValueError('string exceeds max length of %d characters' % limit)
+    char_arr = np.zeros(limit, dtype=np.uint8)
+    char_arr[:len(val)] = np.frombuffer(val, dtype=np.uint8)
+    return char_arr
+
+def decode_lstr(byte_array):
+    """
+    Decode a long string waveform, dropping the zero bytes.
+    """
+    char_arr = np.asarray(byte_array).astype(np.uint8)
+    return char_arr[char_arr != 0].tostring()
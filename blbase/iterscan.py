@@ -298,11 +298,17 @@ class IterScan(object):
 
     def _wait_generic(self, mots):
         """_wait with an arbitrary set of motors."""
+        return motor.wait_all(self._flatten_generic(mots))
+
+    def _flatten_generic(self, mots):
+        """Return a flat list of the motors in arbitrarily nested mots."""
+        flat = []
         for m in mots:
             if isinstance(m, (tuple, list)):
-                self._wait_generic(m)
+                flat.extend(self._flatten_generic(m))
             else:
-                m.wait() 
+                flat.append(m)
+        return flat
 
     def to_first_point(self):
         """
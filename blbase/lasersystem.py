@@ -2,6 +2,7 @@ import os
 from blutil import config, guessBeamline
 import psp.Pv as Pv
 import blutil
+from blutil import snapshot
 from blutil.pypslog import logprint
 from time import time,sleep
 import numpy as np
@@ -12,6 +13,102 @@ laserDict = {"sxr" : {"system" : 2, "m":  0,    "M": 22.2e-9, "eps1": 10e9,   "e
              "cxi" : {"system" : 4, "m": -3e-9, "M": 22.2e-9, "eps1": 10e-12, "eps2":  20e-15},
              "mec" : {"system" : 6, "m":  0,    "M": 19.2e-9, "eps1":  5e-12, "eps2": 100e-15}}
 
+class TimingModel(object):
+  """ Laser timing model: EVR tick and phase shifter settings for a
+  delay, computed from a snapshot of the PV backed parameters so that
+  arrays of delays can be solved at once. Delays are from fs = 0, as for
+  LaserSystem.get_timing_par. """
+  def __init__(self,evr0_las,evr0_gate,fs_cen,fs_rad,fs_offset,
+               evr_tick=8.4e-9,osc_period=1/68000000.,phase_shifter_max=22e-9):
+    self.evr0_las = evr0_las
+    self.evr0_gate = evr0_gate
+    self.fs_cen = fs_cen
+    self.fs_rad = fs_rad
+    self.fs_offset = fs_offset
+    self.evr_tick = evr_tick
+    self.osc_period = osc_period
+    self.phase_shifter_max = phase_shifter_max
+
+  def n_max(self,delay):
+    dn = np.floor((np.asarray(delay)-self.fs_cen+self.fs_rad)/self.evr_tick)
+    return self.evr0_las+dn
+
+  def n_min(self,delay):
+    dn = np.ceil((np.asarray(delay)-self.fs_cen-self.fs_rad)/self.evr_tick)
+    return self.evr0_las+dn
+
+  def get_dt(self,evr,delay):
+    """ phase shifter delay for EVR tick evr, brought in the range
+    (-fs_cen,phase_shifter_max-fs_cen] """
+    tc = self.fs_cen
+    op = self.osc_period
+    dt = (np.asarray(delay)-tc) - np.round((np.asarray(evr)-self.evr0_las)*self.evr_tick/op)*op
+    hi = self.phase_shifter_max-tc
+    lo = -tc
+    dt = np.where(dt>hi, hi-np.mod(hi-dt,op), dt)
+    dt = np.where(dt<lo, lo+np.mod(dt-lo,op), dt)
+    return dt
+
+  def timing_par(self,delay):
+    """ (n,dt) for delay (scalar or array): the present EVR tick evr0_las
+    if the phase shifter can reach the delay from it, otherwise the tick
+    giving the phase shifter setting closest to fs_cen. n is nan where no
+    tick can reach the delay. """
+    t = np.asarray(delay,dtype=float)
+    tf = t.ravel()
+    nmin = self.n_min(tf)
+    nmax = self.n_max(tf)
+    n = np.empty(tf.shape)
+    n.fill(np.nan)
+    ncand = int(np.max(nmax-nmin))+1 if tf.size else 0
+    if ncand > 0:
+      ns = nmin[:,np.newaxis] + np.arange(ncand)
+      dts = np.abs(self.get_dt(ns,tf[:,np.newaxis])-self.fs_cen)
+      dts[ns>nmax[:,np.newaxis]] = np.inf
+      best = ns[np.arange(len(tf)),np.argmin(dts,axis=1)]
+      n = np.where(nmax>=nmin,best,n)
+    n0 = 1.*self.evr0_las
+    n = np.where((nmin<=n0)&(n0<=nmax),n0,n)
+    dt = self.get_dt(n,tf)
+    if t.ndim == 0:
+      return float(n[0]),float(dt[0])
+    return n.reshape(t.shape),dt.reshape(t.shape)
+
+  def plan(self,t0delays):
+    """ TimingPlan for the delays t0delays """
+    return TimingPlan(self,t0delays)
+
+
+class TimingPlan(object):
+  """ set_timing settings precomputed for a list of delays (X-ray to
+  laser, as for set_timing); arrays n (laser EVR ticks), gate (gate EVR
+  ticks), dial (phase shifter dial delay) and move_dial (if the phase
+  shifter has to be moved) """
+  def __init__(self,model,t0delays):
+    self.model = model
+    self.t0delay = np.array(t0delays,dtype=float).ravel()
+    self.n,self.dt = model.timing_par(model.fs_offset-self.t0delay)
+    bad = np.isnan(self.n)
+    if bad.any():
+      raise ValueError("no EVR tick reaches the delay(s) %s, the phase shifter range is too small"
+                       % ", ".join("%.6e" % t for t in self.t0delay[bad]))
+    self.gate = (model.evr0_gate-model.evr0_las) + self.n
+    self.dial = self.dt + model.fs_cen
+    self.move_dial = ~(np.abs(self.t0delay)>200e-9)
+    self.__index = dict( (t,i) for i,t in enumerate(self.t0delay) )
+
+  def __len__(self):
+    return len(self.t0delay)
+
+  def point(self,t0delay):
+    """ (n,gate,dial,move_dial) for t0delay, computed if it is not one of
+    the planned delays """
+    i = self.__index.get(float(t0delay))
+    if i is None:
+      return TimingPlan(self.model,[t0delay]).point(t0delay)
+    return self.n[i],self.gate[i],self.dial[i],bool(self.move_dial[i])
+
+
 class LaserSystem(object):
   def __init__(self,system=None,beamline=None):
     if beamline == None:
@@ -168,64 +265,47 @@ class LaserSystem(object):
     self._evr0_las = self._evr_las
     self._evr0_gate = self._evr_gate
    
+  def timing_model(self):
+    """ TimingModel with the present PV values, read once in one batch """
+    pvs = {"evr0_las": self.__pv_evr0_osc, "evr0_gate": self.__pv_evr0_gate,
+           "fs_min": self.__pv_angleshift_min, "fs_max": self.__pv_angleshift_max,
+           "offset": self.__pv_angleshift_offset}
+    v = snapshot.read_dict(pvs)
+    missing = sorted(pvs[key] for key in pvs if v[key] is None)
+    if missing:
+      raise Exception("could not read %s" % ", ".join(missing))
+    return TimingModel(v["evr0_las"],v["evr0_gate"],
+                       (-v["fs_min"]-v["fs_max"])/2.-v["offset"],
+                       np.abs(v["fs_min"]-v["fs_max"])/2.,-v["offset"],
+                       self.__evr_tick,self.__osc_period,self.__phase_shifter_max)
+
+  def timing_plan(self,t0delays):
+    """ precomputes set_timing for the delays of a scan, e.g.
+    plan = las.timing_plan(positions)
+    lxt = VirtualMotor("lxt",lambda t: las.set_timing(t,plan),las.get_timing) """
+    return TimingPlan(self.timing_model(),t0delays)
+
   def n_max(self,delay):  # delay is from fs = 0
-    t = delay
-    tc= self._fs_cen
-    r = self._fs_rad
-    d = self.__evr_tick
-    n0= self._evr0_las
-    dn = np.floor((t-tc+r)/d)
-    n_max = n0+dn
-    return n_max
+    return self.timing_model().n_max(delay)
 
   def n_min(self,delay):  # delay is from fs = 0
-    t = delay
-    tc= self._fs_cen
-    r = self._fs_rad
-    d = self.__evr_tick
-    n0= self._evr0_las
-    dn = np.ceil((t-tc-r)/d)
-    n_min = n0+dn
-    return n_min
+    return self.timing_model().n_min(delay)
 
   def get_dt(self,evr,delay): # delay is from fs = 0
-    t = delay
-    tc= self._fs_cen
-    r = self._fs_rad
-    d = self.__evr_tick
-    n = evr
-    ps_max = self.__phase_shifter_max
-    n0= self._evr0_las
-    op = self.__osc_period
-    dt = (t-tc)- np.round((n-n0)*d/op)*op
-
-    while dt>(ps_max-tc):
-      dt-=op
-    while dt < -tc:
-      dt+=op
-    return dt
+    return self.timing_model().get_dt(evr,delay)
 
   def get_timing_par(self,delay): # delay is from fs = 0
-    t = delay 
-    n0= self._get_evr0_las()
-    dt_last = self._fs_cen
-    if self.n_min(t)<=n0<=self.n_max(t):
-      n = 1.*n0
-    else:
-      ns  = np.arange(self.n_min(t),self.n_max(t)+1)
-      dts = [abs(self.get_dt(nn,t)-dt_last) for nn in ns]
-      n = ns[np.argmin(dts)]
-    dt = self.get_dt(n,t)
-    return n,dt
-
-  def set_timing(self,t0delay):
-    delay = -t0delay+self._fs_offset
-    n,dt = self.get_timing_par(delay)
+    return self.timing_model().timing_par(delay)
+
+  def set_timing(self,t0delay,plan=None):
+    if plan is None:
+      plan = self.timing_plan([t0delay])
+    n,gate,dial,move_dial = plan.point(t0delay)
     self._evr_las = n
-    self._evr_gate = (self._evr0_gate-self._evr0_las) + n
+    self._evr_gate = gate
     sleep(.1)
-    if not np.abs(t0delay)>200e-9:
-      self.dial_delay(dt+self._fs_cen)
+    if move_dial:
+      self.dial_delay(dial)
     # dirty hack
     self._td_tot = t0delay
 
@@ -385,19 +465,31 @@ class LaserSystem(object):
       sleep(0.01)
 
   def status(self):
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    pvs = {"delay": self.__pv_angleshift_rbv, "error": self.__pv_error,
+           "gain": self.__pv_gain, "diode_rf": self.__pv_diode_rf}
+    try:
+      pvs["evr0_las"] = self.__pv_evr0_osc
+    except AttributeError:
+      pass
+    return pvs
+
+  def format_status(self,values):
     size = 25
     str = "%s: %s\n" % ("Laser system in use".rjust(size),self.system)
-    delay = self.dial_delay()
+    delay = values["delay"]*1e-15
     str+= "%s: %e (%s)\n" % ("current oscillator delay (s)".rjust(size),delay,blutil.time_to_text(delay))
-    delay  = self.error()
+    delay  = values["error"]*1e-15
     str+= "%s: %e (%s)\n" % ("current phase error (s)".rjust(size),delay,blutil.time_to_text(delay))
     try:
-      v = int(self._get_evr0_las())
+      v = int(values["evr0_las"])
       str+= "%s\n" % ("EVR (Laser Hall)".rjust(size))
       str+= "%s: %d\n" % ("delay (ticks)".rjust(size), v)
     except:
       pass
-    gain = self.gain()
+    gain = values["gain"]
     if (gain ==0):
       gain_str="UNLOCKED"
     elif (gain <self.gainthresh):
@@ -405,7 +497,7 @@ class LaserSystem(object):
     else:
       gain_str="HIGH"
     str+="%s: %f (%s)\n" % ("gain".rjust(size),gain,gain_str)
-    str+="%s: %d\n" % ("diode rf".rjust(size), Pv.get(self.__pv_diode_rf))
+    str+="%s: %d\n" % ("diode rf".rjust(size), values["diode_rf"])
     return str
 
   def dial_delay_new(self,value=None):
@@ -113,10 +113,12 @@ class marccd(object):
             self.connection.connect((self.ip_address,self.port))
           self.connection.sendall (command)
           reply = self.connection.recv(4096)
-          while reply.find("\n") == -1:
+          # a newline left over from an image transfer, which came after
+          # drain(), does not end the reply
+          while reply.lstrip("\n\0").find("\n") == -1:
             reply += self.connection.recv(4096)
           self.log("reply %r" % reply)
-          return reply.rstrip("\n\0")
+          return reply.strip("\n\0")
         except Exception,message:
           self.log_error("write %r attempt %d/%d failed: %s" %
               (command,attempt+1,self.retries,message))
@@ -141,6 +143,7 @@ class marccd(object):
           while True:
             try: reply += self.connection.recv(4096)
             except socket.timeout: break
+          self.connection.settimeout(self.timeout)
           self.log("reply length %r" % len(reply))
           return reply
         except Exception,message:
@@ -149,6 +152,73 @@ class marccd(object):
           self.connection = None
       return ""
 
+  def query_image(self,command,nbytes):
+    """To send a command that replies with exactly nbytes of 16-bit image
+    data. The reply is read straight into a preallocated buffer.
+    Returns a uint16 numpy array sharing memory with that buffer, or None
+    on failure."""
+    self.log("query %r" % command)
+    if len(command) == 0 or command[-1] != "\n": command += "\n"
+    with self.lock: # Allow only one thread at a time inside this function.
+      for attempt in range(0,self.retries):
+        try:
+          if self.connection == None:
+            self.connection = socket.socket()
+            self.connection.settimeout(self.timeout)
+            self.connection.connect((self.ip_address,self.port))
+          self.connection.sendall (command)
+          buf = bytearray(nbytes)
+          view = memoryview(buf)
+          pos = 0
+          while pos < nbytes:
+            n = self.connection.recv_into(view[pos:],nbytes-pos)
+            if n == 0: raise socket.error("connection closed after %d of %d bytes" % (pos,nbytes))
+            pos += n
+          self.drain()
+          self.log("reply length %r" % pos)
+          return np.frombuffer(buf,dtype="<u2")
+        except Exception,message:
+          self.log_error("write %r attempt %d/%d failed: %s" %
+              (command,attempt+1,self.retries,message))
+          self.connection = None
+      return None
+
+  def drain(self):
+    """Discard bytes that are already waiting on the connection, e.g. a
+    trailing newline after an image."""
+    try:
+      self.connection.setblocking(0)
+      while len(self.connection.recv(4096)) > 0: pass
+    except socket.error: pass
+    finally: self.connection.settimeout(self.timeout)
+
+  def get_image(self,corrected=True):
+    """Transfers the last read image and returns it as a 2D uint16 array.
+    The expected size comes from image_size, so the transfer ends as soon as
+    the last byte arrives. Falls back to query_long if the size is unknown."""
+    command = "get_image,%d" % int(corrected)
+    n = self.image_size()
+    if n <= 0:
+      reply = self.query_long(command)
+      return np.frombuffer(reply[:len(reply)//2*2],dtype="<u2")
+    img = self.query_image(command,n*n*2)
+    if img is None: return None
+    return img.reshape(n,n)
+
+  def wait_state(self,mask,active=False,timeout=None):
+    """Wait until the bits of the state code in mask are (active=True) or are
+    no longer (active=False) set. The state is re-read as soon as the last
+    reply arrived, backing off up to 50 ms, so the wait ends right after
+    the change instead of on a fixed polling grid.
+    Returns True on success and False on timeout."""
+    t0 = time()
+    dt = 0.002
+    while ((self.state_code() & mask) != 0) != active:
+      if timeout is not None and time()-t0 > timeout: return False
+      sleep(dt)
+      dt = min(2*dt,0.05)
+    return True
+
   def state_code(self):
     "returns the status code as interger value"
     reply = self.query("get_state").strip("\n\0")
@@ -262,42 +332,43 @@ class marccd(object):
     self.write("writefile,"+remote(filename)+",0")
 
   def image(self):
-    """Returns the last image as 16-bit raw data.
+    """Returns the last image as a 2D uint16 array.
     This command required a special version of the MAR CCD server
     (/home/marccd/NIH/v1/marccd_server_socket)
     """
-    return self.query_long("get_image,1")
+    return self.get_image(corrected=True)
   
   def raw_image(self):
-    """Returns the last read image before correction as 16-bit raw data.
+    """Returns the last read image before correction as a 2D uint16 array.
     This command required a special version of the MAR CCD server
     (/home/marccd/NIH/v1/marccd_server_socket)
     """
-    return self.query_long("get_image,0")
+    return self.get_image(corrected=False)
 
   def read_image(self):
     """Reads the detector and transfers the image without saving to a file.
-    Returns 16-bit raw data.
+    Returns a 2D uint16 array.
     This command required a special version of the MAR CCD server
     (/home/marccd/NIH/v1/marccd_server_socket)
     """
     self.write("readout,0")
-    sleep(0.2)
-    while self.is_correcting(): sleep(0.2)
-    return self.query_long("get_image,1")
+    # Wait for the readout to be queued, then for the correction to finish
+    self.wait_state(0x00003300,active=True,timeout=0.2)
+    self.wait_state(0x00003300)
     self.last_read = time()
+    return self.get_image(corrected=True)
   
   def read_raw_image(self):
     """Reads the detector and transfers the image without saving to a file.
-    Returns 16-bit raw data.
+    Returns a 2D uint16 array.
     This command required a special version of the MAR CCD server
     (/home/marccd/NIH/marccd_server_socket)
     """
     self.write("readout,3")
-    sleep(0.2)
-    while self.is_reading(): sleep(0.2)
-    return self.query_long("get_image,0")
+    self.wait_state(0x00000300,active=True,timeout=0.2)
+    self.wait_state(0x00000300)
     self.last_read = time()
+    return self.get_image(corrected=False)
 
   def get_bin_factor(self): 
     try: return int(self.query("get_bin").split(",")[0])
@@ -465,8 +536,7 @@ class marccd(object):
     self.write(cmd)
 
   def wait_for_idle(self):
-    while (not self.is_idle()):
-      sleep(0.05)
+    self.wait_state(0xFFFFFFFF)
 
   def wait(self):
     self.wait_for_idle()
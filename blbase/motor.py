@@ -8,6 +8,7 @@ import Queue
 import subprocess
 import numbers
 import traceback
+import inspect
 import numpy
 import pylab as pl
 import blutil.tools as tl
@@ -16,8 +17,10 @@ import psp.Pv as Pv
 import blutil
 from blutil import notice
 from blutil import keypress
+from blutil import spans
 from blutil.pypslog import logprint
 from blutil.epicsarchive_new import EpicsArchive
+from blutil.threadtools import PycaThread
 try: # Not every environment has pmgr access
   from blutil import pmgr_interface
 except:
@@ -61,6 +64,16 @@ CLEAR_POWERUP=36
 CLEAR_STALL  =40
 CLEAR_ERR    =48
 
+# wait_all outcomes
+WAIT_DONE    ="done"
+WAIT_TIMEOUT ="timed out"
+WAIT_STALLED ="stalled"
+WAIT_LIMIT   ="limit hit"
+WAIT_ERROR   ="error"
+
+# timeout passed to wait methods when wait_all waits indefinitely
+WAIT_FOREVER = 1e6
+
 motor_params = {
    'max_hold_current':('HCMX', 'Hold Current Max '),
    'max_run_current': ('RCMX', 'Run Current Max '),
@@ -250,6 +263,7 @@ class Motor(object):
   ### Basic Motor Functions ###
   #############################
 
+  @spans.timed("motor.move")
   def move(self, pos, relative=False, wait=0, update=False,
            check_limits=True, check_start=3, check_end=True,
            check_problems=True, dial=False, elog=False, silent=False):
@@ -398,6 +412,7 @@ class Motor(object):
     non_bool = not (num is True or num is False)
     return real and non_nan and non_bool
 
+  @spans.timed("motor.monitor_move_start")
   def _monitor_move_start(self, start_pos):
     """
     Start a callback to check when the motor has started moving
@@ -627,6 +642,7 @@ class Motor(object):
     """
     return not self.get_par("done_moving")
 
+  @spans.timed("motor.wait")
   def wait(self, timeout=60, use_pos=False):
     """
     Wait until the motor has finished moving, or until timeout.
@@ -645,6 +661,19 @@ class Motor(object):
       max = goal + abs(deadband)
       return monpv.wait_for_range(min, max, timeout)
 
+  def _wait_outcome(self):
+    """
+    Return the wait_all outcome for this motor once it is done moving.
+    """
+    if self.check_stall(verbose=False):
+      return WAIT_STALLED
+    try:
+      if self.check_limit_switches()[0] != "ok":
+        return WAIT_LIMIT
+    except pyca.pyexc:
+      pass
+    return WAIT_DONE
+
   #####################
   ### PV Utiltities ###
   #####################
@@ -669,6 +698,8 @@ class Motor(object):
     """
     if parname is None:
       return self.pvname
+    if sep == "." and parname in self._pv_cache:
+      return self._pv_cache[parname].name
     return sep.join((self.pvname, motor_params[parname][0]))
 
   def get_pvobj(self, parname, sep="."):
@@ -1200,8 +1231,9 @@ class Motor(object):
     arch = EpicsArchive()
     pospv = self.get_pvname("readback")
     dialpv = self.get_pvname("dial_readback")
-    tpos, xpos = arch.get_points(pospv, start, end, unit, two_lists=True, raw=True)
-    tdia, xdia = arch.get_points(dialpv, start, end, unit, two_lists=True, raw=True)
+    pts = arch.get_points_many([pospv, dialpv], start, end, unit)
+    tpos, _, xpos = pts[pospv]
+    tdia, _, xdia = pts[dialpv]
     tpos = [ datetime.datetime.fromtimestamp(i) for i in tpos ]
     tdia = [ datetime.datetime.fromtimestamp(i) for i in tdia ]
     if len(tpos) == 0 and len(tdia) == 0:
@@ -1567,6 +1599,103 @@ class Motor(object):
       print "Could not estimate move time for motor %s,(%s)"%(self.name,self.pvname)
       return None
 
+@spans.timed("motor.wait_all")
+def wait_all(motors, timeout=60):
+  """
+  Wait until all motors are done moving, or until one shared timeout.
+  A negative or None timeout waits indefinitely.
+
+  Motors with a done moving PV are watched with monitor callbacks. Any other
+  object with a wait method (VirtualMotor, PvMotor...) has its wait run in a
+  background thread so it can take part in the same deadline.
+
+  Returns a dictionary of motor -> outcome, where outcome is one of
+  WAIT_DONE, WAIT_TIMEOUT, WAIT_STALLED or WAIT_LIMIT, or WAIT_ERROR if the
+  wait method of a motor raised.
+  """
+  motors = list(motors)
+  cond = threading.Condition()
+  finished = set()
+  results = {}
+  monitors = []
+  if timeout is None or timeout < 0:
+    deadline = float("inf")
+  else:
+    deadline = time.time() + timeout
+
+  def set_done(mot, outcome=None):
+    with cond:
+      finished.add(mot)
+      if outcome is not None:
+        results[mot] = outcome
+      cond.notify_all()
+
+  def thread_wait(mot):
+    outcome = WAIT_DONE
+    try:
+      if _accepts_timeout(mot.wait):
+        ok = mot.wait(timeout=max(min(deadline - time.time(), WAIT_FOREVER), 0))
+      else:
+        ok = mot.wait()
+      if ok is False:
+        outcome = WAIT_TIMEOUT
+    except Exception, exc:
+      logprint("wait_all: error waiting for {0}: {1}".format(
+               getattr(mot, "name", mot), exc), print_screen=True)
+      outcome = WAIT_ERROR
+    set_done(mot, outcome)
+
+  for mot in set(motors):
+    dmov = None
+    if isinstance(mot, Motor):
+      dmov = mot.get_pvobj("done_moving")
+      if not dmov.isinitialized:
+        dmov = None
+    if dmov is not None:
+      def cb(e=None, mot=mot, dmov=dmov):
+        if e is None and dmov.value == 1:
+          set_done(mot)
+      monitors.append((dmov, dmov.add_monitor_callback(cb)))
+      # we may have missed the transition before adding the callback
+      if dmov.value == 1:
+        set_done(mot)
+    else:
+      thread = PycaThread(target=thread_wait, args=(mot,))
+      thread.daemon = True
+      thread.start()
+
+  try:
+    with cond:
+      while len(finished) < len(set(motors)):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          break
+        # short waits keep ctrl+c responsive
+        cond.wait(min(remaining, 1.0))
+  finally:
+    for dmov, id in monitors:
+      dmov.del_monitor_callback(id)
+
+  outcomes = {}
+  for mot in motors:
+    if mot not in finished:
+      outcomes[mot] = WAIT_TIMEOUT
+    elif results.get(mot, WAIT_DONE) != WAIT_DONE:
+      outcomes[mot] = results[mot]
+    elif isinstance(mot, Motor):
+      outcomes[mot] = mot._wait_outcome()
+    else:
+      outcomes[mot] = WAIT_DONE
+  return outcomes
+
+def _accepts_timeout(func):
+  """ True if func takes a timeout keyword """
+  try:
+    args, varargs, varkw, defaults = inspect.getargspec(func)
+  except TypeError:
+    return False
+  return "timeout" in args or varkw is not None
+
 # Auxilliary Classes
 class CallbackContext(object):
   def __init__(self, pv, callback):
@@ -4,14 +4,15 @@ act on multiple motors.
 """
 import os
 import re
-import threading
+import json
+import time
 from types import MethodType
-from psp import PV
-from blbase.motor import Motor
+from blbase.motor import Motor, wait_all as wait_all_motors, WAIT_DONE
 import blbase.motorPresets as motorPresets
 from blutil.threadtools import PycaThreadPool
 from blutil.doctools import argspec
 from blutil.organize import SimpleContainer
+from blutil import snapshot
 
 
 def interpret_motors(*motors):
@@ -76,6 +77,7 @@ class Motors(object):
     def __init__(self):
         self.all = Group(self, "all")
         self.groups = Groups(self)
+        self.import_report = []
 
     def add(self, *motors, **opts):
         """
@@ -100,7 +102,8 @@ class Motors(object):
         self.add(*objs)
 
     def import_epicsArch(self, file_path, regex=".*:(MMS|MMN|MZM|DMX|IMS):.*",
-                         skip_import=[]):
+                         skip_import=[], timeout=5.0, use_cache=True,
+                         refresh=False):
         """
         Imports all motor pvs and names from a given epicsArch file. By
         default, only grabs pvs that contain :MMS: or :MMN:, but you can
@@ -110,44 +113,74 @@ class Motors(object):
 
         If a list of Motor objects is provided to skip_import, we'll use these
         Motor objects when applicable instead of creating a new Motor object.
-        """
-        arch_list = self._epicsArch_load(file_path)
-        mots = []
+
+        The record type of every matching pv is checked to make sure it is a
+        motor. Known record types are cached on disk along with the parsed
+        epicsArch files (reparsed when a file changes), so only new pvs are
+        looked up. Those are connected all at once and given timeout seconds
+        in total to reply. Cached record types are dropped when an epicsArch
+        file changes or after rtyp_cache_ttl seconds; refresh=True drops the
+        whole cache. Skipped pvs and the reason are kept in
+        self.import_report as (pv, alias, reason) tuples.
+        """
+        cache = RtypCache(file_path) if use_cache else None
+        if cache is not None and refresh:
+            cache.clear()
+        arch_list = None
+        if cache is not None:
+            arch_list = cache.arch_list()
+        if arch_list is None:
+            load_set = set()
+            arch_list = self._epicsArch_load(file_path, load_set)
+            if cache is not None:
+                cache.set_arch_list(arch_list, load_set)
         pattern = re.compile(regex)
 
         skip_dict = {m.pvname : m for m in skip_import if hasattr(m, "pvname")}
 
-        done_flags = []
-        conn_pvs = []
-
+        candidates = []
+        seen = set()
         for d in arch_list:
             pv = d["pv"]
-            alias = d["alias"]
             if pattern.match(pv):
                 pv = pv.split(".")[0]
-                if pv in skip_dict:
-                    mots.append(skip_dict[pv])
-                    continue
-
-                # Check that RTYP field exists and is a valid motor type
-                # Implement with EPICS callback
-                done_flag = threading.Event()
-                done_flags.append(done_flag)
-                rtyp = pv + ".RTYP"
-                check_pv = PV(rtyp, monitor=True)
-                check_pv.add_monitor_callback(
-                    append_motor_cb(check_pv, pv, alias, mots, done_flag))
-                check_pv.do_initialize = True
-                check_pv.connect()
-                conn_pvs.append(check_pv)
-
-        all_done = threading.Thread(target=wait_all, args=(done_flags,))
-        all_done.start()
-        all_done.join(1.0)
-
-        # Disconnect the pvs, we don't need them.
-        for pv_obj in conn_pvs:
-            pv_obj.disconnect()
+                if pv not in seen:
+                    seen.add(pv)
+                    candidates.append((pv, d["alias"]))
+
+        rtyps = {}
+        if cache is not None:
+            rtyps.update(cache.rtyps())
+        lookup = [pv for pv, alias in candidates
+                  if pv not in skip_dict and pv not in rtyps]
+        if lookup:
+            found = get_rtyps(lookup, timeout)
+            rtyps.update(found)
+            if cache is not None:
+                cache.set_rtyps(found)
+        if cache is not None:
+            cache.save()
+
+        mots = []
+        self.import_report = []
+        for pv, alias in candidates:
+            if pv in skip_dict:
+                mots.append(skip_dict[pv])
+            elif pv not in rtyps:
+                self.import_report.append((pv, alias, "no reply"))
+            elif rtyps[pv] in MOTOR_RTYP:
+                mots.append((pv, alias))
+            else:
+                self.import_report.append((pv, alias,
+                    "record type {}".format(rtyps[pv])))
+
+        no_reply = [r for r in self.import_report if r[2] == "no reply"]
+        if self.import_report:
+            print "Skipped {0} of {1} pvs from {2} ({3} not motors, {4} no reply in {5}s)".format(
+                len(self.import_report), len(candidates), file_path,
+                len(self.import_report) - len(no_reply), len(no_reply), timeout)
+            for pv, alias, reason in no_reply:
+                print "  {0} ({1}): {2}".format(alias, pv, reason)
 
         group_name = file_path.split("/")[-1].split(".")[0]
         self.add(*mots, group=group_name, allow_duplicates=False)
@@ -160,7 +193,7 @@ class Motors(object):
         file_path is the full path to the epicsArch file to import.
         load_set is the set of full paths that we've already loaded. This lets
             us avoid infinite recursion. With epicsArch files pointing to each
-            other. Always use the default argument here.
+            other. Pass an empty set to get the list of files that were read.
         """
         if load_set is None:
             load_set = set()
@@ -206,20 +239,102 @@ class Motors(object):
         """
         motorPresets.load_preset_defaults(self.all.get_motors())
 
-def append_motor_cb(rtyp_obj, pv, alias, mots, done_flag):
-    motor_rtyp = ("ims", "xps8p", "arcus", "dmx")
+MOTOR_RTYP = ("ims", "xps8p", "arcus", "dmx")
+rtyp_cache_dir = os.path.expanduser("~/.pyps_cache")
+# seconds a cached RTYP is trusted, in case a record is replaced without
+# the epicsArch file changing
+rtyp_cache_ttl = 24 * 3600.
 
-    def motor_cb(e=None):
-        if e is None and not done_flag.is_set():
-            if rtyp_obj.value in motor_rtyp:
-                mots.append((pv, alias))
-            done_flag.set()
+def get_rtyps(pvs, timeout=5.0):
+    """
+    Look up the RTYP field of all pvs at once, on one deadline of timeout
+    seconds (see blutil.snapshot.read). Returns a dictionary pv: rtyp for
+    the pvs that replied in time.
+    """
+    values, errors = snapshot.read([pv + ".RTYP" for pv in pvs], timeout)
+    return dict((pv, values[pv + ".RTYP"]) for pv in pvs
+                if pv + ".RTYP" in values)
 
-    return motor_cb
 
-def wait_all(flags):
-    for f in flags:
-        f.wait(1.0)
+class RtypCache(object):
+    """
+    On-disk cache for Motors.import_epicsArch. Holds the parsed pv/alias
+    list of an epicsArch file, valid as long as none of the files it was
+    read from changed, and the RTYP of every pv that was looked up, valid
+    for rtyp_cache_ttl seconds and until the epicsArch files change.
+    """
+    def __init__(self, file_path):
+        self._file_path = os.path.abspath(file_path)
+        name = re.sub("[^A-Za-z0-9_.-]", "_", self._file_path.strip("/"))
+        self._cache_path = os.path.join(rtyp_cache_dir, name + ".json")
+        try:
+            with open(self._cache_path, "r") as f:
+                self._data = json.load(f)
+        except (IOError, ValueError):
+            self._data = {}
+        self._data.setdefault("rtyp", {})
+
+    def clear(self):
+        self._data = {"rtyp": {}}
+
+    def arch_list(self):
+        """
+        Return the cached epicsArch list if no file changed, else None.
+        """
+        mtimes = self._data.get("mtimes")
+        if not mtimes or self._data.get("arch_list") is None:
+            return None
+        for path, mtime in mtimes.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return None
+            except OSError:
+                return None
+        return [dict(pv=str(d["pv"]), alias=str(d["alias"]))
+                for d in self._data["arch_list"]]
+
+    def set_arch_list(self, arch_list, files):
+        mtimes = {}
+        for path in files:
+            try:
+                mtimes[os.path.abspath(path)] = os.path.getmtime(path)
+            except OSError:
+                pass
+        self._data["arch_list"] = arch_list
+        self._data["mtimes"] = mtimes
+        # the record types were looked up for the old files
+        self._data["rtyp"] = {}
+
+    def rtyps(self):
+        """
+        Return pv: rtyp for the entries younger than rtyp_cache_ttl.
+        """
+        now = time.time()
+        rtyps = {}
+        for pv, entry in self._data["rtyp"].items():
+            # entries without a time stamp are from an older cache
+            if not isinstance(entry, list) or len(entry) != 2:
+                continue
+            rtyp, stamp = entry
+            if 0 <= now - stamp < rtyp_cache_ttl:
+                rtyps[pv] = rtyp
+        return rtyps
+
+    def set_rtyps(self, rtyps):
+        now = time.time()
+        for pv, rtyp in rtyps.items():
+            self._data["rtyp"][pv] = [rtyp, now]
+
+    def save(self):
+        try:
+            if not os.path.isdir(rtyp_cache_dir):
+                os.makedirs(rtyp_cache_dir)
+            tmp = self._cache_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self._data, f)
+            os.rename(tmp, self._cache_path)
+        except (IOError, OSError), exc:
+            print "Could not save RTYP cache: {0}".format(exc)
 
 
 class Groups(object):
@@ -271,7 +386,6 @@ class Group(object):
             "clear_pu",
             "clear_stall",
             "clear_error",
-            "wait",
             "stop",
             )
 
@@ -293,6 +407,16 @@ class Group(object):
                 self._pvnames.add(motor.pvname)
                 setattr(self.m, motor.name, motor)
 
+    def wait(self, timeout=60):
+        """
+        Wait until all motors in the group are done moving, or until one
+        shared timeout. Return True/False for each motor in the same order
+        as get_motors().
+        """
+        mots = self.get_motors()
+        outcomes = wait_all_motors(mots, timeout)
+        return [outcomes[m] == WAIT_DONE for m in mots]
+
     def get_motors(self):
         """
         Return a list of all motors in the group, sorted alphabetically by
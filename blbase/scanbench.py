@@ -0,0 +1,370 @@
+"""
+Benchmarks of the motor and scan hot paths on the simulated backend
+(blutil.simulation), so scan latency can be measured and compared between
+commits without an IOC or a DAQ.
+
+  move       Motor.move + wait overhead beyond the simulated motion time
+  wait_all   motor.wait_all on several motors moving together
+  ascan      1-D Daq scans of several sizes
+  mesh2D     2-D Daq mesh scans
+  mesh3D     3-D Daq mesh scans
+  iterscan   IterScan steps
+  delayscan  DelayScan sweeps during a fixed DAQ duration
+  smartmotor SmartMotor construction time
+  burstscan  burstScan.ascan/a2scan time per step beyond the motion time
+  gige       GigeCam construction time and the achieved ring buffer frame
+             rate of a simulated 30 Hz camera
+  status     device status printout, serial Pv.get against one snapshot
+
+Daq scans report the total time, the time per point, the dead time per
+point (everything that is not DAQ acquisition) and points per second.
+
+usage:
+  python -m blbase.scanbench --out new.json --compare old.json
+or from python (the simulation has to be installed before blbase.motor,
+blbase.daq, ... are imported, run() takes care of that):
+  from blbase import scanbench
+  report = scanbench.run(quick=True)
+  scanbench.compare(scanbench.load("old.json"), report)
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import contextlib
+from blutil import simulation
+
+SIZES = dict(
+  quick = dict(ascan=[5, 20], mesh2D=[(3, 3)], mesh3D=[(2, 2, 2)], moves=20, iterscan=20, delayscan=1.,
+               smartmotor=5, burstscan=10, burst2D=(3, 3), gige=1., status=3),
+  full  = dict(ascan=[10, 50, 200], mesh2D=[(5, 5), (10, 10)], mesh3D=[(3, 3, 3), (5, 5, 5)], moves=100, iterscan=100, delayscan=3.,
+               smartmotor=20, burstscan=50, burst2D=(5, 10), gige=5., status=10),
+)
+
+class _Linac(object):
+  """ burst mode stand-in for burstScan, time stamps every burst """
+  def __init__(self):
+    self.bursts = []
+  def isburstenabled(self):
+    return True
+  def set_fburst(self, rate):
+    pass
+  def set_nburst(self, nshots):
+    pass
+  def get_burst(self, nshots=None):
+    self.bursts.append(time.time())
+  def wait_burst(self, timeout=None):
+    return True
+
+@contextlib.contextmanager
+def _quiet(enabled=True):
+  """ send prints of the scan code to /dev/null """
+  if not enabled:
+    yield
+    return
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, "w")
+  try:
+    yield
+  finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+
+def _git_commit():
+  here = os.path.dirname(os.path.abspath(__file__))
+  try:
+    return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here).strip()
+  except Exception:
+    return ""
+
+class Bench(object):
+  """ simulated beamline: 3 motors, 2 detectors and a Daq """
+  def __init__(self, rate=1200., events=12, latency=0.0, velocity=10., accel=0.01):
+    self.sim = simulation.install(latency=latency)
+    self.sim.daq_rate = rate
+    self.events = events
+    from blbase import motor
+    from blbase import daq
+    from blbase.detectors_pyami import PYAMIdetector
+    from blutil import config
+    self._tmp = tempfile.mkdtemp()
+    config.scandata_directory = self._tmp + "/"
+    config.scandata_mode = "new_files"
+    self.pvs = ["SIM:BENCH:MMS:%02d" % i for i in range(1, 4)]
+    for pv in self.pvs:
+      self.sim.add_motor(pv, velocity=velocity, accel=accel, low=-1000., high=1000.)
+    self.motors = [motor.Motor(pv, name="sim%d" % i) for i, pv in enumerate(self.pvs)]
+    self.sim.add_detector("SIM:BENCH:DIODE", lambda: self.sim.gauss(self.pvs[0], 0., 1.))
+    self.sim.add_detector("SIM:BENCH:IPM", lambda: 1.0)
+    self.dets = [PYAMIdetector("SIM:BENCH:DIODE", "diode"), PYAMIdetector("SIM:BENCH:IPM", "ipm")]
+    self.daq = daq.Daq("sim")
+    self.daq.record = False
+    import beamline
+    self.linac = _Linac()
+    for name, obj in (("lcls_linac", self.linac), ("daq", self.daq), ("daqconfig", None), ("event", None)):
+      if not hasattr(beamline, name):
+        setattr(beamline, name, obj)
+
+  def close(self):
+    shutil.rmtree(self._tmp, ignore_errors=True)
+
+  def acq_time(self, npoints):
+    return npoints*self.events/self.sim.daq_rate
+
+  def _scan_result(self, t, npoints):
+    acq = self.acq_time(npoints)
+    return dict(points=npoints, total_s=t, per_point_s=t/npoints,
+                dead_per_point_s=(t-acq)/npoints, points_per_s=npoints/t)
+
+  def bench_move(self, n):
+    """ small moves, overhead = wall time - simulated motion time """
+    m = self.motors[0]
+    sm = self.sim.motors[self.pvs[0]]
+    m.move(0., wait=True)
+    overhead = []
+    t0 = time.time()
+    for i in range(n):
+      target = 0.01*((i % 2) + 1)
+      dur = sm.profile(sm.position(), target)[0]
+      t = time.time()
+      m.move(target, wait=True)
+      overhead.append(time.time() - t - dur)
+    total = time.time() - t0
+    overhead.sort()
+    return dict(moves=n, total_s=total, overhead_mean_s=sum(overhead)/n,
+                overhead_median_s=overhead[n//2], overhead_max_s=overhead[-1])
+
+  def bench_wait_all(self, n):
+    from blbase import motor
+    t0 = time.time()
+    worst = 0.
+    for i in range(n):
+      target = 0.01*((i % 2) + 1)
+      dur = max(self.sim.motors[pv].profile(self.sim.motors[pv].position(), target)[0] for pv in self.pvs)
+      t = time.time()
+      for m in self.motors:
+        m.move_silent(target)
+      motor.wait_all(self.motors)
+      worst = max(worst, time.time() - t - dur)
+    total = time.time() - t0
+    return dict(moves=n, motors=len(self.motors), total_s=total,
+                per_move_s=total/n, overhead_max_s=worst)
+
+  def bench_ascan(self, npoints, pipeline=False):
+    t = time.time()
+    self.daq.ascan(self.motors[0], -1., 1., npoints-1, self.events, *self.dets, pipeline=pipeline)
+    return self._scan_result(time.time() - t, npoints)
+
+  def bench_mesh2D(self, n1, n2, pipeline=False):
+    t = time.time()
+    self.daq.mesh2D(self.motors[0], -1., 1., n1-1, self.motors[1], -1., 1., n2-1,
+                    self.events, *self.dets, pipeline=pipeline)
+    return self._scan_result(time.time() - t, n1*n2)
+
+  def bench_mesh3D(self, n1, n2, n3, pipeline=False):
+    t = time.time()
+    self.daq.mesh3D(self.motors[0], -1., 1., n1-1, self.motors[1], -1., 1., n2-1,
+                    self.motors[2], -1., 1., n3-1, self.events, *self.dets, pipeline=pipeline)
+    return self._scan_result(time.time() - t, n1*n2*n3)
+
+  def bench_iterscan(self, npoints):
+    from blbase import iterscan
+    positions = [0.01*(i % 2) for i in range(npoints)]
+    scan = iterscan.IterScan(self.motors[0], iter(positions))
+    scan.do_print = False
+    t = time.time()
+    scan.scan()
+    t = time.time() - t
+    return dict(points=npoints, total_s=t, per_point_s=t/npoints, points_per_s=npoints/t)
+
+  def bench_delayscan(self, duration):
+    from blbase import delay_scan
+    m = self.motors[0]
+    sm = self.sim.motors[self.pvs[0]]
+    ds = delay_scan.DelayScan(self.daq, m, m)
+    n0 = sm.nmoves
+    t = time.time()
+    ds(points=[0., 0.05], duration=duration)
+    t = time.time() - t
+    sweeps = sm.nmoves - n0
+    return dict(duration_s=duration, total_s=t, sweeps=sweeps, sweeps_per_s=sweeps/duration)
+
+  def bench_smartmotor(self, n):
+    """ SmartMotor construction: connections plus the parameter fetch """
+    from blbase.smartMotor import SmartMotor
+    times = []
+    for i in range(n):
+      t = time.time()
+      SmartMotor(self.pvs[i % len(self.pvs)])
+      times.append(time.time() - t)
+    times.sort()
+    return dict(motors=n, total_s=sum(times), init_mean_s=sum(times)/n,
+                init_max_s=times[-1])
+
+  def _burst_result(self, steps):
+    """ time between bursts minus the simulated motion of each step """
+    b = self.linac.bursts
+    gaps = [b[i+1] - b[i] for i in range(len(b)-1)]
+    moves = [self.sim.motors[pv].profile(p0, p1)[0] for pv, p0, p1 in steps]
+    dead = [g - m for g, m in zip(gaps, moves)]
+    return dict(points=len(b), total_s=b[-1] - b[0], per_point_s=sum(gaps)/len(gaps),
+                dead_per_point_s=sum(dead)/len(dead), dead_max_s=max(dead))
+
+  def bench_burstscan(self, npoints):
+    from blbase import burstScan
+    m = self.motors[0]
+    m.move(0., wait=True)
+    self.linac.bursts = []
+    burstScan.ascan(m, 0., 0.1, npoints-1, returnAfter=False)
+    pos = [0.1*i/(npoints-1) for i in range(npoints)]
+    return self._burst_result([(self.pvs[0], pos[i], pos[i+1]) for i in range(npoints-1)])
+
+  def bench_burstscan2D(self, n1, n2):
+    from blbase import burstScan
+    m1, m2 = self.motors[0], self.motors[1]
+    m1.move(0., wait=True)
+    m2.move(0., wait=True)
+    self.linac.bursts = []
+    burstScan.a2scan(m1, 0., 0.1, n1-1, m2, 0., 0.1, n2-1, returnAfter=False)
+    pos2 = [0.1*i/(n2-1) for i in range(n2)]
+    steps = []
+    for i in range(n1):
+      steps += [(self.pvs[1], pos2[j], pos2[j+1]) for j in range(n2-1)]
+      if i+1 < n1:
+        # outer step: both motors move, the inner one back to its start
+        steps.append((self.pvs[1], pos2[-1], pos2[0]))
+    return self._burst_result(steps)
+
+  def bench_gige(self, duration, rate=30.):
+    from blbase.gige import GigeCam
+    pvname = "SIM:BENCH:GIGE"
+    cam = self.sim.cameras.get(pvname) or self.sim.add_camera(pvname, shape=(480, 640), rate=rate)
+    t = time.time()
+    gige = GigeCam(pvname)
+    init = time.time() - t
+    cam.start()
+    gige.start_stream(size=32)
+    time.sleep(duration)
+    cam.stop()
+    stats = gige.stream_stats()
+    gige.stop_stream()
+    return dict(init_mean_s=init, frames=stats["frames"], dropped=stats["dropped"],
+                rate_hz=stats["mean_rate"], target_rate_hz=rate)
+
+  def bench_status(self, n, latency=0.001):
+    """ status printout of n gauges, valves and ion pumps, a control EVR
+    and a laser system: serial Pv.get of their status pvs against one
+    snapshot, with latency seconds per simulated round trip """
+    from blutil import snapshot
+    from blbase.vacuum import Valve, Gauge, IonPump
+    from blbase.controlevr import ControlEVR
+    from blbase.lasersystem import LaserSystem
+    devices = []
+    for i in range(n):
+      devices += [Valve("SIM:BENCH:VGC:%02d" % i, "vgc%d" % i),
+                  Gauge("SIM:BENCH:GCC:%02d" % i, "gcc%d" % i),
+                  IonPump("SIM:BENCH:PIP:%02d" % i, "pip%d" % i)]
+    devices += ControlEVR("SIM:BENCH:EVR").triggers()
+    devices.append(LaserSystem(system=3, beamline="xpp"))
+    old = self.sim.latency
+    self.sim.latency = latency
+    try:
+      res = snapshot.compare(devices)
+    finally:
+      self.sim.latency = old
+    res["speedup"] = res["serial_s"]/res["snapshot_s"]
+    return res
+
+def run(quick=False, pipeline=False, verbose=False, **kw):
+  """
+  Run the benchmark suite and return the report dictionary. quick uses
+  smaller scans; pipeline runs the Daq scans with pipeline=True; the
+  other keywords go to Bench (rate, events, latency, velocity, accel).
+  """
+  sizes = SIZES["quick" if quick else "full"]
+  bench = Bench(**kw)
+  results = {}
+  def record(name, func, *args):
+    try:
+      with _quiet(not verbose):
+        results[name] = func(*args)
+    except ImportError, e:
+      # the device module needs something the simulation does not provide
+      print "%-22s skipped (%s)" % (name, e)
+      return
+    print "%-22s %s" % (name, _summary(results[name]))
+  try:
+    record("move", bench.bench_move, sizes["moves"])
+    record("wait_all", bench.bench_wait_all, sizes["moves"])
+    for n in sizes["ascan"]:
+      record("ascan_%d" % n, bench.bench_ascan, n, pipeline)
+    for n1, n2 in sizes["mesh2D"]:
+      record("mesh2D_%dx%d" % (n1, n2), bench.bench_mesh2D, n1, n2, pipeline)
+    for n1, n2, n3 in sizes["mesh3D"]:
+      record("mesh3D_%dx%dx%d" % (n1, n2, n3), bench.bench_mesh3D, n1, n2, n3, pipeline)
+    record("iterscan_%d" % sizes["iterscan"], bench.bench_iterscan, sizes["iterscan"])
+    record("delayscan", bench.bench_delayscan, sizes["delayscan"])
+    record("smartmotor", bench.bench_smartmotor, sizes["smartmotor"])
+    record("burstscan_%d" % sizes["burstscan"], bench.bench_burstscan, sizes["burstscan"])
+    record("burstscan_%dx%d" % sizes["burst2D"], bench.bench_burstscan2D, *sizes["burst2D"])
+    record("gige", bench.bench_gige, sizes["gige"])
+    record("status", bench.bench_status, sizes["status"])
+  finally:
+    bench.close()
+  meta = dict(commit=_git_commit(), date=time.strftime("%Y-%m-%d %H:%M:%S"),
+              host=platform.node(), python=platform.python_version(),
+              quick=quick, pipeline=pipeline, rate=bench.sim.daq_rate,
+              events=bench.events, latency=bench.sim.latency)
+  return dict(meta=meta, results=results)
+
+def _summary(res):
+  keys = ["total_s", "per_point_s", "dead_per_point_s", "overhead_mean_s", "sweeps_per_s", "init_mean_s", "rate_hz", "dropped", "serial_s", "snapshot_s", "speedup"]
+  return "  ".join("%s=%.4g" % (k, res[k]) for k in keys if k in res)
+
+def save(report, fname):
+  with open(fname, "w") as f:
+    json.dump(report, f, indent=1, sort_keys=True)
+
+def load(fname):
+  with open(fname) as f:
+    return json.load(f)
+
+def compare(old, new):
+  """ print the results of two reports side by side, new/old ratios """
+  print "%-22s %-18s %12s %12s %8s" % ("benchmark", "metric", old["meta"].get("commit", "old"),
+                                       new["meta"].get("commit", "new"), "ratio")
+  for name in sorted(set(old["results"]) | set(new["results"])):
+    a = old["results"].get(name, {})
+    b = new["results"].get(name, {})
+    for key in sorted(set(a) | set(b)):
+      if key.endswith("_s"):
+        va = a.get(key, float("nan"))
+        vb = b.get(key, float("nan"))
+        ratio = vb/va if va else float("nan")
+        print "%-22s %-18s %12.4g %12.4g %8.2f" % (name, key, va, vb, ratio)
+
+if __name__ == "__main__":
+  import argparse
+  import matplotlib
+  # the Daq scans plot, draw off screen so that no display is needed
+  matplotlib.use("Agg")
+  parser = argparse.ArgumentParser(description="scan benchmarks on the simulated backend")
+  parser.add_argument("--quick", action="store_true", help="smaller scans")
+  parser.add_argument("--pipeline", action="store_true", help="run Daq scans with pipeline=True")
+  parser.add_argument("--latency", type=float, default=0.0, help="simulated CA latency (s)")
+  parser.add_argument("--rate", type=float, default=1200., help="simulated DAQ rate (Hz)")
+  parser.add_argument("--events", type=int, default=12, help="events per scan point")
+  parser.add_argument("--out", help="save the report as json")
+  parser.add_argument("--compare", help="json report to compare with")
+  parser.add_argument("--verbose", action="store_true", help="show the scan output")
+  args = parser.parse_args()
+  report = run(quick=args.quick, pipeline=args.pipeline, verbose=args.verbose,
+               rate=args.rate, events=args.events, latency=args.latency)
+  if args.out:
+    save(report, args.out)
+  if args.compare:
+    compare(load(args.compare), report)
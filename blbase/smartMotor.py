@@ -1,46 +1,119 @@
 import pyca
 import sys
 import time
+import threading
 from psp.caget import caget
 from math import fabs
 from psp.Pv import Pv
+from blutil import snapshot
 
 DEFAULT_TIMEOUT = 60
 EPICS_OVERHEAD = 5
+CONNECT_TIMEOUT = 1.0
+# time a move is given to show up as DMOV=0 before wait() stops looking
+START_TIMEOUT = 0.5
+
+# fields that are kept monitored for the life of a SmartMotor
+MONITORED = ('.RBV', '.DMOV', '.LLM', '.HLM', '.LLS', '.HLS')
+# fields read once by update(): (attribute, field)
+PARAMETERS = (
+    ('egu', '.EGU'),
+    ('base_speed', '.SBAS'),
+    ('speed', '.S'),
+    ('accel', '.ACCL'),
+    ('base_speed_egu', '.VBAS'),
+    ('speed_egu', '.VELO'),
+    ('backlash_speed', '.SBAK'),
+    ('backlash_accel', '.BACC'),
+    ('backlash_dist', '.BDST'),
+    ('description', '.DESC'),
+)
 
 class SmartMotor:
-    def __init__(self, motor_channel, motor_name=None, active_monitoring=False):
+    def __init__(self, motor_channel, motor_name=None, active_monitoring=False,
+                 timeout=CONNECT_TIMEOUT):
         self.motor_channel = motor_channel
         self.motor_name = motor_name
         self.active_monitoring = active_monitoring
-        
+        self.timeout = timeout
+        self.__cond = threading.Condition()
+        self.__started = True
+
+        # Start every channel before waiting on any of them: the monitored
+        # fields connect while the parameters are fetched, all on one
+        # deadline.
+        deadline = time.time() + timeout
         self.__move_pv = Pv(motor_channel)
-        self.__move_pv.connect(1.0)
-#        self.__pos_pv = Pv(self.__get_pv_name('.RBV'))
-#        self.__pos_pv.connect(1.0)
-        self.__dmovpv = Pv(self.__get_pv_name('.DMOV'))
-
-        self.update()
+        self.__move_pv.connect()
+        self.__mon = {}
+        for field in MONITORED:
+            pv = Pv(self.__get_pv_name(field), monitor=True)
+            pv.add_monitor_callback(self.__monitor_cb_factory(field, pv))
+            pv.do_initialize = True
+            pv.connect()
+            self.__mon[field] = pv
+        self.__dmovpv = self.__mon['.DMOV']
+
+        self.update(timeout=max(deadline - time.time(), 0))
+        with self.__cond:
+            while not all(pv.isinitialized for pv in self.__mon.values()):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+        pyca.pend_io(max(deadline - time.time(), 0.01))
         pass
 
-
-    def update(self):
-        self.egu = self.__get('.EGU')
-        self.ulim_lo = self.__get('.LLM')
-        self.ulim_hi = self.__get('.HLM')
-        self.base_speed = self.__get('.SBAS')
-        self.speed = self.__get('.S')
-        self.accel = self.__get('.ACCL')
-        self.base_speed_egu = self.__get('.VELO')
-        self.speed_egu = self.__get('.VELO')
-        self.backlash_speed = self.__get('.SBAK')
-        self.backlash_accel = self.__get('.BACC')
-        self.backlash_dist = self.__get('.BDST')
+    def __monitor_cb_factory(self, field, pv):
+        def monitor_cb(e=None):
+            if e is None:
+                with self.__cond:
+                    if field == '.DMOV' and pv.value == 0:
+                        self.__started = True
+                    self.__cond.notify_all()
+        return monitor_cb
+
+    def update(self, timeout=None):
+        """
+        Read all static motor parameters in one concurrent batch.
+        Missing replies fall back to single reads.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        names = [self.__get_pv_name(field) for attr, field in PARAMETERS]
+        values, errors = snapshot.read(names, timeout)
+        for (attr, field), name in zip(PARAMETERS, names):
+            if name in values:
+                setattr(self, attr, values[name])
+            else:
+                setattr(self, attr, self.__get(field))
         if (self.motor_name is None):
-            self.motor_name = self.__get('.DESC')
+            self.motor_name = self.description
             pass
         pass
 
+    @property
+    def name(self):
+        return self.motor_name
+
+    @property
+    def ulim_lo(self):
+        return self.__value('.LLM')
+
+    @property
+    def ulim_hi(self):
+        return self.__value('.HLM')
+
+    def __value(self, field):
+        """
+        Latest monitored value of field, or a single read if its channel did
+        not connect.
+        """
+        pv = self.__mon[field]
+        if pv.isinitialized:
+            return pv.value
+        return self.__get(field)
+
     # TODO:  Add logic to consider backlash:
     def is_in_range(self, pos):
         return not (pos < self.ulim_lo or pos > self.ulim_hi)
@@ -57,23 +130,51 @@ class SmartMotor:
         
 
     def is_in_range_relative(self, offset):
-        return is_in_range(self.get_position() + offset)
+        return self.is_in_range(self.get_position() + offset)
 
+    def within_limits(self, pos=None):
+        """
+        Scan interface: is pos (default: the current position) within the
+        user limits.
+        """
+        if pos is None:
+            pos = self.get_position()
+        return self.is_in_range(pos)
 
     def get_position(self):
-        return caget(self.__get_pv_name('.RBV'))
-#        self.__pos_pv.get(False, 5.0)
-#        return self.__pos_pv.value
-
+        return self.__value('.RBV')
 
+    def wm(self):
+        return self.get_position()
 
     def move(self, pos):
+        with self.__cond:
+            self.__started = False
         self.__move_pv.put(pos)
         pyca.pend_io(.5)
         pass
 
     def wait(self, timeout=DEFAULT_TIMEOUT):
-        self.__dmovpv.wait_for_value(1, timeout)
+        """
+        Wait for the last move to start (DMOV 0) and to finish (DMOV 1).
+        A move that does not show up within START_TIMEOUT is taken as done.
+        Returns True if DMOV is 1.
+        """
+        deadline = time.time() + timeout
+        start_deadline = min(deadline, time.time() + START_TIMEOUT)
+        dmov = self.__dmovpv
+        with self.__cond:
+            while not self.__started:
+                remaining = start_deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            while dmov.value != 1:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            return dmov.value == 1
 
 
     def move_wait(self, pos, timeout=None):
@@ -124,11 +225,11 @@ class SmartMotor:
 
     # todo: add backlash checks
     def checkLimits(self):
-        lim_lo = self.__get('.LLS')
+        lim_lo = self.__value('.LLS')
         if (lim_lo == 1):
             return -1
         else:
-            lim_hi = self.__get('.HLS')
+            lim_hi = self.__value('.HLS')
             if (lim_hi == 1):
                 return 1
             else:
@@ -1,5 +1,13 @@
+import os
+import re
+import json
+import time
+import threading
 import psp.Pv as pv
 from types import MethodType
+from blutil import snapshot
+
+cache_dir = os.path.expanduser("~/.pyps_cache")
 
 def myFormat(state):
     return "_" + state.lower()
@@ -20,50 +28,168 @@ class stateiocDevice:
     -mbbi records at :GO that allow us to move to a state,
     -booleans at :STATE that tell us if we're at the state.
     -floats at :STATE_SET that save the state's value
+
+    The state table (names, positions and deltas) is cached on disk per PV
+    prefix, so only the first construction has to ask the IOC for it. Call
+    refresh() to read it again if the IOC changed. The monitored pvs all
+    connect at once and are waited for on one deadline of timeout seconds.
     """
     _strFields = ["ZRST", "ONST", "TWST", "THST", "FRST", "FVST", "SXST",
                   "SVST", "EIST", "NIST", "TEST", "ELST", "TVST", "TTST",
                   "FTST", "FFST"]
     _badStates = ["unknown"]
 
-    def __init__(self, PV):
+    def __init__(self, PV, use_cache=True, timeout=5.0):
         """
         Builds all of the object's methods from the PV. You can expect the
         object to have methods like move_in, move_out, etc. for each position
         of the device.
         """
-        self._PV = pv.Pv(PV)
+        self._prefix = PV
+        self._timeout = timeout
+        self._cond = threading.Condition()
+        self._PV = self._connect(PV)
         self._PVGO = pv.Pv(PV + ":GO")
-        self._mbbiStates = []
-        self._mbboStates = []
-        mbbiPVs = [None] * 16
-        mbboPVs = [None] * 16
-        for i in range(16):
-            fld = self._strFields[i]
-            mbbiPVs[i] = pv.Pv("{0}.{1}".format(PV, fld), initialize=True)
-            mbboPVs[i] = pv.Pv("{0}:GO.{1}".format(PV, fld), initialize=True)
-        for i in range(16):
-            mbboPVs[i].wait_ready()
-            outStr = mbboPVs[i].get()
+        self._methodNames = []
+        self._setPVs = []
+        self._deltaPVs = []
+        table = None
+        if use_cache:
+            table = load_table(PV)
+        if table is None:
+            table, complete = self._readTable()
+            if table["mbbo"] and complete:
+                save_table(PV, table)
+        self._build(table)
+        # Temporary wait handler while the IOC doesn't directly support wait
+        self._lastMove = None
+
+    def refresh(self):
+        """
+        Reads the state table from the IOC again, rebuilds the methods and
+        updates the cache.
+        """
+        table, complete = self._readTable()
+        if not table["mbbo"]:
+            print "Could not read the states of {0}.".format(self._prefix)
+            return
+        if complete:
+            save_table(self._prefix, table)
+        else:
+            print "Not all states of {0} replied, cache not updated.".format(self._prefix)
+        self._build(table)
+
+    def _readTable(self):
+        """
+        Returns (table, complete); complete is False if some of the pvs did
+        not reply in time, the table should then not be cached.
+        """
+        PV = self._prefix
+        mbbiNames = ["{0}.{1}".format(PV, fld) for fld in self._strFields]
+        mbboNames = ["{0}:GO.{1}".format(PV, fld) for fld in self._strFields]
+        names = mbbiNames + mbboNames
+        values = connect_all(names, self._timeout)
+        complete = len(values) == len(names)
+        mbbi = []
+        mbbo = []
+        for inName, outName in zip(mbbiNames, mbboNames):
+            outStr = values.get(outName)
+            if outStr is None:
+                # no reply: use the readback name, the states go on
+                outStr = values.get(inName)
+                if outStr is None:
+                    break
             if outStr == "":
                 break
-            mbbiPVs[i].wait_ready()
-            inStr = mbbiPVs[i].get()
-            self._mbbiStates += [inStr]
-            self._mbboStates += [outStr]
+            mbbi.append(values.get(inName, outStr))
+            mbbo.append(outStr)
+        good = [s for s in mbbo if s.lower() not in self._badStates]
+        setNames = ["{0}:{1}_SET".format(PV, s) for s in good]
+        deltaNames = ["{0}:{1}_DELTA".format(PV, s) for s in good]
+        values = connect_all(setNames + deltaNames, self._timeout)
+        complete = complete and len(values) == len(setNames + deltaNames)
+        pos = {}
+        delta = {}
+        for state, setName, deltaName in zip(good, setNames, deltaNames):
+            pos[state] = values.get(setName)
+            delta[state] = values.get(deltaName)
+        return dict(mbbi=mbbi, mbbo=mbbo, pos=pos, delta=delta), complete
+
+    def _build(self, table):
+        PV = self._prefix
+        for name in self._methodNames:
+            delattr(self, name)
+        self._methodNames = []
+        # stop the monitors of the old table, they write to the old lists
+        for p in self._setPVs + self._deltaPVs:
+            if p is not None:
+                p.disconnect()
+        # json gives unicode, pyca wants plain strings
+        self._mbbiStates = [str(s) for s in table["mbbi"]]
+        self._mbboStates = [str(s) for s in table["mbbo"]]
         nStates = len(self._mbbiStates)
         self._statePVs = [None] * nStates
         self._setPVs = [None] * nStates
         self._deltaPVs = [None] * nStates
+        self._pos = [None] * nStates
+        self._delta = [None] * nStates
         for i in range(nStates):
             state = self._mbboStates[i]
             if state.lower() not in self._badStates:
+                self._pos[i] = table["pos"].get(state)
+                self._delta[i] = table["delta"].get(state)
                 self._statePVs[i] = pv.Pv("{0}:{1}".format(PV, state))
-                self._setPVs[i] = pv.Pv("{0}:{1}_SET".format(PV, state))
-                self._deltaPVs[i] = pv.Pv("{0}:{1}_DELTA".format(PV, state))
+                self._setPVs[i] = self._monitor(
+                    "{0}:{1}_SET".format(PV, state), self._pos, i)
+                self._deltaPVs[i] = self._monitor(
+                    "{0}:{1}_DELTA".format(PV, state), self._delta, i)
                 self._addMethods(i, self._mbbiStates[i])
-        # Temporary wait handler while the IOC doesn't directly support wait
-        self._lastMove = self._PV.get()
+        pvs = [self._PV] + [p for p in self._setPVs + self._deltaPVs if p is not None]
+        missing = self._waitInitialized(pvs)
+        if missing:
+            print "No reply from {0}.".format(", ".join(missing))
+
+    def _connect(self, name, callback=None):
+        """
+        Returns a monitored pv that starts connecting without waiting for
+        it; its first value comes with the first monitor callback.
+        """
+        p = pv.Pv(name, monitor=True)
+        def notify(e=None):
+            if callback is not None and e is None:
+                callback(p)
+            with self._cond:
+                self._cond.notify_all()
+        p.add_monitor_callback(notify)
+        p.do_initialize = True
+        try:
+            p.connect()
+        except Exception:
+            # left for _waitInitialized to report
+            pass
+        return p
+
+    def _monitor(self, name, values, index):
+        """
+        Returns a monitored pv that keeps values[index] up to date.
+        """
+        def update(p):
+            values[index] = p.value
+        return self._connect(name, update)
+
+    def _waitInitialized(self, pvs):
+        """
+        Waits on one deadline of timeout seconds until all pvs have a value.
+        Returns the names of the pvs that have none.
+        """
+        deadline = time.time() + self._timeout
+        with self._cond:
+            while True:
+                missing = [p.name for p in pvs if not p.isinitialized]
+                remaining = deadline - time.time()
+                if not missing or remaining <= 0:
+                    return missing
+                self._cond.wait(remaining)
 
     def move(self, state):
         """ Moves motor to state. Useful for scripting (no tab completion) """
@@ -96,8 +222,14 @@ class stateiocDevice:
 
     def state(self):
         """ Returns the state of this motor. """
+        if self._PV.isinitialized:
+            return self._mbbiStates[self._PV.value]
         return self._mbbiStates[self._PV.get()]
 
+    def state_name(self, value):
+        """ Returns the name of the state with readback value. """
+        return self._mbbiStates[value]
+
     def statesAll(self):
         states = []
         for s in self._mbbiStates:
@@ -120,7 +252,9 @@ class stateiocDevice:
             return self._getPos(index)
 
     def _getPos(self, index):
-        return self._setPVs[index].get()
+        if self._pos[index] is None:
+            self._pos[index] = self._setPVs[index].get()
+        return self._pos[index]
 
     def statePosAll(self):
         """ Returns all set positions as a dictionary. """
@@ -138,6 +272,8 @@ class stateiocDevice:
 
     def _setPos(self, index, pos):
         self._setPVs[index].put(pos)
+        self._pos[index] = pos
+        self._saveTable()
 
     def stateDelta(self, state):
         """ Gets the delta (allowed deviation) of state. """
@@ -146,7 +282,9 @@ class stateiocDevice:
             return self._getDelta(index)
 
     def _getDelta(self, index):
-        return self._deltaPVs[index].get()
+        if self._delta[index] is None:
+            self._delta[index] = self._deltaPVs[index].get()
+        return self._delta[index]
 
     def setStateDelta(self, state, delta):
         """ Sets the state's delta (allowed deviation) in the IOC. """
@@ -156,13 +294,26 @@ class stateiocDevice:
 
     def _setDelta(self, index, delta):
         self._deltaPVs[index].put(delta)
+        self._delta[index] = delta
+        self._saveTable()
+
+    def _saveTable(self):
+        pos = {}
+        delta = {}
+        for i, state in enumerate(self._mbboStates):
+            if state.lower() not in self._badStates:
+                pos[state] = self._pos[i]
+                delta[state] = self._delta[i]
+        save_table(self._prefix, dict(mbbi=self._mbbiStates,
+            mbbo=self._mbboStates, pos=pos, delta=delta))
 
     def wait(self):
         """
         Checks if the motor is in the last position it was told to move to.
         If not, waits until the motor is in this position.
         """
-        self._PV.wait_for_value(self._lastMove)
+        if self._lastMove is not None:
+            self._PV.wait_for_value(self._lastMove)
 
     def _addMethods(self, index, inS):
         def moveMethod(self):
@@ -189,7 +340,47 @@ class stateiocDevice:
         bindMethod(self, "setPos" + myFormat(inS), setPosMethod)
         bindMethod(self, "getDelta" + myFormat(inS), getDeltaMethod)
         bindMethod(self, "setDelta" + myFormat(inS), setDeltaMethod)
+        for prefix in ("move", "is", "getPos", "setPos", "getDelta", "setDelta"):
+            self._methodNames.append(prefix + myFormat(inS))
 
 def bindMethod(obj, methodName, method):
     setattr(obj, methodName, MethodType(method, obj))
 
+
+def connect_all(names, timeout=5.0):
+    """
+    Reads all of names at once on one deadline of timeout seconds, see
+    blutil.snapshot.read. Returns a dictionary name: value for the pvs that
+    replied in time.
+    """
+    values, errors = snapshot.read(names, timeout)
+    return values
+
+def _cache_path(prefix):
+    name = re.sub("[^A-Za-z0-9_.-]", "_", prefix)
+    return os.path.join(cache_dir, "stateioc_" + name + ".json")
+
+def load_table(prefix):
+    """
+    Returns the cached state table of prefix, or None if there is none.
+    """
+    try:
+        with open(_cache_path(prefix), "r") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_table(prefix, table):
+    """
+    Saves the state table of prefix to the cache.
+    """
+    path = _cache_path(prefix)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(table, f)
+        os.rename(tmp, path)
+    except (IOError, OSError), exc:
+        print "Could not save state cache: {0}".format(exc)
@@ -1,5 +1,5 @@
 import psp.Pv as Pv
-from blutil import estr
+from blutil import estr, snapshot
 from blutil.pypslog import logprint
 
 class Valve:
@@ -54,8 +54,17 @@ class Valve:
     or both open AND closed,
     status will be reported as 'NOT KNOWN'
     """
-    op = self.isopen()
-    cl = self.isclosed()
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    return {"opn_di": self._opn_di, "cls_di": self._cls_di}
+
+  def _isclosed(self,values):
+    return values["cls_di"] == 1
+
+  def format_status(self,values):
+    op = values["opn_di"] == 1
+    cl = self._isclosed(values)
     if ((op and cl) or (not op and not cl)):
       vstatus=estr("NOT KNOWN", color='red',type='normal')     
     elif op:
@@ -85,6 +94,9 @@ class LeyboldValve(Valve):
   def isclosed(self):
     """ returns True if valve is not commanded open """
     return Pv.get(self._opn_di) == 0
+
+  def _isclosed(self,values):
+    return values["opn_di"] == 0
  
 
 class Gauge:
@@ -125,12 +137,20 @@ class Gauge:
 
   def status(self):
     """ Returns the gauge reading """
-    g_on = Pv.get(self.__statusmon)
-    if (g_on !=0):
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    return {"statusmon": self.__statusmon, "pmon": self.__pmon}
+
+  def format_status(self,values):
+    g_on = values["statusmon"]
+    if (g_on is None):
+      gstatus=estr("Unknown",color='red',type='normal')
+    elif (g_on !=0):
       gstatus=estr("Gauge Off",color='white',type='normal')
       str="%s: %s" % (self.name,gstatus)
     else:
-      pressure=Pv.get(self.__pmon)
+      pressure=values["pmon"]
       if pressure<5e-8:
         gstatus=estr("%.1e Torr" % pressure ,color='green',type='normal')
       elif pressure<1e-6:
@@ -174,11 +194,19 @@ class IonPump:
   
   def status(self):
     """ Returns the ion pump pressure reading """
-    p_on = Pv.get(self.__statemon)
-    if (p_on ==0):
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    return {"statemon": self.__statemon, "pmon": self.__pmon}
+
+  def format_status(self,values):
+    p_on = values["statemon"]
+    if (p_on is None):
+      pstatus=estr("Unknown",color='red',type='normal')
+    elif (p_on ==0):
       pstatus=estr("Ion Pump Off",color='white',type='normal')
     else:
-      pressure=Pv.get(self.__pmon)
+      pressure=values["pmon"]
       if pressure<5e-8:
         pstatus=estr("%.2e Torr" % pressure ,color='green',type='normal')
       elif pressure<1e-6:
@@ -195,18 +223,22 @@ class IonPump:
 
   def info(self):
     """ Returns the ion pump information """
-    current = Pv.get(self.__imon)
-    voltage = Pv.get(self.__vmon)
-    controller = Pv.get(self.__vpcname)
-    pumpsize = Pv.get(self.__pumpsize)
-    statemon = Pv.get(self.__statemon)
+    pvs = {"imon": self.__imon, "vmon": self.__vmon, "vpcname": self.__vpcname,
+           "pumpsize": self.__pumpsize}
+    pvs.update(self.status_pvs())
+    v = snapshot.read_dict(pvs)
+    current = v["imon"]
+    voltage = v["vmon"]
+    controller = v["vpcname"]
+    pumpsize = v["pumpsize"]
+    statemon = v["statemon"]
     if (statemon ==0):
       state=estr("Off",color='red',type='normal')
     elif (statemon ==1):
       state="On"
     else:
       state=estr("Unknown",color='white',type='normal')
-    str="   %s\n" % (self.status())
+    str="   %s\n" % (self.format_status(v))
     str += "   Current: %.2e Amps\n" % current
     str += "   Voltage: %4.0f Volts\n" % voltage
     str += "     State: %s\n" % state
@@ -1,6 +1,93 @@
 import socket
 import time
 import struct
+import numpy as np
+
+VICP_DATA = 0x80
+VICP_EOI  = 0x01
+
+# WAVEDESC fields used: name, byte offset, struct format (LECROY_2_3 template)
+WAVEDESC_FIELDS = (
+  ("comm_type",         32, "h"),
+  ("comm_order",        34, "h"),
+  ("wave_descriptor",   36, "l"),
+  ("user_text",         40, "l"),
+  ("res_desc1",         44, "l"),
+  ("trigtime_array",    48, "l"),
+  ("ris_time_array",    52, "l"),
+  ("res_array1",        56, "l"),
+  ("wave_array_1",      60, "l"),
+  ("wave_array_count", 116, "l"),
+  ("first_valid_pnt",  124, "l"),
+  ("last_valid_pnt",   128, "l"),
+  ("vertical_gain",    156, "f"),
+  ("vertical_offset",  160, "f"),
+  ("horiz_interval",   176, "f"),
+  ("horiz_offset",     180, "d"),
+)
+
+def parse_wavedesc(buf,pos=0):
+  """ decodes the WAVEDESC block starting at pos of buf into a dict """
+  # COMM_ORDER: 0 = big endian, 1 = little endian
+  order = ">" if struct.unpack_from("<h",buf,pos+34)[0] == 0 else "<"
+  desc = {}
+  for name,offset,fmt in WAVEDESC_FIELDS:
+    desc[name] = struct.unpack_from(order+fmt,buf,pos+offset)[0]
+  desc["order"] = order
+  return desc
+
+def parse_waveform(reply):
+  """ splits a WF? reply ("C1:WF ALL,#9nnnnnnnnn<block>") into the decoded
+  WAVEDESC and the raw data array (a view on reply, no copy) """
+  pos = reply.find("WAVEDESC")
+  if pos < 0:
+    raise ValueError("no WAVEDESC in waveform reply")
+  desc = parse_wavedesc(reply,pos)
+  start = pos + desc["wave_descriptor"] + desc["user_text"] + desc["res_desc1"] \
+          + desc["trigtime_array"] + desc["ris_time_array"] + desc["res_array1"]
+  dtype = np.dtype(desc["order"] + ("i2" if desc["comm_type"] == 1 else "i1"))
+  count = desc["wave_array_1"] // dtype.itemsize
+  raw = np.frombuffer(reply,dtype=dtype,count=count,offset=start)
+  return desc,raw
+
+class WaveformRing(object):
+  """ preallocated ring buffer of size waveforms of npts points """
+  def __init__(self,size,npts):
+    self.data = np.zeros((size,npts))
+    self.t0 = np.zeros(size) # time of the first point of each waveform
+    self.stamps = np.zeros(size) # host time when each waveform arrived
+    self.count = 0
+    self.nbytes = 0
+    self.start = time.time()
+
+  def append(self,y,t0=0.):
+    i = self.count % len(self.data)
+    n = min(len(y),self.data.shape[1])
+    self.data[i,:n] = y[:n]
+    self.t0[i] = t0
+    self.stamps[i] = time.time()
+    self.count += 1
+    self.nbytes += y.nbytes
+
+  def latest(self,n=None):
+    """ returns the last n waveforms (default all stored), oldest first """
+    size = len(self.data)
+    n = min(self.count,size) if n is None else min(n,self.count,size)
+    idx = (np.arange(self.count-n,self.count)) % size
+    return self.data[idx]
+
+  def stats(self):
+    """ returns dict with count, dropped (overwritten), elapsed time,
+    waveforms per second and MB per second """
+    elapsed = time.time()-self.start
+    return dict(count=self.count, dropped=max(0,self.count-len(self.data)),
+                elapsed=elapsed, rate=self.count/elapsed if elapsed > 0 else 0.,
+                mbps=self.nbytes/elapsed/1e6 if elapsed > 0 else 0.)
+
+  def print_stats(self):
+    s = self.stats()
+    print "%d waveforms in %.2f s: %.1f waveforms/s, %.2f MB/s, %d overwritten" % (
+      s["count"],s["elapsed"],s["rate"],s["mbps"],s["dropped"])
 
 class value(object):
   def __init__(self,v,u,isint=False):
@@ -14,27 +101,54 @@ class value(object):
 
 class Wavesurfer:
 
-  def __init__(self,hostname):
-    self.address = (hostname, 1861)
+  def __init__(self,hostname,port=1861):
+    self.address = (hostname, port)
     self.socket = socket.socket()
+    # commands are small packets, don't let Nagle hold them back
+    self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
     self.socket.connect(self.address)
+    self.__seq = 0
+    self.__wf_format_set = False
+    self.wavedesc = None # descriptor of the last waveform read
     
   def query(self,command):
-    self.socket.send(self.__makeCommand(command))
-    reply = self.socket.recv(4096)
-    return reply[8:-1]
+    self.send(command)
+    return str(self.read_reply()).rstrip("\n")
   
   def send(self,command):
-    self.socket.send(self.__makeCommand(command))
+    self.socket.sendall(self.__makeCommand(command))
   
   def __makeCommand(self,command):
-    header = [0x81,1,0,0]
-    n = len (command)
-    count = [0, 0, (n>>8) & 0xff, n & 0xff]
-
-    header = struct.pack('BBBBBBBB', 0x81,1,0,0, 0, 0, (n>>8) & 0xff, n & 0xff)
+    # VICP header: operation (DATA|EOI), version, sequence, spare, length
+    self.__seq = self.__seq % 255 + 1
+    header = struct.pack('>BBBBI', VICP_DATA|VICP_EOI, 1, self.__seq, 0, len(command))
     return header+command  
-    
+
+  def __recv_exact(self,n):
+    """ reads exactly n bytes into a new bytearray """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+      k = self.socket.recv_into(view[pos:],n-pos)
+      if k == 0:
+        raise socket.error("connection closed after %d of %d bytes" % (pos,n))
+      pos += k
+    return buf
+
+  def read_reply(self):
+    """ reads VICP blocks until one has the EOI flag set and returns the
+    joined payload as a bytearray """
+    parts = []
+    while True:
+      op,version,seq,spare,n = struct.unpack('>BBBBI',str(self.__recv_exact(8)))
+      parts.append(self.__recv_exact(n))
+      if op & VICP_EOI:
+        break
+    if len(parts) == 1:
+      return parts[0]
+    return bytearray().join(parts)
+
   def close(self):
     self.socket.close()
 
@@ -56,9 +170,52 @@ class Wavesurfer:
   def clear_sweeps(self):
     self.send("CLEAR_SWEEPS")
     
-  def wait_for_pulse(self):
-    while self.query('TRMD?') == 'SINGLE':
-      pass
+  def wait_for_pulse(self,timeout=None):
+    """ waits until a SINGLE acquisition has triggered. Returns False on
+    timeout """
+    t0 = time.time()
+    dt = 0.0005
+    while self.query('TRMD?').endswith('SINGLE'):
+      if timeout is not None and time.time()-t0 > timeout:
+        return False
+      time.sleep(dt)
+      dt = min(2*dt,0.01)
+    return True
+
+  def get_waveform(self,channel=1):
+    """ reads the waveform of channel (number or name like "C1", "F1") in
+    binary form. Returns (t,y) numpy arrays in seconds and vertical units;
+    the decoded WAVEDESC is kept in self.wavedesc """
+    if not self.__wf_format_set:
+      self.send("CFMT DEF9,WORD,BIN")
+      self.send("CORD LO")
+      self.__wf_format_set = True
+    if isinstance(channel,int):
+      channel = "C%d" % channel
+    self.send("%s:WF? ALL" % channel)
+    desc,raw = parse_waveform(self.read_reply())
+    self.wavedesc = desc
+    y = raw*desc["vertical_gain"] - desc["vertical_offset"]
+    t = np.arange(len(raw))*desc["horiz_interval"] + desc["horiz_offset"]
+    return t,y
+
+  def stream_waveforms(self,n,channel=1,ring=None,timeout=10.):
+    """ acquires n triggered waveforms of channel into a ring buffer
+    (a WaveformRing, made with room for n waveforms if not given) and
+    returns it. Throughput statistics are in ring.stats() """
+    t,y = None,None
+    for i in range(n):
+      self.send("TRMD SINGLE")
+      if not self.wait_for_pulse(timeout):
+        print "wavesurfer: no trigger within %.1f s, stopping after %d waveforms" % (timeout,i)
+        break
+      t,y = self.get_waveform(channel)
+      if ring is None:
+        ring = WaveformRing(n,len(y))
+      ring.append(y,t[0])
+    if ring is not None:
+      ring.print_stats()
+    return ring
 
   def __get_custom_par(self,what):
     cmd = "PARAMETER_STATISTICS? CUST,%s" % what
@@ -14,6 +14,7 @@ import sys
 from blutil import estr
 from psp import Pv
 from blutil.pypslog import logprint
+from blbase.motor import wait_all
 
 gR = 3.175
 #    self.__D = 232.15
@@ -112,7 +113,7 @@ class CCM:
     y3=self.__inpos["y3"];
 #    myprint("moving x1,x2 to %f,%f" % (x1,x2))
     self.x1.move(x1); self.x2.move(x2)
-    self.x1.wait(); self.x2.wait()
+    wait_all((self.x1, self.x2))
 #    myprint("moving y1,y2,y3 to %f,%f" % (y1,y2,y3))
 #    self.y1.move(y1); self.y2.move(y2); self.y3.move(y3)
 
@@ -131,9 +132,7 @@ class CCM:
 
   def wait(self):
     """ Returns when x1,x2,y1,y2,y3 are not moving """
-    self.y1.wait(); self.y2.wait(); self.y3.wait()
-    self.x1.wait(); self.x2.wait()
-    self.alio.wait()
+    wait_all((self.y1, self.y2, self.y3, self.x1, self.x2, self.alio))
 
   def __update_PV(self):
     if (self.__pv_E is not None):
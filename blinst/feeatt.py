@@ -4,6 +4,7 @@ import blutil.attenuators as utilAtt
 import numpy as np
 import sys
 import blutil as util
+from blutil import snapshot
 import psp.Pv as Pv
 from blutil.pypslog import logprint
 from time import sleep
@@ -33,7 +34,8 @@ class Filter(object):
     att_len = self.att_len(E)
     return np.exp(-self.d/att_len)
   def wm(self):
-    v = Pv.get(self.pv_status)
+    return self.state_name(Pv.get(self.pv_status))
+  def state_name(self,v):
     if (v == 2):
       return "OUT"
     elif (v == 1):
@@ -154,7 +156,15 @@ class Feeatt(object):
 
 
   def status(self):
-    (v,s)=self.getT(printit=0)
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    return dict( (i,self.att[i].pv_status) for i in range(self.n) )
+
+  def format_status(self,values):
+    fin = [i for i in range(self.n) if self.att[i].state_name(values[i]) == "IN"]
+    fout = [i for i in range(self.n) if self.att[i].state_name(values[i]) == "OUT"]
+    (v,s)=utilAtt.formatT(self.att,self.__E,fin,fout)
     return s
 
   def __repr__(self):
@@ -3,6 +3,14 @@
 
 import numpy as np
 
+# calcWhat: (signal index, diode x corner, diode y corner) of the diodes used
+diode_sets = {
+  "v" : ((0,1), (-17.,7.), (-5.,-5.)),
+  "h" : ((2,3), (-5.,-5.), (7.,-17.)),
+  "c" : ((0,1,2,3), (-17.,7.,7.,-17.), (7.,7.,-17.,-17.)),
+  "d" : ((0,1,2,3), (-17.,7.,-5.,-5.), (-5.,-5.,7.,-17.)),
+}
+
 class IPMcalc:
   """ Class to calculate the IPM signal """
   def __init__(self, eBeam=2, XrayE=8.265, Npoints=1024):
@@ -26,11 +34,14 @@ class IPMcalc:
     r0_2=(2.818e-13)**2 # in cm^-2
     alpha=(12.398/(Lambda*1e4))/Me
     
-    Tvx = Tvy = np.arange(-self.N/2,self.N/2,1)
-    [tvx,tvy]=np.meshgrid(Tvx,Tvy) # create 2-D array
+    Tv = np.arange(-self.N/2,self.N/2,1)
     self.xL=self.L/self.N # increment in x and y in mm
-    self.xv=tvx*self.xL # create 2-D array in space, in mm
-    self.yv=tvy*self.xL 
+    # row and column vectors, broadcast to 2-D in the expressions below
+    self.xv=(Tv*self.xL)[np.newaxis,:] # in mm
+    self.yv=(Tv*self.xL)[:,np.newaxis]
+    # diode edge coordinates along both axes of the grid, see diodeEdges
+    self.coords=np.arange(self.N)*self.xL-self.L/2.
+    self._dio_cache={}
     theta=180-np.arctan(np.sqrt(self.xv * self.xv+self.yv * self.yv)/Zt)*180/np.pi
     phi=np.arctan(self.yv/(self.xv+1e-10))*180/np.pi
     sin_2_Lambda=np.sin((theta/2)/180*np.pi)/(Lambda*1e4)
@@ -67,6 +78,36 @@ class IPMcalc:
     average_charge=average_energy/3.6 # nC        
     self.average_vol=np.divide((average_charge*1000),self.capacitances) # in mV
 
+  def diodeEdges(self, dioX, dioY):
+    """ returns the (x,y) boolean vectors of the grid lines covered by a
+    diode with its corner at dioX,dioY. As in the original loop version the
+    first row and column are never masked """
+    inx=(self.coords >= dioX) & (self.coords <= dioX+self.diosq)
+    iny=(self.coords >= dioY) & (self.coords <= dioY+self.diosq)
+    inx[0]=True
+    iny[0]=True
+    return inx, iny
+
+  def diodeMask(self, dioX, dioY):
+    """ returns the full N x N mask of a diode, for inspection """
+    inx, iny=self.diodeEdges(dioX, dioY)
+    mask=np.outer(inx, iny).astype(float)
+    mask[0,:]=1
+    return mask
+
+  def calcDios(self, dioXs, dioYs):
+    """ returns the signal of many diodes at once, one per dioX,dioY pair.
+    Only the edge vectors are built, the N x N intensity is read once for
+    all of them """
+    dioXs=np.atleast_1d(np.asarray(dioXs, dtype=float))
+    dioYs=np.atleast_1d(np.asarray(dioYs, dtype=float))
+    inx=(self.coords >= dioXs[:,np.newaxis]) & (self.coords <= dioXs[:,np.newaxis]+self.diosq)
+    iny=(self.coords >= dioYs[:,np.newaxis]) & (self.coords <= dioYs[:,np.newaxis]+self.diosq)
+    iny[:,0]=True
+    # row 0 is always fully counted, the other rows only inside the diode
+    rows=np.dot(inx[:,1:].astype(float), self.int[1:])
+    return (rows*iny).sum(axis=1) + self.int[0].sum()
+
   def calcDio(self, dioX=999., dioY=999.):
     self.dio_x=-5.
     self.dio_y=7
@@ -74,48 +115,22 @@ class IPMcalc:
       dioX=self.dio_x
       if (dioY == 999.):
         dioY=self.dio_y
-        # define detector geometry
-    self.diode_geo_ar=np.ones((self.N,self.N))
-    for i in range(1,self.N):
-      xval=i*self.xL-self.L/2.
-      if (xval < dioX) or (xval > (dioX+self.diosq)):
-        self.diode_geo_ar[i,:]=0
-      else:
-        for j in range(1,self.N):
-          yval=j*self.xL-self.L/2.
-          if (yval < dioY) or (yval > (dioY+self.diosq)):
-            self.diode_geo_ar[i,j]=0
-
-    self.int_diode_geo=self.int*self.diode_geo_ar
-    int_diode_geo_total=sum(sum(self.int_diode_geo))
-    return int_diode_geo_total
+    key=(float(dioX), float(dioY))
+    if key not in self._dio_cache:
+      self._dio_cache[key]=self.calcDios([dioX], [dioY])[0]
+    return self._dio_cache[key]
 
   def calcIPMset(self, calcWhat="d"):
     signal = [0., 0., 0., 0.]
-    ndiode=4
-    if (calcWhat == "v"):
-      signal[0] = self.calcDio(-17., -5.)
-      signal[1] = self.calcDio(7., -5.)
-      ndiode=2
-    elif (calcWhat == "h"):
-      signal[2] = self.calcDio(-5., 7.)
-      signal[3] = self.calcDio(-5., -17.)
-      ndiode=2
-    elif (calcWhat == "c"):
-      signal[0] = self.calcDio(-17., 7.)
-      signal[1] = self.calcDio(7., 7.)
-      signal[2] = self.calcDio(7., -17.)
-      signal[3] = self.calcDio(-17., -17.)
-    elif (calcWhat == "c"):
-      signal[0] = self.calcDio(-25., 15.)
-      signal[1] = self.calcDio(15., 15.)
-      signal[2] = self.calcDio(15., -25.)
-      signal[3] = self.calcDio(-25., -25.)
-    else:
-      signal[0] = self.calcDio(-17., -5.)
-      signal[1] = self.calcDio(7., -5.)
-      signal[2] = self.calcDio(-5., 7.)
-      signal[3] = self.calcDio(-5., -17.)
+    idx, dioX, dioY = diode_sets.get(calcWhat, diode_sets["d"])
+    missing = [k for k in range(len(idx)) if (dioX[k], dioY[k]) not in self._dio_cache]
+    if missing:
+      values = self.calcDios([dioX[k] for k in missing], [dioY[k] for k in missing])
+      for k, val in zip(missing, values):
+        self._dio_cache[(dioX[k], dioY[k])] = val
+    for k, i in enumerate(idx):
+      signal[i] = self._dio_cache[(dioX[k], dioY[k])]
+    ndiode=len(idx)
 
     self.average_diode=(signal[0]+signal[1]+signal[2]+signal[3])/ndiode
     average_energy=self.average_diode/self.int_0*self.beam_energy*1e6 # nJ
@@ -125,6 +140,41 @@ class IPMcalc:
     average_vole=np.divide(self.average_vol,np.e) # in mV
     return self.average_vol
 
+  def calcIPMpositions(self, beamX, beamY, calcWhat="d"):
+    """ returns the diode signals for many beam positions at once.
+    beamX,beamY are the beam offsets in mm (arrays of the same length);
+    moving the beam by +b is the same as moving the diodes by -b.
+    Returns (signals, xratio, yratio): signals is an M x 4 array,
+    xratio=(s0-s1)/(s0+s1) and yratio=(s2-s3)/(s2+s3) (nan if unused) """
+    beamX=np.atleast_1d(np.asarray(beamX, dtype=float))
+    beamY=np.atleast_1d(np.asarray(beamY, dtype=float))
+    idx, dioX, dioY = diode_sets.get(calcWhat, diode_sets["d"])
+    dx=(np.asarray(dioX)[np.newaxis,:]-beamX[:,np.newaxis]).ravel()
+    dy=(np.asarray(dioY)[np.newaxis,:]-beamY[:,np.newaxis]).ravel()
+    values=self.calcDios(dx, dy).reshape(len(beamX), len(idx))
+    signals=np.zeros((len(beamX), 4))
+    signals[:,idx]=values
+    with np.errstate(invalid="ignore", divide="ignore"):
+      xratio=(signals[:,0]-signals[:,1])/(signals[:,0]+signals[:,1])
+      yratio=(signals[:,2]-signals[:,3])/(signals[:,2]+signals[:,3])
+    return signals, xratio, yratio
+
+  def benchmark(self, npos=100):
+    """ times calcIPMset (cold and cached) and calcIPMpositions for npos
+    beam positions; returns the times in seconds """
+    import time
+    self._dio_cache.clear()
+    t0=time.time()
+    self.calcIPMset()
+    t1=time.time()
+    self.calcIPMset()
+    t2=time.time()
+    pos=np.linspace(-1,1,npos)
+    self.calcIPMpositions(pos, pos)
+    t3=time.time()
+    print 'calcIPMset: %.3f s, cached: %.6f s, %d positions: %.3f s' %(t1-t0, t2-t1, npos, t3-t2)
+    return t1-t0, t2-t1, t3-t2
+
   def printInfo(self, printRes=True):
     print 'N = ',self.N
     print 'number of photons int_0 = ', self.int_0
@@ -3,7 +3,7 @@
 # IPM (intensity position monitor) devices
 
 from blbase.stateioc import stateiocDevice
-from blutil import estr, guessBeamline, config
+from blutil import estr, guessBeamline, config, snapshot
 from blutil.edm import edm_hutch_open
 import subprocess
 
@@ -133,16 +133,36 @@ class IPM:
     return self.status()
 
   def status(self,show_dets=None):
+    return self.format_status(snapshot.read_dict(self.status_pvs()),show_dets)
+
+  def status_pvs(self):
+    pvs = {"diode": self._ipmPV + ":DIODE", "target": self._ipmPV + ":TARGET"}
+    for key in ("dx","dy","ty"):
+      mot = getattr(self,key)
+      if hasattr(mot,"get_pvname"):
+        pvs[key] = mot.get_pvname("readback")
+    return pvs
+
+  def _pos(self,values,key):
+    if values.get(key) is None:
+      return getattr(self,key).wm()
+    return values[key]
+
+  def _state(self,values,key):
+    if values.get(key) is None:
+      return getattr(self,key).state()
+    return getattr(self,key).state_name(values[key])
+
+  def format_status(self,values,show_dets=None):
     str = estr(self.__desc, color="black", type="bold")
     if self.dx and self.dy:
-      str += ", diode @ (dx,dy) = ({0:.4f},{1:.4f})".format(self.dx.wm(),self.dy.wm())
-    str += ", diode {0}".format(self.diode.state())
+      str += ", diode @ (dx,dy) = ({0:.4f},{1:.4f})".format(self._pos(values,"dx"),self._pos(values,"dy"))
+    str += ", diode {0}".format(self._state(values,"diode"))
     if self.ty:
-      str += ", target @ ty = {0:.4f}".format(self.ty.wm())
-    str += ", target {0}\n".format(self.target.state())
+      str += ", target @ ty = {0:.4f}".format(self._pos(values,"ty"))
+    str += ", target {0}\n".format(self._state(values,"target"))
     if show_dets is None:
       show_dets = self.__show_dets
     if self.__det and show_dets:
       str += " {0}".format(self.__det.status())
     return str
-
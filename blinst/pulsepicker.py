@@ -1,5 +1,6 @@
 import time
 import blutil
+from blutil import snapshot
 from psp import Pv
 from blbase.stateioc import stateiocDevice
 from functools import partial
@@ -69,11 +70,17 @@ class PulsePicker(object):
     edm_hutch_open("pp_screens/pp_mode_control.edl", MOTOR=self._rotPVbase)
 
   def status(self):
+    return snapshot.status(self)
+
+  def status_pvs(self):
+    return {"df": self._PVname('DF')}
+
+  def format_status(self,values):
     #get clostest position in y
     #deltas = self.y._presetDelta()
     status = ''
     status += 'Pulse picker -- '
-    isopen = Pv.get(self._PVname('DF'))==0
+    isopen = values["df"]==0
     if isopen:
       status += blutil.estr('open',color='green')+'\n'
     else:
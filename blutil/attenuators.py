@@ -1,4 +1,4 @@
-from blutil import printnow, dec2bin, estr
+from blutil import printnow, estr
 from periodictable import xsf
 from periodictable import formula as ptable_formula
 import numpy as np
@@ -68,35 +68,118 @@ def calcTrasmissionForThick(d,E,material="Si",density=None):
   att_len = getAttLen(E,material,density)
   return np.exp(-d/att_len)
 
-def findFiltersForTrasm(att_list,transmission,E):
+# filter sets with at least this many filters use a meet-in-the-middle search
+# instead of a table of all 2^n configurations
+MITM_MIN_FILTERS = 21
+# extra table entries looked at on each side of the best match, so that
+# configurations with the same transmission can be ranked by filter moves
+_TIE_WINDOW = 8
+_conf_cache = {}
+_CONF_CACHE_SIZE = 64
+
+def _log_table(logT):
+  """ returns the log transmission of every configuration of the filters
+      with log transmissions logT; bit s of the index is filter s """
+  table = np.zeros(1)
+  for lt in logT:
+    table = np.concatenate((table,table+lt))
+  return table
+
+def _filter_key(f):
+  """ (thickness, material) of a filter for the cache key, so that changing
+      a filter does not return a stale table; d and material may be
+      attributes or getters depending on the filter class """
+  key = [f]
+  for name in ("d","material"):
+    v = getattr(f,name,None)
+    if callable(v): v = v()
+    key.append(v)
+  return tuple(key)
+
+def _conf_tables(att_list,E):
+  """ returns the sorted configuration table(s) for att_list at energy E as a
+      list of (sorted log transmissions, configuration index) tuples: one
+      table, or two half tables for the meet-in-the-middle search.
+      Each filter transmission is computed once per (filter set, energy) """
+  key = (tuple(_filter_key(a) for a in att_list),E)
+  try:
+    return _conf_cache[key]
+  except KeyError:
+    pass
+  T = np.array([float(a.transmission(E)) for a in att_list])
+  with np.errstate(divide="ignore"):
+    logT = np.log(T)
+  n = len(logT)
+  if n < MITM_MIN_FILTERS:
+    halves = (logT,)
+  else:
+    halves = (logT[:n//2],logT[n//2:])
+  tables = []
+  for h in halves:
+    t = _log_table(h)
+    order = np.argsort(t,kind="mergesort")
+    tables.append((t[order],order))
+  if len(_conf_cache) >= _CONF_CACHE_SIZE:
+    _conf_cache.clear()
+  _conf_cache[key] = tables
+  return tables
+
+def _window(sorted_t,target,w):
+  """ indices of the 2*w entries of sorted_t around target (per target) """
+  idx = np.searchsorted(sorted_t,target)
+  idx = np.atleast_1d(idx)[:,np.newaxis] + np.arange(-w,w)
+  return np.clip(idx,0,len(sorted_t)-1)
+
+def findBestConfigurations(att_list,transmission,E,k=5,current=None):
+  """ Returns the k filter configurations giving a transmission closest to
+      the requested one as a list of (T,conf), best first. conf is a tuple
+      with 1 (in) or 0 (out) for every filter in att_list.
+      current is the present in/out state in the same format; configurations
+      with the same transmission are ranked by the number of filters to move.
+      The sorted configuration table is cached per (filter set, energy), so
+      repeated calls only cost a binary search.
+  Note : the function does not move the filters """
+  n = len(att_list)
+  k = min(k,1<<n)
+  tables = _conf_tables(att_list,E)
+  with np.errstate(divide="ignore"):
+    target = np.log(transmission)
+  w = k+_TIE_WINDOW
+  if len(tables) == 1:
+    sorted_t,order = tables[0]
+    idx = np.unique(_window(sorted_t,target,w))
+    logT = sorted_t[idx]
+    confs = order[idx]
+  else:
+    (ta,oa),(tb,ob) = tables
+    idx = _window(tb,target-ta,w)
+    logT = (ta[:,np.newaxis]+tb[idx]).ravel()
+    confs = (oa[:,np.newaxis] | (ob[idx] << (n//2))).ravel()
+    confs,first = np.unique(confs,return_index=True)
+    logT = logT[first]
+  T = np.exp(logT)
+  deltaT = np.abs(T-transmission)
+  # round to rank configurations with the same transmission as equal
+  scale = max(abs(transmission),np.finfo(float).tiny)
+  dkey = np.round(deltaT/scale,9)
+  if current is None:
+    moves = np.zeros(len(confs),dtype=int)
+  else:
+    cur = sum(int(bool(c)) << s for s,c in enumerate(current))
+    diff = confs ^ cur
+    moves = sum((diff >> s) & 1 for s in range(n))
+  best = np.lexsort((moves,dkey))[:k]
+  return [ (T[i],tuple(int((confs[i] >> s) & 1) for s in range(n))) for i in best ]
+
+def findFiltersForTrasm(att_list,transmission,E,current=None):
   """ Determines which filters have to be moved in the beam to
       achieve a transmission as close as possible to the requested one.
+      current is the present in/out state (see findBestConfigurations).
   Note : the function does not move the filters
        to use for calculation"""
-  tobe_in  = []
-  tobe_out = []
-  n = len(att_list)
-  deltaT_min = 1e35
-  for i in range(1<<n):
-    conf = dec2bin(i)
-    d = 0
-    T=1
-    for s in range(len(conf)):
-      if (conf[-(s+1)] == "1"):
-        T *= att_list[s].transmission(E)
-    deltaT = abs(T-transmission)
-#    print d_needed,conf,d,dist,dist_min
-    if (deltaT < deltaT_min):
-      deltaT_min=deltaT
-#      print d_needed,d,conf,dist_min
-      conf_min = conf
-  for s in range(len(conf_min)):
-    if (conf_min[-(s+1)] == "1"):
-      tobe_in.append(att_list[s])
-    else:
-      tobe_out.append(att_list[s])
-  for s in range(len(conf_min),n):
-    tobe_out.append(att_list[s])
+  T,conf = findBestConfigurations(att_list,transmission,E,k=1,current=current)[0]
+  tobe_in  = [a for a,c in zip(att_list,conf) if c]
+  tobe_out = [a for a,c in zip(att_list,conf) if not c]
   return (tobe_in,tobe_out)
 
 
@@ -138,8 +221,16 @@ def getT(att_list,E,printit=1):
       for the energy defined with the `setE` command
       The finding is returned as dictionary """
   wait(att_list)
-  n=len(att_list)
   (fin,fout,funknown)=check_filters_position(att_list)
+  (ret,sret) = formatT(att_list,E,fin,fout)
+  if (printit):
+    print sret
+  return (ret,sret)
+
+def formatT(att_list,E,fin,fout):
+  """ as getT for the filter positions fin and fout (lists of indices of
+      the filters in and out, the others are unknown) """
+  n=len(att_list)
   att_list_in=[]
   s_title = "filter# |"
   for i in range(n):
@@ -173,8 +264,6 @@ def getT(att_list,E,printit=1):
     s += "Transmission for 3rd harmonic (E=%.2fkeV): %.3e\n" % (E,T)
   ret["E"]=T
   sret = s_title + "\n" + s_out + "\n" + s_in + "\n" + s
-  if (printit):
-    print sret
   return (ret,sret)
 
 def getTvalue(att_list,E):
@@ -194,7 +283,8 @@ def setT(att_list,transmission,E,fast=False,printit=1,domove=1):
 Note : the function moves the filters
 Note2: use the `setE` command before to choose which energy 
        to use for calculation"""
-  (tobe_in,tobe_out) = findFiltersForTrasm(att_list,transmission,E)
+  current = [a.isin() for a in att_list]
+  (tobe_in,tobe_out) = findFiltersForTrasm(att_list,transmission,E,current)
   if (domove):
     if (printit): printnow("Moving attenuators IN")
     moveIN(tobe_in,fast=fast)
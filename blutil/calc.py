@@ -1,5 +1,6 @@
 """ Utilities to perfrom various calculations """
 
+import collections
 import psp.Pv as Pv
 import numpy as n
 import scipy.integrate
@@ -9,6 +10,31 @@ import matplotlib.pyplot as plt
 
 _manual_energy = None
 _ePv = Pv.Pv("SIOC:SYS0:ML00:AO627",monitor=True,initialize=True)
+_fast_cs = False
+
+# energy range (keV) and number of points of the fast cross section grids
+CS_GRID = (0.1, 100., 2000)
+
+
+def _memoize(maxsize=256):
+    """
+    Least recently used cache for functions with hashable arguments
+    """
+    def decorator(func):
+        cache = collections.OrderedDict()
+        def wrapper(*args):
+            try:
+                value = cache.pop(args)
+            except KeyError:
+                value = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = value
+            return value
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
 
 
 def setE(energy):
@@ -88,6 +114,9 @@ def E2f(E):
 
 def eV(E):
     """ Returns photon energy in eV if specified in eV or keV """
+    if not n.isscalar(E):
+      E=n.asarray(E,dtype=float)
+      return n.where(E<100,E*1000.0,E)
     if E < 100:
       E=E*1000.0;
     return E*1.0
@@ -243,11 +272,7 @@ def TransmissionPlotFixedT(ID,t,E1,E2,density=None,N=100):
     E2=eV(E2)/1000.
     ID=checkID(ID)
     E=n.linspace(E1,E2,N)
-    trans=n.zeros(N)
-    ii=0
-    for i in E:
-      trans[ii]=Transmission(ID,t,i,density)
-      ii+=1
+    trans=Transmission(ID,t,E,density)
     t_mm=t*u['mm']
     tstr="%3.3f mm of %s" % (t_mm,ID) 
     fig=plt.figure()
@@ -276,11 +301,7 @@ def gasTransmissionPlotFixedT(ID,t,E1,E2,P=760,T=295,N=100):
     E2=eV(E2)/1000.
     ID=checkID(ID)
     E=n.linspace(E1,E2,N)
-    trans=n.zeros(N)
-    ii=0
-    for i in E:
-      trans[ii]=gasTransmission(ID,t,i,P,T)
-      ii+=1
+    trans=gasTransmission(ID,t,E,P,T)
     tstr="%3.3f m of %s" % (t,ID) 
     fig=plt.figure()
     plt.plot(E,trans,'b.-')
@@ -374,10 +395,76 @@ def attenuationLength_noCompton(ID,E=None,density=None):
 
 
 
+@_memoize()
+def _parse_formula(ID):
+    """Cached periodictable.formulas.parse_formula"""
+    return periodictable.formulas.parse_formula(ID)
+
+@_memoize()
+def _cs_terms(ID):
+    """Returns (Z, weight) for every element in ID, where weight converts the
+       xraylib cross section of the element (cm^2/g) to m^2 per molecule"""
+    form=_parse_formula(ID)
+    terms=[]
+    for elem, atoms in form.atoms.items():
+      id = elem.symbol
+      terms.append((elementZ[id],atoms*AtomicMass[id]/c['NA']/u['cm']**2))
+    return tuple(terms)
+
+@_memoize()
+def _cs_grid(kind,z):
+    """Returns log(E) and log(cross section) of element z on the fast grid,
+       with extra points on both sides of every absorption edge"""
+    E1,E2,N=CS_GRID
+    grid=[n.logspace(n.log10(E1),n.log10(E2),N)]
+    for shell in range(9): # K, L1-L3, M1-M5
+      try:
+        edge=xraylib.EdgeEnergy(z,shell)
+      except ValueError:
+        continue
+      if E1<edge<E2:
+        grid.append([edge*(1-1e-6),edge*(1+1e-6)])
+    grid=n.unique(n.concatenate(grid))
+    func=getattr(xraylib,kind)
+    cs=n.array([func(z,e) for e in grid])
+    return n.log(grid),n.log(n.maximum(cs,n.finfo(float).tiny))
+
+def _element_cs(kind,z,E_keV):
+    """Cross section xraylib.<kind> of element z for scalar or array E_keV"""
+    func=getattr(xraylib,kind)
+    if not _fast_cs and n.isscalar(E_keV):
+      return func(z,E_keV)
+    E_keV=n.asarray(E_keV,dtype=float)
+    if _fast_cs and (E_keV>=CS_GRID[0]).all() and (E_keV<=CS_GRID[1]).all():
+      logE,logcs=_cs_grid(kind,z)
+      return n.exp(n.interp(n.log(E_keV),logE,logcs))
+    cs=n.array([func(z,e) for e in E_keV.flat]).reshape(E_keV.shape)
+    if cs.ndim==0:
+      return float(cs)
+    return cs
+
+def _cross_section(kind,ID,E):
+    """Sums the xraylib.<kind> cross section over the elements of ID"""
+    ID=checkID(ID)
+    E = getE(energy=E,correctEv=True)
+    E_keV=eV(E)/1000. # for xraylib
+    CS=0
+    for z, weight in _cs_terms(ID):
+      CS+=_element_cs(kind,z,E_keV)*weight
+    return CS
+
+def setFastCS(fast=True):
+    """ Use log-log interpolation on a precomputed energy grid per element
+        for the CS_* functions (and everything built on them) instead of
+        calling xraylib at every energy. The grid covers CS_GRID and includes
+        the absorption edges. """
+    global _fast_cs
+    _fast_cs = fast
+
 def MolecularMass(ID):
     """Returns the molecular mass of a chemical formula in g"""
     ID=checkID(ID)
-    form=periodictable.formulas.parse_formula(ID)
+    form=_parse_formula(ID)
     mass=0
     for i in range(len(form.atoms)):
       id=str(form.structure[i][1])
@@ -389,7 +476,7 @@ def MolecularMass(ID):
 def nAtoms(ID):
     """Returns the number of atoms in a chemical formula"""
     ID=checkID(ID)
-    form=periodictable.formulas.parse_formula(ID)
+    form=_parse_formula(ID)
     atoms=0
     for num in form.atoms.values():
       atoms += num
@@ -448,11 +535,7 @@ def DoseMaxEnergyPlot(ID,FWHM,dose,E1,E2,N=100,CS=None):
     E1=eV(E1)/1000
     E2=eV(E2)/1000
     E=n.linspace(E1,E2,N)
-    J=n.zeros(N)
-    ii=0
-    for i in E:
-      J[ii]=DoseMaxEnergy(ID,FWHM,dose,i,CS)
-      ii+=1
+    J=DoseMaxEnergy(ID,FWHM,dose,E,CS)
     tstr="Pulse energy to reach %3.3f eV/atom in %s" % (dose,ID) 
     FWHMum=FWHM*u['um']
     lstr="%4.1f um FWHM" % FWHMum 
@@ -1256,15 +1339,7 @@ def FlourescenceLines(ID):
       return
 
 def CS_Total(ID,E=None):
-  ID=checkID(ID)
-  E = getE(energy=E,correctEv=True)
-  E_keV=eV(E)/1000. # for xraylib
-  form=periodictable.formulas.parse_formula(ID)
-  CS=0
-  for elem, atoms in form.atoms.items():
-    id = elem.symbol
-    CS+=xraylib.CS_Total(elementZ[id],E_keV)*atoms*AtomicMass[id]/c['NA']/u['cm']**2
-  return CS
+  return _cross_section("CS_Total",ID,E)
 
 
 def CS_Photo(ID,E=None):
@@ -1273,15 +1348,7 @@ def CS_Photo(ID,E=None):
      E is the photon energy (default is current LCLS value)
      NOTE: This is per molecule if chemical formula given
   """
-  ID=checkID(ID)
-  E = getE(energy=E,correctEv=True)
-  E_keV=eV(E)/1000. # for xraylib
-  form=periodictable.formulas.parse_formula(ID)
-  CS=0
-  for elem, atoms in form.atoms.items():
-    id = elem.symbol
-    CS+=xraylib.CS_Photo(elementZ[id],E_keV)*atoms*AtomicMass[id]/c['NA']/u['cm']**2
-  return CS
+  return _cross_section("CS_Photo",ID,E)
 
 def CS_PhotoPlot(ID,E1,E2,N=100):
     """ Plots the xraylib photoabsorbtion cross section in megabarns
@@ -1293,11 +1360,7 @@ def CS_PhotoPlot(ID,E1,E2,N=100):
     E1=eV(E1)/1000.  # note: keV
     E2=eV(E2)/1000.  # note: keV
     E=n.linspace(E1,E2,N)
-    CS_ph=n.zeros(N)
-    ii=0
-    for i in E:
-      CS_ph[ii]=CS_Photo(ID,E[ii])
-      ii+=1
+    CS_ph=CS_Photo(ID,E)
     tstr="%s" % (ID) 
     fig=plt.figure()
     plt.plot(E,CS_ph*u['Mbarn'],'b.-')
@@ -1315,15 +1378,7 @@ def CS_Rayl(ID,E=None):
      ID is the element symbol
      E is the photon energy in eV or keV (default is current LCLS value)
   """
-  ID=checkID(ID)
-  E = getE(energy=E,correctEv=True)
-  E_keV=eV(E)/1000. # for xraylib
-  form=periodictable.formulas.parse_formula(ID)
-  CS=0
-  for elem, atoms in form.atoms.items():
-    id = elem.symbol
-    CS+=xraylib.CS_Rayl(elementZ[id],E_keV)*atoms*AtomicMass[id]/c['NA']/u['cm']**2
-  return CS
+  return _cross_section("CS_Rayl",ID,E)
 
 
 def CS_Compt(ID,E=None):
@@ -1331,15 +1386,7 @@ def CS_Compt(ID,E=None):
      ID is the element symbol
      E is the photon energy (default is current LCLS value)
   """
-  ID=checkID(ID)
-  E = getE(energy=E,correctEv=True)
-  E_keV=eV(E)/1000. # for xraylib
-  form=periodictable.formulas.parse_formula(ID)
-  CS=0
-  for elem, atoms in form.atoms.items():
-    id = elem.symbol
-    CS+=xraylib.CS_Compt(elementZ[id],E_keV)*atoms*AtomicMass[id]/c['NA']/u['cm']**2
-  return CS
+  return _cross_section("CS_Compt",ID,E)
 
 
 def CS_KN(E=None):
@@ -2,6 +2,10 @@
 DEBUG = 0
 TIMEIT = 0
 
+# record timing spans (see blutil.spans) in a ring of SPANS_size entries
+SPANS = False
+SPANS_size = 100000
+
 # use timestamp when using myprint
 PRINT_DATE = True
 
@@ -9,5 +13,21 @@ PRINT_DATE = True
 LOFGILE = None
 LOGFOLDER = None
 LOGFILE_print_screen = False
+# logprint hands lines to a writer thread that flushes every
+# LOGFILE_flush_interval seconds or LOGFILE_flush_bytes bytes
+LOGFILE_async = True
+LOGFILE_flush_interval = 0.5
+LOGFILE_flush_bytes = 65536
 
 Elog = None
+
+# online scan plots (blutil.plot.Plot2D) redraw at most this many times
+# per second
+PLOT_max_rate = 5.
+
+# also write scan points to a binary scan store (see blutil.scanstore)
+# next to the text scan log
+scandata_store = True
+
+# build independent beamline devices in parallel at startup
+STARTUP_PARALLEL = True
@@ -2,8 +2,15 @@ import math
 import os
 import time
 import datetime
+import threading
+import Queue
+import httplib
+import socket
+import shutil
 import urllib
 import urllib2
+import urlparse
+import numpy as np
 import matplotlib.pyplot as plt
 import simplejson as json
 
@@ -14,58 +21,103 @@ pv_arg = "?pv={}"
 url_arg = "&{0}={1}"
 url_flag = "&{0}"
 date_spec_format   = "{0:04}-{1:02}-{2:02}T{3:02}:{4:02}:{5:02}.{6:03}Z"
+cache_dir = os.path.expanduser("~/.epicsarchive_cache")
 
 class EpicsArchive(object):
     """
     Class that accesses data from the new archiver.
     Currently supports getting points, plotting points, and searching for pvs.
+
+    Fetched points are kept in an on-disk ArchiveCache, so asking again for a
+    time range that was already retrieved only downloads the missing pieces.
+    Pass use_cache=False to always go to the archiver.
     """
-    def __init__(self):
+    def __init__(self, use_cache=True, cache_path=None, url=None):
         self._pts_cache = None
         self._pv_cache = None
+        if url is None:
+            url = retrieval_url
+        self._conn = ArchiveConnection(url)
+        if use_cache:
+            self._store = ArchiveCache(cache_path)
+        else:
+            self._store = None
 
-    def get_points(self, PV=None, start=30, end=None, unit="days", chunk=False, two_lists=False, raw=False):
+    def get_points(self, PV=None, start=30, end=None, unit="days", chunk=False, two_lists=False, raw=False, arrays=False):
         """
         Get points from the archive, returning them as a list of tuples.
         You may set two_lists=True to get a list of positions and a list of
             times instead of a single list of tuples.
         You may set raw=True to get times as seconds from the epoch instead of
             as strings.
+        You may set arrays=True to get numpy arrays (secs, nanos, vals)
+            instead of python lists. This skips building the tuple list.
         """
         if PV is None:
-            pts, _ = self._check_cache()
-            if pts is None:
+            arrs, _ = self._check_cache()
+            if arrs is None:
                 return
         else:
-            json_start, json_end = self._json_args(start, end, unit)
-            if valid_date_arrays(json_start, json_end):
-                json_obj = self._get_json(PV, json_start, json_end, chunk)
-                pts = self._json_to_pts(json_obj)
-                self._pts_cache = pts
+            t0, t1 = self._epoch_args(start, end, unit)
+            if t0 < t1:
+                arrs = self._get_arrays(PV, t0, t1, chunk)
+                self._pts_cache = arrs
                 self._pv_cache = PV
             else:
                 print "Invalid dates! Start must be BEFORE end!"
-                pts = []
-        if not raw:
-            pts = pts_string_time(pts)
-        if two_lists:
-            return self._pts_to_arrays(pts)
-        else:
-            return pts
+                arrs = empty_arrays()
+        return self._format_arrays(arrs, two_lists, raw, arrays)
+
+    def get_points_many(self, PVs, start=30, end=None, unit="days", chunk=False, arrays=True, workers=4):
+        """
+        Get points for several PVs at once, fetching in parallel with one
+        reused connection per worker thread. Returns a dictionary of
+        PV: (secs, nanos, vals) numpy arrays, or PV: list of (secs, val)
+        tuples if arrays=False.
+        """
+        t0, t1 = self._epoch_args(start, end, unit)
+        if t0 >= t1:
+            print "Invalid dates! Start must be BEFORE end!"
+            return {}
+        PVs = list(PVs)
+        results = {}
+        queue = Queue.Queue()
+        for PV in PVs:
+            queue.put(PV)
+        def worker():
+            while True:
+                try:
+                    PV = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[PV] = self._get_arrays(PV, t0, t1, chunk)
+                except Exception, exc:
+                    print "Error fetching {0}: {1}".format(PV, exc)
+                    results[PV] = empty_arrays()
+        threads = [threading.Thread(target=worker)
+                   for i in range(max(1, min(workers, len(PVs))))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if not arrays:
+            for PV in PVs:
+                results[PV] = self._format_arrays(results[PV], False, True, False)
+        return results
 
     def plot_points(self, PV=None, start=30, end=None, unit="days", chunk=False):
         """
         Use matplotlib to plot points from the archive.
         """
         if PV is None:
-            pts, PV = self._check_cache()
-            if pts is None:
+            arrs, PV = self._check_cache()
+            if arrs is None:
                 return
         else:
-            pts = self.get_points(PV, start, end, unit, chunk, False, True)
-        t, x = self._pts_to_arrays(pts)
-        for i in range(len(t)):
-            t[i] = datetime.datetime.fromtimestamp(t[i])
+            arrs = self.get_points(PV, start, end, unit, chunk, arrays=True)
+        secs, nanos, x = arrs
+        t = [ datetime.datetime.fromtimestamp(i) for i in secs + nanos * 1e-9 ]
         fig = plt.figure()
         fig.canvas.set_window_title("EPICS Archive " + PV)
         plt.plot(t, x, "k.")
@@ -73,6 +125,13 @@ class EpicsArchive(object):
         plt.ylabel(PV)
         plt.show(block=False)
 
+    def clear_cache(self, PV=None):
+        """
+        Remove the on-disk points for PV, or for every PV if PV is None.
+        """
+        if self._store is not None:
+            self._store.clear(PV)
+
     def _check_cache(self):
         """
         Return cache if it exists, otherwise print a message.
@@ -126,72 +185,232 @@ class EpicsArchive(object):
         """
         pass # This only exists to hold the common doc string elements
     get_points.__doc__ += __interface.__doc__
+    get_points_many.__doc__ += __interface.__doc__
     plot_points.__doc__ += __interface.__doc__
 
-    def _json_args(self, start, end, unit):
+    def _epoch_args(self, start, end, unit):
         """
-        Change the user interface arguments into arguments suitable for the
-        URL json request.
+        Change the user interface arguments into seconds since the epoch.
         """
         # Default endpoints
         if start is None:
             start = [2010]
         if end is None:
-            end = datetime_to_array(datetime.datetime.now())
-
-        # Convert to datetime
+            end = datetime.datetime.now()
         start = to_datetime(start, unit)
         end = to_datetime(end, unit)
+        return datetime_to_epoch(start), datetime_to_epoch(end)
 
-        # Adjust to UTC
-        utcnow = datetime.datetime.utcnow()
-        herenow = datetime.datetime.now()
-        offset = round((utcnow - herenow).total_seconds()/(60*60), 2)
-
-        utc_start = start + datetime.timedelta(hours=offset)
-        utc_end = end + datetime.timedelta(hours=offset)
-
-        # Switch to date arrays for url construction
-        json_start = datetime_to_array(utc_start)
-        json_end = datetime_to_array(utc_end)
-
-        return json_start, json_end
+    def _get_arrays(self, PV, start, end, chunk):
+        """
+        Return (secs, nanos, vals) for PV between the start and end epoch
+        times, downloading only the intervals the cache does not have yet.
+        """
+        if self._store is None:
+            return self._fetch(PV, start, end, chunk)
+        try:
+            for gap_start, gap_end in self._store.missing(PV, start, end):
+                arrs = self._fetch(PV, gap_start, gap_end, chunk)
+                if not self._store.add(PV, gap_start, gap_end, arrs):
+                    return self._fetch(PV, start, end, chunk)
+            return self._store.get(PV, start, end)
+        except (IOError, OSError), exc:
+            print "Archive cache disabled: {0}".format(exc)
+            self._store = None
+            return self._fetch(PV, start, end, chunk)
 
-    def _get_json(self, PV, start, end, chunk):
+    def _fetch(self, PV, start, end, chunk):
         """
-        Do a url query of the new archiver. Return the json result unmodified.
+        Do a url query of the new archiver and return (secs, nanos, vals).
 
         PV: string PV to look up in the archiver.
-        start, end: array of the form [year, month, day, hour, min, sec, ms]
-            where you may omit later entries as desired. For example, [2015]
-            is a valid argument and would be the start of 2015. [2016, 4, 15]
-            is a valid argument and would be the start of April 15, 2016.
+        start, end: seconds since the epoch.
         chunk: boolean for whether or not you want data to be chunked.
         """
-        url = retrieval_url
-        url += pv_arg.format(urllib.quote(PV, safe=""))
-        url += url_arg.format("from", date_format(*start))
-        url += url_arg.format("to", date_format(*end))
+        query = pv_arg.format(urllib.quote(PV, safe=""))
+        query += url_arg.format("from", epoch_format(start))
+        query += url_arg.format("to", epoch_format(end))
         if not chunk:
-            url += url_flag.format("donotchunk")
-        return url_query(url)
+            query += url_flag.format("donotchunk")
+        return json_to_arrays(self._conn.get(query))
+
+    def _format_arrays(self, arrs, two_lists, raw, arrays):
+        """
+        Turn (secs, nanos, vals) arrays into the output get_points asked for.
+        """
+        if arrays:
+            return arrs
+        secs, nanos, vals = arrs
+        t = secs.tolist()
+        if not raw:
+            t = [ time.ctime(i) for i in t ]
+        x = vals.tolist()
+        if two_lists:
+            return t, x
+        else:
+            return zip(t, x)
+
+
+class ArchiveConnection(object):
+    """
+    Keeps one persistent HTTP connection to the archiver per thread, so that
+    repeated requests do not pay for a new connection every time.
+    """
+    def __init__(self, url):
+        parts = urlparse.urlparse(url)
+        self._host = parts.netloc
+        self._path = parts.path
+        self._local = threading.local()
+
+    def get(self, query):
+        """
+        Request the url path + query and return the decoded json.
+        """
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = httplib.HTTPConnection(self._host, timeout=60)
+                self._local.conn = conn
+            try:
+                conn.request("GET", self._path + query)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (httplib.HTTPException, socket.error):
+                # Server may have dropped an idle connection, retry once
+                conn.close()
+                self._local.conn = None
+                if attempt > 0:
+                    raise
+                continue
+            if resp.status != 200:
+                raise IOError("Archiver returned {0} {1}".format(resp.status,
+                                                                 resp.reason))
+            return json.loads(data)
+
+
+class ArchiveCache(object):
+    """
+    On-disk store of archived points. Each PV gets a directory holding
+    secs.npy, nanos.npy, vals.npy and intervals.json, the sorted list of
+    [start, end] epoch ranges that were already fetched. Arrays are opened
+    memory-mapped so that only the requested slice is read.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = cache_dir
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _pv_dir(self, PV):
+        return os.path.join(self.path, urllib.quote(PV, safe=""))
+
+    def intervals(self, PV):
+        """
+        Return the list of [start, end] epoch ranges stored for PV.
+        """
+        try:
+            with open(os.path.join(self._pv_dir(PV), "intervals.json")) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return []
+
+    def missing(self, PV, start, end):
+        """
+        Return the list of (start, end) ranges not yet stored for PV.
+        """
+        gaps = []
+        t = start
+        for i_start, i_end in self.intervals(PV):
+            if i_end <= t:
+                continue
+            if i_start >= end:
+                break
+            if i_start > t:
+                gaps.append((t, i_start))
+            t = max(t, i_end)
+        if t < end:
+            gaps.append((t, end))
+        return gaps
+
+    def load(self, PV):
+        """
+        Return memory-mapped (secs, nanos, vals) for everything stored for PV.
+        """
+        pv_dir = self._pv_dir(PV)
+        try:
+            return tuple(np.load(os.path.join(pv_dir, name + ".npy"),
+                                 mmap_mode="r")
+                         for name in ("secs", "nanos", "vals"))
+        except (IOError, ValueError):
+            return empty_arrays()
 
-    def _json_to_pts(self, json_obj):
+    def get(self, PV, start, end):
         """
-        Inteprets a data retrieval json object as an array of tuple points.
+        Return (secs, nanos, vals) stored for PV between start and end.
+        Like the archiver, the first point is the last one before start if
+        the stored ranges cover start.
         """
-        return [ (x["secs"], x["val"]) for x in json_obj[0]["data"] ]
+        secs, nanos, vals = self.load(PV)
+        i0 = np.searchsorted(secs, math.floor(start), "left")
+        i1 = np.searchsorted(secs, end, "right")
+        if i0 > 0 and (i0 == len(secs) or secs[i0] > start):
+            # The archiver sends the last known point before the start of
+            # every fetch, so it is stored for any range that covers start.
+            if any(i_start <= start < i_end
+                   for i_start, i_end in self.intervals(PV)):
+                i0 -= 1
+        return (np.array(secs[i0:i1]), np.array(nanos[i0:i1]),
+                np.array(vals[i0:i1]))
+
+    def add(self, PV, start, end, arrs):
+        """
+        Merge arrs fetched for the range start to end into the store for PV.
+        Returns False if these values can not be stored.
+        """
+        secs, nanos, vals = arrs
+        if vals.dtype == object:
+            return False
+        # Points after now may still arrive, don't mark them as fetched
+        end = min(end, time.time())
+        with self._lock:
+            old_secs, old_nanos, old_vals = self.load(PV)
+            if len(old_secs) > 0:
+                try:
+                    vals = np.concatenate((old_vals, vals))
+                except ValueError:
+                    return False
+                secs = np.concatenate((old_secs, secs))
+                nanos = np.concatenate((old_nanos, nanos))
+            order = np.lexsort((nanos, secs))
+            secs, nanos, vals = secs[order], nanos[order], vals[order]
+            keep = np.ones(len(secs), dtype=bool)
+            keep[1:] = (np.diff(secs) != 0) | (np.diff(nanos) != 0)
+            secs, nanos, vals = secs[keep], nanos[keep], vals[keep]
+            intervals = self.intervals(PV)
+            if start < end:
+                intervals = merge_intervals(intervals + [[start, end]])
+            pv_dir = self._pv_dir(PV)
+            if not os.path.isdir(pv_dir):
+                os.makedirs(pv_dir)
+            for name, arr in zip(("secs", "nanos", "vals"), (secs, nanos, vals)):
+                tmp = os.path.join(pv_dir, name + ".tmp.npy")
+                np.save(tmp, arr)
+                os.rename(tmp, os.path.join(pv_dir, name + ".npy"))
+            tmp = os.path.join(pv_dir, "intervals.tmp")
+            with open(tmp, "w") as f:
+                json.dump(intervals, f)
+            os.rename(tmp, os.path.join(pv_dir, "intervals.json"))
+        return True
 
-    def _pts_to_arrays(self, pts):
+    def clear(self, PV=None):
         """
-        Changes an array of tuples into two lists.
+        Remove stored points for PV, or the whole store if PV is None.
         """
-        t_array = []
-        val_array = []
-        for (t, val) in pts:
-            t_array.append(t)
-            val_array.append(val)
-        return t_array, val_array
+        with self._lock:
+            if PV is None:
+                shutil.rmtree(self.path, ignore_errors=True)
+            else:
+                shutil.rmtree(self._pv_dir(PV), ignore_errors=True)
 
 days_map = {}
 days_map.update({ x: 365              for x in ("years", "year", "yr", "y")        })
@@ -220,7 +439,7 @@ def to_datetime(arg, unit):
     if isinstance(arg, (list, tuple)):
         arg = list(arg)
         while len(arg) < 3:
-            arg.append(0)
+            arg.append(1)
         return datetime.datetime(*arg)
  
 def datetime_ago(delta, unit):
@@ -239,6 +458,18 @@ def datetime_to_array(dt):
     """
     return [dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second]
 
+def datetime_to_epoch(dt):
+    """
+    Convert a local time datetime object to seconds since the epoch.
+    """
+    return time.mktime(dt.timetuple()) + dt.microsecond * 1e-6
+
+def epoch_format(t):
+    """Convert seconds since the epoch to date format string for archiver"""
+    dt = datetime.datetime.utcfromtimestamp(t)
+    return date_format(dt.year, dt.month, dt.day, dt.hour, dt.minute,
+                       dt.second, dt.microsecond // 1000)
+
 def date_format(year=2015, month=1, day=1, hr=0, min=0, s=0, ms=0):
     """Convert date/time parameters to date format string for archiver"""
     d = date_spec_format.format(year, month, day, hr, min, s, ms)
@@ -257,6 +488,39 @@ def valid_date_arrays(start, end):
         return True
     return False
 
+def empty_arrays():
+    """
+    Return empty (secs, nanos, vals) arrays.
+    """
+    return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0))
+
+def json_to_arrays(json_obj):
+    """
+    Interprets a data retrieval json object as (secs, nanos, vals) arrays.
+    """
+    if len(json_obj) == 0:
+        return empty_arrays()
+    data = json_obj[0]["data"]
+    n = len(data)
+    secs = np.fromiter((x["secs"] for x in data), dtype=np.int64, count=n)
+    nanos = np.fromiter((x.get("nanos", 0) for x in data), dtype=np.int64,
+                        count=n)
+    vals = np.array([ x["val"] for x in data ])
+    return secs, nanos, vals
+
+def merge_intervals(intervals):
+    """
+    Merge a list of [start, end] ranges into a sorted list of disjoint ones.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
 def pts_string_time(pts):
     """
     Convert array of points of the form (unix timestamp, value) to the form
@@ -4,6 +4,9 @@ Module for organizing objects in the beamline.
 Contains utilities for grouping objects together in beamline.py to satisfy
 the individual needs of each hutch without compromising code unification.
 """
+import sys
+import time
+import threading
 import functools
 import inspect
 import importlib
@@ -27,9 +30,8 @@ def alias_class(Class, **aliases):
         can either be a string or a list/tuple of strings.
     Attribute names that are omitted will carry through unaliased.
     """
-    def proxy_class(*args):
-        obj = alias_object(Class(*args))
-        return alias_object(obj, **aliases)
+    def proxy_class(*args, **kwargs):
+        return alias_object(Class(*args, **kwargs), **aliases)
     proxy_class.__doc__ = argspec(Class.__init__) + "\n" + Class.__doc__
     return proxy_class
 
@@ -40,18 +42,24 @@ def alias_object(obj, **aliases):
         can either be a string or a list/tuple of strings.
     Attribute names that are omitted will carry through unaliased.
     """
-    attrs = {}
-    attrs["__doc__"] = obj.__doc__
-    attrs["__module__"] = obj.__class__.__module__
-    for a in object_attrs(obj):
-        name = aliases.get(a, a)
-        if isinstance(name, (list, tuple)):
-            for n in name:
-                attrs[n] = proxy_property(obj, a)
-        else:
-            attrs[name] = proxy_property(obj, a)
-    AliasClass = type(obj.__class__.__name__, (object,), attrs)
-    return AliasClass()
+    attrs = object_attrs(obj)
+    key = ("alias", obj.__class__, tuple(attrs), _instance_types(obj, attrs),
+           _alias_key(aliases))
+    AliasClass = _proxy_classes.get(key)
+    if AliasClass is None:
+        props = {}
+        props["__doc__"] = obj.__doc__
+        props["__module__"] = obj.__class__.__module__
+        for a in attrs:
+            name = aliases.get(a, a)
+            if isinstance(name, (list, tuple)):
+                for n in name:
+                    props[n] = ProxyProperty(a, obj, 0)
+            else:
+                props[name] = ProxyProperty(a, obj, 0)
+        AliasClass = type(obj.__class__.__name__, (object,), props)
+        _proxy_classes[key] = AliasClass
+    return _proxy_instance(AliasClass, (obj,))
 
 def object_merge(name, *objs):
     """
@@ -60,18 +68,95 @@ def object_merge(name, *objs):
     Merged objects have the attributes that their constituent objects have,
     and forward all getattr, setattr, delattr requests to the original object.
     """
-    attrs = {}
-    doc = "Docstrings of merged objects:"
-    for obj in objs:
-        try:
-            doc += "\n" + obj.__doc__
-        except:
-            pass
-        for a in object_attrs(obj):
-            attrs[a] = proxy_property(obj, a)
-    attrs["__doc__"] = doc
-    MergeClass = type(name, (object,), attrs)
-    return MergeClass()
+    attrs = [object_attrs(obj) for obj in objs]
+    key = ("merge", name) + tuple((obj.__class__, tuple(a), _instance_types(obj, a))
+                                  for obj, a in zip(objs, attrs))
+    MergeClass = _proxy_classes.get(key)
+    if MergeClass is None:
+        props = {}
+        doc = "Docstrings of merged objects:"
+        for i, obj in enumerate(objs):
+            try:
+                doc += "\n" + obj.__doc__
+            except:
+                pass
+            for a in attrs[i]:
+                props[a] = ProxyProperty(a, obj, i)
+        props["__doc__"] = doc
+        MergeClass = type(name, (object,), props)
+        _proxy_classes[key] = MergeClass
+    return _proxy_instance(MergeClass, objs)
+
+# Proxy classes by (kind, wrapped classes, attribute names, types of the
+# instance attributes, aliases). The classes only hold ProxyProperty
+# descriptors; the wrapped objects are kept by each instance, so one class
+# serves every object of the same shape and does not keep any of them alive.
+_proxy_classes = {}
+
+def _instance_type(obj, attr):
+    d = getattr(obj, "__dict__", {})
+    if attr in d:
+        return type(d[attr])
+    return None
+
+def _instance_types(obj, attrs):
+    return tuple(_instance_type(obj, a) for a in attrs)
+
+def _alias_key(aliases):
+    items = []
+    for old, new in sorted(aliases.items()):
+        if isinstance(new, list):
+            new = tuple(new)
+        items.append((old, new))
+    return tuple(items)
+
+def _proxy_instance(ProxyClass, objs):
+    proxy = ProxyClass()
+    proxy.__dict__["__proxied__"] = objs
+    return proxy
+
+class ProxyProperty(property):
+    # Property that forwards getattr, setattr, delattr of attr to the
+    # wrapped object number index of a proxy instance, or always to source
+    # if index is None. The docstring is built on first access from the
+    # class of source (see class_attr_doc), attributes are never evaluated
+    # for it. Only with index None is source itself kept.
+    def __init__(self, attr, source, index=None):
+        property.__init__(self)
+        self._attr = attr
+        self._index = index
+        if index is None:
+            self._source = source
+        else:
+            self._source = None
+        self._class = source.__class__
+        self._type = _instance_type(source, attr)
+        self._doc = None
+
+    def _target(self, proxy):
+        if self._index is None:
+            return self._source
+        return proxy.__dict__["__proxied__"][self._index]
+
+    def __get__(self, proxy, cls=None):
+        if proxy is None:
+            return self
+        return getattr(self._target(proxy), self._attr)
+
+    def __set__(self, proxy, value):
+        setattr(self._target(proxy), self._attr, value)
+
+    def __delete__(self, proxy):
+        delattr(self._target(proxy), self._attr)
+
+    @property
+    def __doc__(self):
+        if self._doc is None:
+            if self._source is not None:
+                self._doc = attr_doc(self._source, self._attr)
+            else:
+                self._doc = class_attr_doc(self._class, self._attr, self._type)
+        return self._doc
 
 def proxy_property(obj, attr):
     """
@@ -79,15 +164,55 @@ def proxy_property(obj, attr):
     When accessed, forwards all getattr, setattr, delattr requests to obj.
     Sets up a clean, useful docstring for ipython sessions.
     """
-    def optattr(func, obj, attr, self, *args):
-        return func(obj, attr, *args)
-    parts = [functools.partial(optattr, f, obj, attr) for f in (getattr, setattr, delattr)]
-    property_no_doc = type("property", (property,), {})
-    prop = property_no_doc(*parts)
-    v = getattr(obj, attr)
+    return ProxyProperty(attr, obj)
+
+def attr_doc(obj, attr):
+    """
+    Return a docstring for attr of obj without evaluating it: properties and
+    methods are looked up on the class, only plain instance attributes are
+    read.
+    """
+    d = getattr(obj, "__dict__", {})
+    if attr in d:
+        return _attr_doc(obj.__class__, attr, lambda: _value_doc(d[attr]))
+    return _attr_doc(obj.__class__, attr)
+
+def class_attr_doc(klass, attr, value_type=None):
+    """
+    Return a docstring for attr of the instances of klass, as attr_doc but
+    without an instance: an instance attribute is described by value_type,
+    the type of its value.
+    """
+    if value_type is not None:
+        return _attr_doc(klass, attr, lambda: _type_doc(value_type))
+    return _attr_doc(klass, attr)
+
+def _attr_doc(klass, attr, instance_doc=None):
+    v = None
+    found = False
+    for k in inspect.getmro(klass):
+        if attr in k.__dict__:
+            v = k.__dict__[attr]
+            found = True
+            break
+    if isinstance(v, property):
+        return v.__doc__ or "property"
+    if isinstance(v, (staticmethod, classmethod)):
+        return _value_doc(v.__get__(None, klass))
+    if instance_doc is not None:
+        return instance_doc()
+    if found and hasattr(v, "__get__") and not inspect.isfunction(v):
+        # other descriptors
+        return getattr(v, "__doc__", None) or "type " + v.__class__.__name__
+    return _value_doc(v)
+
+def _value_doc(v):
     doc = ""
     if callable(v):
-        doc += argspec(v) + "\n"
+        try:
+            doc += argspec(v) + "\n"
+        except:
+            pass
     if hasattr(v, "__dict__"):
         try:
             doc += v.__doc__
@@ -95,8 +220,12 @@ def proxy_property(obj, attr):
             pass
     else:
         doc += "type " + v.__class__.__name__
-    prop.__doc__ = doc
-    return prop
+    return doc
+
+def _type_doc(t):
+    if t.__module__ in ("__builtin__", "builtins") or not t.__doc__:
+        return "type " + t.__name__
+    return t.__doc__
 
 def object_attrs(obj):
     """
@@ -105,3 +234,246 @@ def object_attrs(obj):
     keys = obj.__class__.__dict__.keys() + obj.__dict__.keys()
     return [k for k in keys if k[:2] != "__"]
 
+def benchmark(nattrs=50, nobjs=100):
+    """
+    Time alias_object and object_merge on a fake device with nattrs
+    properties that count their evaluations, as a stand-in for devices whose
+    properties read PVs. Returns a dict with the times in seconds and the
+    number of property evaluations (should be 0).
+    """
+    counter = [0]
+    def make_prop(i):
+        def fget(self):
+            counter[0] += 1
+            return float(i)
+        return property(fget, doc="pv backed value {0}".format(i))
+    props = dict(("pv{0}".format(i), make_prop(i)) for i in range(nattrs))
+    props["move"] = lambda self, pos, wait=False: None
+    FakeDevice = type("FakeDevice", (object,), props)
+    aliases = dict(("pv{0}".format(i), "alias{0}".format(i)) for i in range(0, nattrs, 2))
+    devs = [FakeDevice() for i in range(nobjs)]
+    t0 = time.time()
+    first = alias_object(devs[0], **aliases)
+    t1 = time.time()
+    for dev in devs[1:]:
+        alias_object(dev, **aliases)
+    t2 = time.time()
+    for i in range(1, nobjs):
+        object_merge("merged", devs[i - 1], devs[i])
+    t3 = time.time()
+    evals = counter[0]
+    docs = [getattr(first.__class__, a).__doc__ for a in dir(first.__class__) if a[:2] != "__"]
+    res = dict(first_alias=t1 - t0, cached_alias=(t2 - t1) / max(nobjs - 1, 1),
+               merge=(t3 - t2) / max(nobjs - 1, 1), evaluations=evals,
+               doc_evaluations=counter[0] - evals, docs=len(docs))
+    print "alias_object: first {0:.2f} ms, cached {1:.3f} ms per object".format(res["first_alias"] * 1e3, res["cached_alias"] * 1e3)
+    print "object_merge: {0:.3f} ms per object".format(res["merge"] * 1e3)
+    print "property evaluations while aliasing: {0}, while building {1} docstrings: {2}".format(evals, len(docs), res["doc_evaluations"])
+    return res
+
+
+class DeviceRegistry(object):
+    """
+    Declares beamline devices with the names they provide and the names they
+    need, then builds them in dependency order. Independent devices are built
+    in parallel in a PycaThreadPool, lazy devices only on first attribute
+    access. A failing device is reported and its names are set to None,
+    without stopping the others.
+
+    Usage in beamline.py:
+        devices = DeviceRegistry(globals(), export, warning)
+
+        @devices.add("motors", "m", deps=("lcls_linac",))
+        def _motors():
+            motors = motorsfile.Motors()
+            ...
+            return dict(motors=motors, m=motors.all.m)
+
+        devices.build()
+    """
+    def __init__(self, namespace, export=None, warning=None):
+        """
+        namespace is the dict that built devices are put into, e.g. globals().
+        export(*names) is called with the names of every device that loads.
+        warning(text) is used to report failures.
+        """
+        self._ns = namespace
+        self._export = export
+        self._warning = warning
+        self._blocks = []
+        self._providers = {}
+
+    def add(self, *names, **opts):
+        """
+        Decorator that declares a device function. The function takes no
+        arguments and returns a dict of name: object for names.
+        **opts can be:
+            deps=<list of names> : names that must be built first
+            lazy=<bool>          : build on first attribute access
+            desc=<string>        : name used in messages, default names[0]
+            error=<string>       : warning printed if the function raises
+        """
+        def decorator(func):
+            block = DeviceBlock(func, names, **opts)
+            self._blocks.append(block)
+            for name in names:
+                self._providers[name] = block
+            return func
+        return decorator
+
+    def build(self, parallel=True, profile=True):
+        """
+        Build all devices that are not lazy, in parallel when possible, and
+        put lazy proxies in place for the rest. Print the startup profile if
+        profile=True.
+        """
+        for block in self._blocks:
+            if block.lazy and block.state is None:
+                for name in block.names:
+                    self._ns[name] = LazyDevice(self, block, name)
+                if self._export is not None:
+                    self._export(*block.names)
+        pending = [b for b in self._blocks if not b.lazy]
+        pool = None
+        if parallel and len(pending) > 1:
+            from blutil.threadtools import PycaThreadPool
+            pool = PycaThreadPool(min(len(pending), 8))
+        t0 = time.time()
+        try:
+            while pending:
+                ready = [b for b in pending if self._deps_done(b)]
+                if not ready:
+                    # Unknown or circular dependencies, build the rest in order
+                    ready = pending
+                if pool is not None and len(ready) > 1:
+                    pool.map(self._build, ready)
+                else:
+                    for block in ready:
+                        self._build(block)
+                pending = [b for b in pending if b not in ready]
+        finally:
+            if pool is not None:
+                pool.close()
+        self._wall = time.time() - t0
+        if profile:
+            self.print_profile()
+
+    def _deps_done(self, block):
+        for dep in block.deps:
+            provider = self._providers.get(dep)
+            if provider is not None and not provider.lazy and provider.state is None:
+                return False
+        return True
+
+    def _build(self, block):
+        """
+        Build one device and its lazy dependencies. Safe to call more than
+        once and from several threads.
+        """
+        with block.lock:
+            if block.state is not None or block.building:
+                return
+            block.building = True
+            for dep in block.deps:
+                provider = self._providers.get(dep)
+                if provider is not None and provider is not block:
+                    self._build(provider)
+            t0 = time.time()
+            try:
+                objs = block.func() or {}
+                for name in block.names:
+                    self._ns[name] = objs.get(name)
+                block.state = "ok"
+                if self._export is not None and not block.lazy:
+                    self._export(*block.names)
+                sys.stdout.write("defining {0}...done\n".format(block.desc))
+            except Exception, exc:
+                for name in block.names:
+                    self._ns[name] = None
+                block.state = "failed"
+                if self._warning is not None:
+                    self._warning(block.error)
+                else:
+                    sys.stdout.write(block.error + "\n")
+                sys.stdout.write("{0}\n".format(exc))
+            block.time = time.time() - t0
+            block.building = False
+            sys.stdout.flush()
+
+    def profile(self):
+        """
+        Return a list of (desc, seconds, state) for every device, in the
+        order they were declared. Lazy devices not yet built have state
+        "lazy" and seconds None.
+        """
+        return [(b.desc, b.time, b.state or ("lazy" if b.lazy else "pending"))
+                for b in self._blocks]
+
+    def print_profile(self):
+        """
+        Print the startup profile table, slowest devices first.
+        """
+        rows = sorted(self.profile(), key=lambda r: -(r[1] or 0))
+        width = max([len(r[0]) for r in rows] + [6])
+        print "{0:{1}}  {2:>8}  {3}".format("device", width, "time (s)", "state")
+        for desc, dt, state in rows:
+            if dt is None:
+                dt = ""
+            else:
+                dt = "{0:.2f}".format(dt)
+            print "{0:{1}}  {2:>8}  {3}".format(desc, width, dt, state)
+        total = sum(r[1] or 0 for r in rows)
+        wall = getattr(self, "_wall", total)
+        print "{0:{1}}  {2:>8.2f}  (sum {3:.2f})".format("total", width, wall, total)
+
+
+class DeviceBlock(object):
+    """
+    One declared device function of a DeviceRegistry.
+    """
+    def __init__(self, func, names, deps=(), lazy=False, desc=None, error=None):
+        self.func = func
+        self.names = names
+        self.deps = deps
+        self.lazy = lazy
+        self.desc = desc or names[0]
+        self.error = error or "Error loading {0}!".format(self.desc)
+        self.state = None
+        self.time = None
+        self.building = False
+        self.lock = threading.RLock()
+
+
+class LazyDevice(object):
+    """
+    Stand-in for a lazy device. The device is built on first attribute
+    access or call, and every access after that is forwarded to it.
+    """
+    def __init__(self, registry, block, name):
+        object.__setattr__(self, "_lazy", (registry, block, name))
+
+    def _lazy_obj(self):
+        registry, block, name = object.__getattribute__(self, "_lazy")
+        registry._build(block)
+        obj = registry._ns.get(name)
+        if obj is None or obj is self:
+            raise AttributeError("{0} failed to load".format(name))
+        return obj
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_obj(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._lazy_obj(), attr, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._lazy_obj()(*args, **kwargs)
+
+    def __dir__(self):
+        return dir(self._lazy_obj())
+
+    def __repr__(self):
+        registry, block, name = object.__getattribute__(self, "_lazy")
+        if block.state is None:
+            return "<{0}: not loaded yet>".format(name)
+        return repr(registry._ns.get(name))
@@ -7,6 +7,20 @@ from scipy.interpolate import interp1d
 from pylab import *
 import config
 
+def _grow_until(y,nb,limit):
+  """ smallest nt >= nb with std(y[0:nt]) >= limit (len(y) if there is
+  none); the std of every leading slice comes from cumulative sums """
+  y = asarray(y,dtype=float)
+  y = y-y[0:nb].mean()
+  nts = arange(nb,len(y)+1)
+  s1 = cumsum(y)[nb-1:]
+  s2 = cumsum(y*y)[nb-1:]
+  std = sqrt(maximum(s2/nts-(s1/nts)**2,0))
+  idx = flatnonzero(std>=limit)
+  if len(idx)==0:
+    return len(y)
+  return nts[idx[0]]
+
 def PeakAnalysis(x,y,nb=3,plotpoints=False):
   """ nb = number of point (on each side) to use as background"""
   ## get background
@@ -69,18 +83,12 @@ def PeakAnalysis(x,y,nb=3,plotpoints=False):
   if not ispeak:
     # findings start of step coming from left.
     std0 = scipy.std(y[0:nb])
-    nt = nb
-
-    while (scipy.std(y[0:nt])<(2*std0)) and (nt<len(y)):
-      nt = nt+1
+    nt = _grow_until(y,nb,2*std0)
     lev0 = scipy.mean(y[0:nt])
 
     # findings start of step coming from right.
     std0 = scipy.std(y[-nb:])
-    nt = nb
-
-    while (scipy.std(y[-nt:])<(2*std0)) and (nt<len(y)):
-      nt = nt+1
+    nt = _grow_until(y[::-1],nb,2*std0)
     lev1 = scipy.mean(y[-nt:])
 
     gg = abs(y-((lev0+lev1)/2)).argmin()     
@@ -135,6 +143,98 @@ def PeakAnalysis(x,y,nb=3,plotpoints=False):
 
   return (CEN,FWHM,PEAK)
 
+class RunningPeak:
+  """ Peak statistics of a scan growing one point at a time. append()
+  updates running sums, so the center of mass, rms width and position of
+  the maximum cost O(1) per point; analyze() runs PeakAnalysis on the
+  points collected so far and caches the result until the next append. """
+  def __init__(self,nb=3,size=256):
+    self.nb = nb
+    self.reset(size)
+
+  def reset(self,size=256):
+    self.__x = empty(size)
+    self.__y = empty(size)
+    self.n = 0
+    self.__s0 = self.__s1 = self.__s2 = 0.
+    self.__imax = None
+    self.__result = None
+
+  def __reserve(self,n):
+    if (n > len(self.__x)):
+      size = 2*len(self.__x)
+      if (size < n):
+        size = n
+      self.__x = resize(self.__x,size)
+      self.__y = resize(self.__y,size)
+
+  def append(self,x,y):
+    self.__reserve(self.n+1)
+    self.__x[self.n] = x
+    self.__y[self.n] = y
+    if isfinite(x) and isfinite(y):
+      self.__s0 += y
+      self.__s1 += x*y
+      self.__s2 += x*x*y
+      if (self.__imax is None) or (y > self.__y[self.__imax]):
+        self.__imax = self.n
+    self.n += 1
+    self.__result = None
+
+  def extend(self,x,y):
+    x = asarray(x,dtype=float)
+    y = asarray(y,dtype=float)
+    n0 = self.n
+    self.__reserve(n0+len(x))
+    self.__x[n0:n0+len(x)] = x
+    self.__y[n0:n0+len(x)] = y
+    ok = isfinite(x) & isfinite(y)
+    if ok.any():
+      xo = x[ok]
+      yo = y[ok]
+      self.__s0 += yo.sum()
+      self.__s1 += (xo*yo).sum()
+      self.__s2 += (xo*xo*yo).sum()
+      i = n0+flatnonzero(ok)[yo.argmax()]
+      if (self.__imax is None) or (self.__y[i] > self.__y[self.__imax]):
+        self.__imax = i
+    self.n += len(x)
+    self.__result = None
+
+  def data(self):
+    """ (x,y) arrays of the points so far (views, do not modify) """
+    return self.__x[:self.n],self.__y[:self.n]
+
+  def com(self):
+    """ center of mass sum(x*y)/sum(y) """
+    if (self.__s0 == 0):
+      return nan
+    return self.__s1/self.__s0
+
+  def rms(self):
+    """ rms width around the center of mass """
+    if (self.__s0 == 0):
+      return nan
+    c = self.__s1/self.__s0
+    return sqrt(maximum(self.__s2/self.__s0-c*c,0))
+
+  def peak(self):
+    """ x of the largest y """
+    if (self.__imax is None):
+      return nan
+    return self.__x[self.__imax]
+
+  def analyze(self):
+    """ (CEN,FWHM,PEAK) of PeakAnalysis, nan if it fails """
+    if (self.__result is None):
+      x,y = self.data()
+      ok = isfinite(x)
+      try:
+        self.__result = PeakAnalysis(x[ok],y[ok],self.nb)
+      except:
+        self.__result = (nan,nan,nan)
+    return self.__result
+
 if (__name__ == "__main__"):
   x = arange(-10,10,1)
   sig = 2
@@ -2,17 +2,34 @@ import matplotlib
 if not hasattr(matplotlib,'backends'):
     matplotlib.use("TkAgg")
 import pylab as p
+import time
+import threading
 from numpy import array,isfinite
-from peakanalysis import PeakAnalysis
+from peakanalysis import PeakAnalysis,RunningPeak
+import config
+import spans
 import blutil
 
 
 class Plot2D:
-  def __init__(self,i,x=None,y=None,daq=None,dets=None):
+  """ Online scan plot. Points given to setdata/append are buffered and
+  drawn at most max_rate times per second (config.PLOT_max_rate): by the
+  call that finds the last draw old enough, or by a canvas timer while
+  the GUI event loop runs. Only the thread that created the plot draws;
+  flush() draws what is still pending, close() also stops the timer. """
+  def __init__(self,i,x=None,y=None,daq=None,dets=None,max_rate=None):
     self.__id = i
     self.daq=daq
     self.dets=dets
-    p.ion(); # interactive on
+    if (max_rate is None):
+      max_rate = config.PLOT_max_rate
+    self.max_rate = max_rate
+    self.__peak = RunningPeak()
+    self.__dirty = False
+    self.__last_draw = 0.
+    self.__thread = threading.current_thread()
+    if (matplotlib.get_backend() in matplotlib.rcsetup.interactive_bk):
+      p.ion(); # interactive on; off screen backends would redraw on every change
     self.enable=True
     self.fig = p.figure(i)
     self.fig.canvas.set_window_title('%spython online plot' % blutil.guessBeamline())
@@ -31,9 +48,16 @@ class Plot2D:
 
     if (x is not None):
       self.line,=self.plot.plot(x,y,thisspec)
+      self.__peak.extend(x,y)
     else:
       self.line,=self.plot.plot([0, 1],[0,1],thisspec)
     p.draw()
+    try:
+      self.__timer = self.fig.canvas.new_timer(interval=int(1000./self.max_rate))
+      self.__timer.add_callback(self.update)
+      self.__timer.start()
+    except AttributeError:
+      self.__timer = None
 
   def win_title(self,title):
     self.fig.canvas.set_window_title(title)
@@ -76,33 +100,65 @@ class Plot2D:
     colorstring = colors[colorletter]
     return colorstring
 
+  @spans.timed("plot.setdata")
   def setdata(self,x,y):
+    """ replace the plotted points """
     if (not self.enable):
       return
-    p.figure(self.__id)
-    x=array(x)[isfinite(x)]
-    y=array(y)[isfinite(x)]
-#    print y
-#    idx = isfinite(y)
-#    x = x[idx]
-#    y = y[idx]
+    self.__peak.reset(max(len(x),256))
+    self.__peak.extend(array(x,dtype=float),array(y,dtype=float))
+    self.__dirty = True
+    self.update()
+
+  def append(self,x,y):
+    """ add one point to the plot """
+    if (not self.enable):
+      return
+    self.__peak.append(x,y)
+    self.__dirty = True
+    self.update()
+
+  def update(self):
+    """ draw the pending points if the last draw is older than 1/max_rate """
+    if self.__dirty and (time.time()-self.__last_draw >= 1./self.max_rate):
+      self.render()
+
+  def flush(self):
+    """ draw the pending points now """
+    if self.__dirty:
+      self.render()
+
+  def close(self):
+    """ draw the pending points and stop the redraw timer, when no more
+    points come; the figure stays open """
+    self.flush()
+    if (self.__timer is not None):
+      self.__timer.stop()
+      self.__timer.remove_callback(self.update)
+      self.__timer = None
+
+  @spans.timed("plot.render")
+  def render(self):
+    if (not self.enable) or (threading.current_thread() is not self.__thread):
+      return
+    self.__dirty = False
+    x,y = self.__peak.data()
+    ok = isfinite(x)
+    x = x[ok]
+    y = y[ok]
     self.line.set_data(x,y)
-    try:
-        self.plot.set_ylim(y[isfinite(y)].min(),y[isfinite(y)].max())
-    except ValueError:
-        print "Error updating ylim! We have no data or invalid data!"
-    try:
-        self.plot.set_xlim(x[isfinite(x)].min(),x[isfinite(x)].max())
-    except ValueError:
-        print "Error updating xlim! We have no data or invalid data!"
-    try :
-      (CEN,FWHM,PEAK) = PeakAnalysis(x,y)
-    except:
-      CEN=FWHM=PEAK=1e1000/1e1000
-    title = "CEN %.5e, FWHM %.5e, PEAK %.5e" % (CEN,FWHM,PEAK)
-    self.set_title(title)
-    p.draw()
-    p.pause(0.01)
+    yok = y[isfinite(y)]
+    if (len(yok) == 0):
+      print "Error updating ylim! We have no data or invalid data!"
+    elif (yok.max() > yok.min()):
+      self.plot.set_ylim(yok.min(),yok.max())
+    if (len(x) > 1) and (x.max() > x.min()):
+      self.plot.set_xlim(x.min(),x.max())
+    (CEN,FWHM,PEAK) = self.__peak.analyze()
+    self.plot.set_title("CEN %.5e, FWHM %.5e, PEAK %.5e" % (CEN,FWHM,PEAK))
+    self.fig.canvas.draw_idle()
+    self.fig.canvas.flush_events()
+    self.__last_draw = time.time()
 
   def get_data_from_daq(self):
     while True:
@@ -7,6 +7,12 @@
     print_screen=True/False print also to the screen
     newline=True/False print also to the screen
 
+    By default (config.LOGFILE_async) logprint only queues the line; a writer
+    thread formats, writes and flushes in batches every
+    config.LOGFILE_flush_interval seconds or config.LOGFILE_flush_bytes bytes,
+    and opens the next day's file when the date changes. The queue is drained
+    at exit; call flush() to wait for everything queued so far to be on disk.
+
     DATA:
     gFilename:  current filename
     gLogfolder: current path to logfile
@@ -14,7 +20,13 @@
 """
 import sys
 import os
+import time
+import datetime
+import threading
+import Queue
+import atexit
 import config
+import spans
 import blutil
 
 PYPS_INTERACTIVE = os.getenv('PYPS_INTERACTIVE',"FALSE").lower()=='true'
@@ -23,6 +35,11 @@ gFilename    = None
 gLogf        = None
 gLogfolder   = None
 
+gQueue       = Queue.Queue()
+gWriter      = None
+gWriterLock  = threading.Lock()
+_FLUSH       = "flush" # queue marker asking the writer to flush now
+
 def checkFolder():
   """ returns (and set global variable) for folder to use for logfile
   most of the time it will be ~operator/pyps/log"""
@@ -39,17 +56,102 @@ def checkFolder():
   globals()["gLogfolder"] = folder
   return folder
 
-def guessFilename():
+def guessFilename(date=None):
   """ returns (and set global variable) for filename to use
   if automatically sets it to for example 2011-04-19_pyps.log"""
   if (gLogfolder is None): checkFolder()
-  date = blutil.today()
+  if (date is None): date = blutil.today()
   fname = date + "_pyps.log"
+  if (gLogf is not None): gLogf.close()
   globals()["gFilename"] = fname
   fname_complete = gLogfolder+"/"+fname
   globals()["gLogf"] = open(fname_complete,"a")
   return fname_complete
 
+def _format(t,text,date,newline):
+  """ returns (day, line) for a log record queued at time t """
+  now = datetime.datetime.fromtimestamp(t)
+  day = "%04d-%02d-%02d" % (now.year,now.month,now.day)
+  if (config.PRINT_DATE & date):
+    text = "%s %02d:%02d:%02d.%03d %s" % (day,now.hour,now.minute,
+                     now.second,int(now.microsecond/1e3),text)
+  if (newline): text += "\n"
+  return day,text
+
+def _write(records):
+  """ writes a batch of (t,text,date,newline) records, switching to a new
+  file when the day changes. Returns the number of bytes written """
+  nbytes = 0
+  for rec in records:
+    day,text = _format(*rec)
+    if ( (gLogf is None) or (not gFilename.startswith(day)) ):
+      guessFilename(day)
+    gLogf.write(text)
+    nbytes += len(text)
+  return nbytes
+
+def _writer():
+  """ writer thread: takes records from gQueue and writes them in batches.
+  A None record stops the thread after everything before it is written,
+  a _FLUSH record forces a flush """
+  pending = 0
+  last_flush = time.time()
+  running = True
+  while running:
+    try:
+      records = [gQueue.get(timeout=config.LOGFILE_flush_interval)]
+    except Queue.Empty:
+      records = []
+    # grab whatever else is already waiting, without blocking
+    while True:
+      try:
+        records.append(gQueue.get_nowait())
+      except Queue.Empty:
+        break
+    running = None not in records
+    force = (not running) or (_FLUSH in records)
+    try:
+      pending += _write([r for r in records if r not in (None,_FLUSH)])
+      now = time.time()
+      if pending > 0 and ( force or (pending >= config.LOGFILE_flush_bytes)
+          or (now-last_flush >= config.LOGFILE_flush_interval) ):
+        gLogf.flush()
+        pending = 0
+        last_flush = now
+    except Exception, e:
+      sys.stderr.write("pypslog: error writing logfile: %s\n" % e)
+    finally:
+      for r in records:
+        gQueue.task_done()
+
+def _start_writer():
+  """ starts the writer thread if it is not running """
+  global gWriter
+  with gWriterLock:
+    if (gWriter is None) or (not gWriter.is_alive()):
+      gWriter = threading.Thread(target=_writer,name="pypslog writer")
+      gWriter.daemon = True
+      gWriter.start()
+
+def flush():
+  """ blocks until every line queued so far has been written and flushed """
+  if (gWriter is not None) and gWriter.is_alive():
+    gQueue.put(_FLUSH)
+    gQueue.join()
+  elif (gLogf is not None): gLogf.flush()
+
+def stop():
+  """ writes everything queued and stops the writer thread """
+  global gWriter
+  if (gWriter is not None) and gWriter.is_alive():
+    gQueue.put(None)
+    gWriter.join()
+  gWriter = None
+  if (gLogf is not None): gLogf.flush()
+
+atexit.register(stop)
+
+@spans.timed("pypslog.logprint")
 def logprint(text,date=True,print_screen=None,newline=True):
   """ appends `text` to the logfile.
   Optional (booleans):
@@ -59,13 +161,50 @@ def logprint(text,date=True,print_screen=None,newline=True):
   if not PYPS_INTERACTIVE:
     print "WARNING: pypslog.logprint, not in interactive mode, not logging"
     return
-  if ( (gLogf is None) or (gFilename.startswith(blutil.today()) != True) ): guessFilename()
-  if (config.PRINT_DATE & date):
-    text = "%s %s" % (blutil.now(),text)
-  if (newline): text += "\n"
+  rec = (time.time(),text,date,newline)
   if (print_screen is None): print_screen = config.LOGFILE_print_screen
   if (print_screen):
-    sys.stdout.write(text)
+    sys.stdout.write(_format(*rec)[1])
     sys.stdout.flush()
-  gLogf.write(text)
-  gLogf.flush()
+  if (config.LOGFILE_async):
+    if (gWriter is None) or (not gWriter.is_alive()): _start_writer()
+    gQueue.put(rec)
+  else:
+    if (gWriter is not None): stop()
+    _write([rec])
+    gLogf.flush()
+
+def benchmark(n=10000):
+  """ measures the time spent in the caller for n logprint calls, with the
+  writer thread and with synchronous writes. The lines go to a logfile in
+  a temporary folder, not to the real one. Returns (async,sync) in
+  microseconds per call """
+  import tempfile
+  import shutil
+  global PYPS_INTERACTIVE,gLogfolder,gFilename,gLogf
+  stop()
+  old_async = config.LOGFILE_async
+  old_screen = config.LOGFILE_print_screen
+  old_log = (PYPS_INTERACTIVE,gLogfolder,gFilename,gLogf)
+  tmpdir = tempfile.mkdtemp()
+  config.LOGFILE_print_screen = False
+  PYPS_INTERACTIVE = True
+  gLogfolder,gFilename,gLogf = tmpdir,None,None
+  res = []
+  try:
+    for use_async in (True,False):
+      config.LOGFILE_async = use_async
+      t0 = time.time()
+      for i in range(n):
+        logprint("pypslog benchmark %d" % i)
+      res.append( (time.time()-t0)/n*1e6 )
+      flush()
+  finally:
+    stop()
+    if (gLogf is not None): gLogf.close()
+    config.LOGFILE_async = old_async
+    config.LOGFILE_print_screen = old_screen
+    PYPS_INTERACTIVE,gLogfolder,gFilename,gLogf = old_log
+    shutil.rmtree(tmpdir,ignore_errors=True)
+  print "logprint: %.1f us/call with writer thread, %.1f us/call synchronous" % tuple(res)
+  return tuple(res)
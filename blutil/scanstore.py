@@ -0,0 +1,290 @@
+""" Append-only binary store for scan points.
+    A store holds any number of scans, each a table of float columns plus
+    a metadata dictionary (motors, detectors, run number, times, ...).
+
+    With h5py the store is one HDF5 file with a group per scan and a
+    resizable compound dataset "points" that grows by one row per append.
+    Without h5py the store is a directory with a subdirectory per scan:
+    points are written as numbered .npz chunks while the scan runs and
+    merged into a single points.npy when it is closed.
+
+    usage:
+    w = ScanWriter("scan.h5", ["point","x","diode","diode_err"], meta)
+    w.append([1, 0.5, 1.2e3, 4.0])
+    w.close(run=123)
+    data,meta = read_scan("scan.h5")     # last scan, structured array
+    data["diode"]
+"""
+import os
+import re
+import glob
+import json
+import time
+import numpy as np
+
+try:
+  import h5py
+except ImportError:
+  h5py = None
+
+def default_ext():
+  """ extension of new stores: .h5 if h5py is available, else .scans """
+  if (h5py is not None):
+    return ".h5"
+  return ".scans"
+
+def _is_hdf5(path):
+  return path.endswith(".h5") or path.endswith(".hdf5")
+
+def unique_names(names):
+  """ make column names unique by appending _2, _3, ... to repeats """
+  out = []
+  for name in names:
+    new = name
+    i = 2
+    while new in out:
+      new = "%s_%d" % (name,i)
+      i += 1
+    out.append(new)
+  return out
+
+
+class ScanWriter:
+  """ Writes the points of one scan to a store, opening it (or adding a
+  new scan to it) on creation. chunk is the number of points buffered
+  before they are written when the npz backend is used; HDF5 rows are
+  written and flushed on every append. """
+  def __init__(self,path,columns,meta=None,chunk=64):
+    self.path = path
+    self.columns = unique_names(columns)
+    self.dtype = np.dtype([(str(c),np.float64) for c in self.columns])
+    self.meta = dict(meta or {})
+    self.meta.setdefault("start_time",time.time())
+    self.meta["columns"] = self.columns
+    self.npoints = 0
+    self.__chunk = chunk
+    self.__buffer = []
+    self.__nchunks = 0
+    if _is_hdf5(path):
+      if (h5py is None):
+        raise ImportError("h5py is needed to write %s" % path)
+      self.__h5 = h5py.File(path,"a")
+      self.scan = "scan%04d" % len(self.__h5.keys())
+      group = self.__h5.create_group(self.scan)
+      self.__ds = group.create_dataset("points",shape=(0,),maxshape=(None,),
+        dtype=self.dtype,chunks=(max(chunk,1),))
+      self.__group = group
+      self.__write_meta()
+    else:
+      self.__h5 = None
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      self.scan = "scan%04d" % len(list_scans(path))
+      self.__dir = os.path.join(path,self.scan)
+      os.mkdir(self.__dir)
+      self.__write_meta()
+
+  def __write_meta(self):
+    if (self.__h5 is not None):
+      self.__group.attrs["meta"] = json.dumps(self.meta)
+      self.__h5.flush()
+    else:
+      tmp = os.path.join(self.__dir,"meta.json.tmp")
+      with open(tmp,"w") as f:
+        json.dump(self.meta,f)
+      os.rename(tmp,os.path.join(self.__dir,"meta.json"))
+
+  def append(self,values):
+    """ add one point; values are given in column order """
+    row = np.array(tuple(float(v) for v in values),dtype=self.dtype)
+    if (self.__h5 is not None):
+      self.__ds.resize((self.npoints+1,))
+      self.__ds[self.npoints] = row
+      self.__h5.flush()
+    else:
+      self.__buffer.append(row)
+      if (len(self.__buffer) >= self.__chunk):
+        self.flush()
+    self.npoints += 1
+
+  def flush(self):
+    """ write the buffered points (npz backend) """
+    if (self.__h5 is not None) or (len(self.__buffer) == 0):
+      return
+    fname = os.path.join(self.__dir,"chunk%05d.npz" % self.__nchunks)
+    np.savez(fname,points=np.array(self.__buffer,dtype=self.dtype))
+    self.__nchunks += 1
+    self.__buffer = []
+
+  def close(self,**meta):
+    """ finish the scan, adding meta to its metadata """
+    self.meta.update(meta)
+    self.meta.setdefault("end_time",time.time())
+    self.meta["npoints"] = self.npoints
+    if (self.__h5 is not None):
+      self.__write_meta()
+      self.__h5.close()
+      return
+    self.flush()
+    points = _read_chunks(self.__dir,self.dtype)
+    tmp = os.path.join(self.__dir,"points.tmp.npy")
+    np.save(tmp,points)
+    os.rename(tmp,os.path.join(self.__dir,"points.npy"))
+    for fname in glob.glob(os.path.join(self.__dir,"chunk*.npz")):
+      os.remove(fname)
+    self.__write_meta()
+
+
+def _read_chunks(dirname,dtype=None):
+  chunks = []
+  for fname in sorted(glob.glob(os.path.join(dirname,"chunk*.npz"))):
+    chunks.append(np.load(fname)["points"])
+  if (len(chunks) == 0):
+    return np.zeros(0,dtype=dtype)
+  return np.concatenate(chunks)
+
+def list_scans(path):
+  """ names of the scans in a store, oldest first """
+  if not os.path.exists(path):
+    return []
+  if _is_hdf5(path):
+    with h5py.File(path,"r") as f:
+      return sorted(f.keys())
+  return sorted(d for d in os.listdir(path) if re.match(r"scan\d+$",d))
+
+def read_meta(path,scan=-1):
+  """ metadata dictionary of a scan (by name or index) """
+  if not isinstance(scan,basestring):
+    scan = list_scans(path)[scan]
+  if _is_hdf5(path):
+    with h5py.File(path,"r") as f:
+      return json.loads(f[scan].attrs["meta"])
+  with open(os.path.join(path,scan,"meta.json")) as f:
+    return json.load(f)
+
+def read_scan(path,scan=-1,mmap=False):
+  """ returns (points,meta) of a scan given by name or index (default:
+  the last one). points is a structured array with one field per column.
+  With mmap=True the points are not read into memory: a memory mapped
+  array for the npz backend, the h5py dataset for HDF5 (index it with a
+  column name to read one column). """
+  if not isinstance(scan,basestring):
+    scan = list_scans(path)[scan]
+  if _is_hdf5(path):
+    f = h5py.File(path,"r")
+    ds = f[scan]["points"]
+    meta = json.loads(f[scan].attrs["meta"])
+    if mmap:
+      return ds,meta
+    points = ds[...]
+    f.close()
+    return points,meta
+  dirname = os.path.join(path,scan)
+  meta = read_meta(path,scan)
+  fname = os.path.join(dirname,"points.npy")
+  if os.path.exists(fname):
+    points = np.load(fname,mmap_mode="r" if mmap else None)
+  else:
+    # scan still running or interrupted
+    points = _read_chunks(dirname)
+  return points,meta
+
+
+def parse_txt(fname):
+  """ parse a text scan log written by Daq.savetxt; returns a list of
+  (columns,rows,meta), one per scan in the file """
+  scans = []
+  cur = None
+  for line in open(fname):
+    if re.match(r"#\s*\w*python scan #",line):
+      cur = dict(motors=[],names=None,rows=[],meta={"source":os.path.abspath(fname)})
+      scans.append(cur)
+      continue
+    if cur is None:
+      continue
+    m = re.search(r"Scanning\s+motor:\s*(\S+)",line)
+    if m:
+      cur["motors"].append(m.group(1))
+    elif line.startswith("#++"):
+      cur["names"] = line[3:].split()
+    elif line.startswith("#"):
+      m = re.search(r"run number \(0 = not saved\):\s*(\d+)",line)
+      if m:
+        cur["meta"]["run"] = int(m.group(1))
+      m = re.search(r"(Start|End) time:\s*(.*)$",line)
+      if m:
+        cur["meta"][m.group(1).lower()+"_time_str"] = m.group(2).strip().strip('"')
+      m = re.search(r"normalization monitor:\s*(\S+)",line)
+      if m:
+        cur["meta"]["monitor"] = m.group(1)
+    elif line.strip():
+      try:
+        cur["rows"].append([float(v) for v in line.split()])
+      except ValueError:
+        print "Warning: skipping bad line in %s: %s" % (fname,line.strip())
+  out = []
+  for s in scans:
+    motors = s["motors"]
+    names = s["names"] or []
+    dets = names[len(motors):]
+    columns = ["point"] + motors
+    for det in dets:
+      columns += [det,det+"_err"]
+    columns += ["pulses"]
+    meta = s["meta"]
+    meta["motors"] = motors
+    meta["detectors"] = dets
+    rows = [r for r in s["rows"] if len(r) == len(columns)]
+    if (len(rows) != len(s["rows"])):
+      print "Warning: %d rows of a scan in %s do not match its header" % (len(s["rows"])-len(rows),fname)
+    out.append((columns,rows,meta))
+  return out
+
+def convert_txt(fname,path=None):
+  """ convert a text scan log (Daq.savetxt format, one or more scans) to a
+  binary store; path defaults to fname with the store extension """
+  if (path is None):
+    path = os.path.splitext(fname)[0] + default_ext()
+  for columns,rows,meta in parse_txt(fname):
+    w = ScanWriter(path,columns,meta,chunk=max(len(rows),1))
+    for row in rows:
+      w.append(row)
+    w.close()
+  return path
+
+
+def benchmark(npoints=10000,ncols=20,path=None):
+  """ time per point appends and reading back, for the binary store and
+  for the text format written by Daq.savetxt """
+  import tempfile
+  import shutil
+  tmpdir = tempfile.mkdtemp()
+  try:
+    if (path is None):
+      path = os.path.join(tmpdir,"bench"+default_ext())
+    columns = ["point"] + ["c%d" % i for i in range(ncols-1)]
+    data = np.random.rand(npoints,ncols)
+    t0 = time.time()
+    w = ScanWriter(path,columns)
+    for row in data:
+      w.append(row)
+    w.close()
+    t1 = time.time()
+    points,meta = read_scan(path)
+    col = np.asarray(points["c0"])
+    t2 = time.time()
+    txt = os.path.join(tmpdir,"bench.dat")
+    with open(txt,"w") as f:
+      f.write("# xpppython scan #\n#++ %s\n" % " ".join(columns[1:]))
+      for row in data:
+        f.write(" ".join("%12.5e" % v for v in row) + "\n")
+        f.flush()
+    t3 = time.time()
+    ref = np.loadtxt(txt)
+    t4 = time.time()
+    print "%d points x %d columns" % (npoints,ncols)
+    print "store %-6s write %.3f s, read %.3f s" % (default_ext(),t1-t0,t2-t1)
+    print "text         write %.3f s, read %.3f s" % (t3-t2,t4-t3)
+    return dict(store_write=t1-t0,store_read=t2-t1,text_write=t3-t2,text_read=t4-t3)
+  finally:
+    shutil.rmtree(tmpdir)
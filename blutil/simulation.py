@@ -0,0 +1,759 @@
+"""
+Simulated EPICS, DAQ and AMI backend.
+
+install() puts stand-ins for psp (psp.Pv, psp.utils, psp.caget), pyca,
+pydaq and pyami into sys.modules, so Motor, Daq, IterScan, DelayScan and
+the rest of the scan code run against simulated PVs, a simulated DAQ and
+simulated AMI entries instead of a live IOC and DAQ. It has to be called
+before anything imports those modules.
+
+    from blutil import simulation
+    sim = simulation.install()
+    sim.add_motor("SIM:MMS:01", velocity=2.0, accel=0.1)
+    sim.add_detector("SIM:DIODE", lambda: sim.gauss("SIM:MMS:01", 0, 1))
+    from blbase.motor import Motor
+    m = Motor("SIM:MMS:01", name="simx")
+
+PVs live in a SimServer. Unknown names are created on first use with
+value 0 (set server.autocreate = False to make them fail like an
+unreachable PV). server.latency adds a delay to every get, put and
+connect to mimic channel access round trips.
+"""
+import sys
+import time
+import math
+import types
+import random
+import threading
+import numpy as np
+
+DEFAULT_TIMEOUT = 1.0
+
+# MSTA bits set by the simulated motor record
+_MSTA_DONE     = 1
+_MSTA_PLUS_LS  = 2
+_MSTA_MINUS_LS = 13
+
+server = None
+
+
+class pyexc(Exception):
+  """ stand-in for pyca.pyexc """
+  pass
+
+class caexc(Exception):
+  """ stand-in for pyca.caexc """
+  pass
+
+
+class SimServer(object):
+  """
+  Holds the value of every simulated PV and the monitors on it.
+  put hooks let records (motors) react to writes.
+  """
+  def __init__(self, latency=0.0, autocreate=True):
+    self.latency = latency
+    self.autocreate = autocreate
+    self._values = {}
+    self._monitors = {}
+    self._hooks = {}
+    self._lock = threading.RLock()
+    self.motors = {}
+    self.cameras = {}
+    self.detectors = {}
+    self.daq_rate = 120.
+    self.daq_overhead = 0.0
+    self.counts = dict(get=0, put=0, connect=0)
+
+  def _delay(self):
+    if self.latency > 0:
+      time.sleep(self.latency)
+
+  def exists(self, name):
+    return name in self._values
+
+  def add(self, name, value=0, hook=None):
+    """ create (or reset) a PV; hook(value) is called on every put """
+    with self._lock:
+      self._values[name] = value
+      if hook is not None:
+        self._hooks[name] = hook
+    self._notify(name)
+
+  def _check(self, name):
+    if name not in self._values:
+      if self.autocreate:
+        self.add(name, 0)
+      else:
+        raise pyexc("simulated PV %s does not exist" % name)
+
+  def get(self, name):
+    self.counts["get"] += 1
+    self._delay()
+    self._check(name)
+    return self._values[name]
+
+  def put(self, name, value):
+    """ client write: runs the record's hook if it has one """
+    self.counts["put"] += 1
+    self._delay()
+    self._check(name)
+    hook = self._hooks.get(name)
+    self.set(name, value)
+    if hook is not None:
+      hook(value)
+
+  def set(self, name, value):
+    """ record side write: updates the value and fires the monitors """
+    with self._lock:
+      self._values[name] = value
+    self._notify(name)
+
+  def subscribe(self, name, pv):
+    with self._lock:
+      self._monitors.setdefault(name, []).append(pv)
+
+  def unsubscribe(self, name, pv):
+    with self._lock:
+      try:
+        self._monitors.get(name, []).remove(pv)
+      except ValueError:
+        pass
+
+  def _notify(self, name):
+    with self._lock:
+      pvs = list(self._monitors.get(name, []))
+      value = self._values.get(name)
+    for pv in pvs:
+      pv._monitor_event(value)
+
+  def add_motor(self, pvname, **kw):
+    """ add a simulated motor record, see SimMotor for the options """
+    mot = SimMotor(self, pvname, **kw)
+    self.motors[pvname] = mot
+    return mot
+
+  def add_camera(self, pvname, **kw):
+    """ add a simulated areaDetector camera, see SimCamera for the options """
+    cam = SimCamera(self, pvname, **kw)
+    self.cameras[pvname] = cam
+    return cam
+
+  def add_detector(self, name, func=None, noise=0.01):
+    """
+    add a simulated AMI scalar. func() gives the true value at the time
+    of the readout (default 1.0); noise is the shot to shot rms.
+    """
+    self.detectors[name] = (func or (lambda: 1.0), noise)
+
+  def gauss(self, pvname, center=0., sigma=1., amplitude=1.):
+    """ gaussian of the readback of pvname, handy as a detector func """
+    x = self._values.get(pvname + ".RBV", 0.)
+    return amplitude * math.exp(-0.5*((x-center)/sigma)**2)
+
+
+class SimMotor(object):
+  """
+  Simulated EPICS motor record. A put to .VAL starts a trapezoidal move
+  (velocity VELO, acceleration time ACCL) that updates RBV, DMOV, MOVN
+  and MSTA every 1/update_rate seconds. Moves are cut at the soft limits
+  (LLM/HLM, flagging LVIO) and stop on the limit switches at hw_low and
+  hw_high (flagging LLS/HLS and the MSTA limit bits). STOP halts the
+  motor where it is.
+  """
+  def __init__(self, server, pvname, pos=0., velocity=1., accel=0.1,
+               base_velocity=0., low=-100., high=100., hw_low=None,
+               hw_high=None, resolution=1e-4, deadband=1e-3, precision=4,
+               description=None, rtyp="motor", update_rate=100.):
+    self.server = server
+    self.pvname = pvname
+    self.update_rate = update_rate
+    self.hw_low = hw_low
+    self.hw_high = hw_high
+    self._lock = threading.Lock()
+    self._target = pos
+    self._thread = None
+    self._abort = threading.Event()
+    self.nmoves = 0
+    fields = dict(VAL=pos, RBV=pos, DVAL=pos, DRBV=pos, RRBV=0, RVAL=0,
+      DMOV=1, MOVN=0, MSTA=1 << _MSTA_DONE, HLM=high, LLM=low, DHLM=high,
+      DLLM=low, VELO=velocity, VMAX=max(velocity, 1.)*10, VBAS=base_velocity,
+      ACCL=accel, MRES=resolution, ERES=resolution, RDBD=deadband,
+      PREC=precision, DESC=description or pvname, RTYP=rtyp, EGU="mm",
+      OFF=0., DIR=0, SET=0, SPMG=3, SPG=2, LVIO=0, HLS=0, LLS=0, S=1.,
+      STOP=0, TWV=1., CNEN=1)
+    for field, value in fields.items():
+      hook = None
+      if field == "VAL":
+        hook = self._move
+      elif field == "STOP":
+        hook = self._stop
+      server.add("%s.%s" % (pvname, field), value, hook)
+    server.add(pvname, pos, self._move)
+
+  def _field(self, field):
+    return self.server._values["%s.%s" % (self.pvname, field)]
+
+  def _set(self, field, value):
+    self.server.set("%s.%s" % (self.pvname, field), value)
+
+  def position(self):
+    return self._field("RBV")
+
+  def _move(self, target):
+    target = float(target)
+    if not self._field("LLM") <= target <= self._field("HLM"):
+      self._set("LVIO", 1)
+      self._set("VAL", self.position())
+      return
+    self._set("LVIO", 0)
+    self._stop()
+    with self._lock:
+      self.nmoves += 1
+      self._abort.clear()
+      self._target = target
+      self._set("VAL", target)
+      self.server.set(self.pvname, target)
+      self._set("DVAL", target)
+      self._set("DMOV", 0)
+      self._set("MOVN", 1)
+      self._set("MSTA", 0)
+      self._thread = threading.Thread(target=self._run, args=(self.position(), target))
+      self._thread.daemon = True
+      self._thread.start()
+
+  def _stop(self, value=1):
+    thread = self._thread
+    if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+      self._abort.set()
+      thread.join()
+
+  def profile(self, start, target):
+    """ returns (duration, position(t)) of a move from start to target """
+    dist = abs(target - start)
+    sign = 1 if target >= start else -1
+    v = max(self._field("VELO"), 1e-9)
+    ta = max(self._field("ACCL"), 0.)
+    if dist == 0:
+      return 0., lambda t: target
+    if ta == 0:
+      dur = dist/v
+      return dur, lambda t: start + sign*min(v*t, dist)
+    a = v/ta
+    if dist >= v*ta:
+      dur = dist/v + ta
+      def pos(t):
+        if t < ta:
+          d = 0.5*a*t*t
+        elif t < dur - ta:
+          d = 0.5*v*ta + v*(t-ta)
+        else:
+          tr = max(dur - t, 0.)
+          d = dist - 0.5*a*tr*tr
+        return start + sign*min(d, dist)
+    else:
+      th = math.sqrt(dist/a)
+      dur = 2*th
+      def pos(t):
+        if t < th:
+          d = 0.5*a*t*t
+        else:
+          tr = max(dur - t, 0.)
+          d = dist - 0.5*a*tr*tr
+        return start + sign*min(d, dist)
+    return dur, pos
+
+  def _run(self, start, target):
+    dur, pos = self.profile(start, target)
+    mres = self._field("MRES") or 1e-12
+    t0 = time.time()
+    dt = 1./self.update_rate
+    msta = 0
+    while True:
+      t = time.time() - t0
+      if self._abort.is_set():
+        self._set("VAL", self.position())
+        break
+      x = pos(min(t, dur))
+      x = round(x/mres)*mres if t < dur else target
+      if self.hw_high is not None and x >= self.hw_high:
+        x = self.hw_high
+        self._set("HLS", 1)
+        msta |= 1 << _MSTA_PLUS_LS
+      elif self.hw_low is not None and x <= self.hw_low:
+        x = self.hw_low
+        self._set("LLS", 1)
+        msta |= 1 << _MSTA_MINUS_LS
+      else:
+        self._set("HLS", 0)
+        self._set("LLS", 0)
+      self._set("RBV", x)
+      self._set("DRBV", x)
+      if t >= dur or msta:
+        break
+      time.sleep(min(dt, max(dur - t, 0.)))
+    self._set("MOVN", 0)
+    self._set("MSTA", msta | 1 << _MSTA_DONE)
+    self._set("DMOV", 1)
+
+
+class SimCamera(object):
+  """
+  Simulated areaDetector camera. Acquire=1 (or start()) produces frames
+  at rate Hz: the camera ArrayCounter_RBV and the UniqueId_RBV of the
+  image plugin count them and the plugin ArrayData gets each frame.
+  With drop_every=n every n-th frame is counted but not posted, like a
+  frame lost on the way to the client.
+  """
+  def __init__(self, server, pvname, shape=(480, 640), rate=30.,
+               plugin="IMAGE1", drop_every=0, model="Simulated GigE"):
+    self.server = server
+    self.pvname = pvname
+    self.plugin = "%s:%s" % (pvname, plugin)
+    self.shape = tuple(shape)
+    self.rate = rate
+    self.drop_every = drop_every
+    self.nframes = 0
+    self._thread = None
+    self._running = threading.Event()
+    self._base = (np.arange(shape[0]*shape[1]) % 4096).astype(np.uint16)
+    fields = dict(ArraySizeX_RBV=shape[1], ArraySizeY_RBV=shape[0],
+      SizeX_RBV=shape[1], SizeY_RBV=shape[0], MinX_RBV=0, MinY_RBV=0,
+      ArrayCounter_RBV=0, ArrayRate_RBV=0., Model_RBV=model,
+      DetectorState_RBV="Idle", AcquirePeriod_RBV=1./rate, Acquire_RBV=0)
+    for field, value in fields.items():
+      server.add("%s:%s" % (pvname, field), value)
+    server.add("%s:Acquire" % pvname, 0, self._acquire)
+    server.add("%s:UniqueId_RBV" % self.plugin, 0)
+    server.add("%s:ArrayCounter_RBV" % self.plugin, 0)
+    server.add("%s:ArrayData" % self.plugin, np.zeros(shape[0]*shape[1], np.uint16))
+
+  def _acquire(self, value):
+    if value:
+      self.start()
+    else:
+      self.stop()
+
+  def start(self):
+    if self._thread is not None and self._thread.is_alive():
+      return
+    self._running.set()
+    self.server.set("%s:Acquire_RBV" % self.pvname, 1)
+    self.server.set("%s:DetectorState_RBV" % self.pvname, "Acquire")
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    self._running.clear()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+    self.server.set("%s:Acquire_RBV" % self.pvname, 0)
+    self.server.set("%s:DetectorState_RBV" % self.pvname, "Idle")
+
+  def _run(self):
+    period = 1./self.rate
+    t0 = time.time()
+    while self._running.is_set():
+      self.nframes += 1
+      n = self.nframes
+      self.server.set("%s:ArrayCounter_RBV" % self.pvname, n)
+      self.server.set("%s:ArrayRate_RBV" % self.pvname, self.rate)
+      if not (self.drop_every and n % self.drop_every == 0):
+        self.server.set("%s:UniqueId_RBV" % self.plugin, n)
+        self.server.set("%s:ArrayCounter_RBV" % self.plugin, n)
+        self.server.set("%s:ArrayData" % self.plugin, self._base + (n % 1024))
+      time.sleep(max(t0 + n*period - time.time(), 0.))
+
+
+class Pv(object):
+  """ stand-in for psp.Pv.Pv """
+  def __init__(self, name, initialize=False, monitor=False, **kw):
+    self.name = name
+    self.value = None
+    self.isconnected = False
+    self.isinitialized = False
+    self.ismonitored = False
+    self.do_initialize = initialize
+    self.do_monitor = monitor
+    self._cbs = {}
+    self._cbid = 0
+    self._conn_cbs = []
+    self._cond = threading.Condition()
+    if initialize:
+      self.connect(DEFAULT_TIMEOUT)
+
+  def __repr__(self):
+    return "<simulated Pv %s>" % self.name
+
+  def connect(self, timeout=None):
+    """
+    Like psp, connect() without a timeout only starts connecting: with a
+    latency the connection completes in the background and the connection
+    callbacks are called then.
+    """
+    server.counts["connect"] += 1
+    if timeout is None and server.latency > 0:
+      t = threading.Thread(target=self._connected, args=(True,))
+      t.daemon = True
+      t.start()
+      return True
+    self._connected()
+    return True
+
+  def _connected(self, background=False):
+    server._delay()
+    try:
+      server._check(self.name)
+    except pyexc:
+      if background:
+        return
+      raise
+    self.isconnected = True
+    if self.do_initialize:
+      self.get()
+      self.isinitialized = True
+      self.do_initialize = False
+    if self.do_monitor:
+      self.monitor_start()
+    for cb in list(self._conn_cbs):
+      cb(True)
+
+  def disconnect(self):
+    self.monitor_stop()
+    self.isconnected = False
+
+  def get(self, ctrl=False, timeout=DEFAULT_TIMEOUT, **kw):
+    value = server.get(self.name)
+    with self._cond:
+      self.value = value
+      self._cond.notify_all()
+    return value
+
+  def put(self, value, timeout=DEFAULT_TIMEOUT, **kw):
+    if not self.isconnected:
+      self.connect(timeout)
+    server.put(self.name, value)
+    return True
+
+  def monitor(self, *args, **kw):
+    self.monitor_start()
+
+  def monitor_start(self, *args, **kw):
+    if not self.isconnected:
+      self.connect(DEFAULT_TIMEOUT)
+    if not self.ismonitored:
+      self.ismonitored = True
+      server.subscribe(self.name, self)
+      self._monitor_event(server._values.get(self.name))
+
+  def monitor_stop(self):
+    if self.ismonitored:
+      server.unsubscribe(self.name, self)
+      self.ismonitored = False
+
+  def monitor_clear(self):
+    pass
+
+  def _monitor_event(self, value):
+    with self._cond:
+      self.value = value
+      self.isinitialized = True
+      self._cond.notify_all()
+    self._fire(None)
+
+  def _fire(self, e):
+    for cb in list(self._cbs.values()):
+      cb(e)
+
+  def add_monitor_callback(self, cb, once=False):
+    self._cbid += 1
+    self._cbs[self._cbid] = cb
+    return self._cbid
+
+  def del_monitor_callback(self, id):
+    self._cbs.pop(id, None)
+
+  def add_connection_callback(self, cb):
+    self._conn_cbs.append(cb)
+    return cb
+
+  def del_connection_callback(self, cb):
+    if cb in self._conn_cbs:
+      self._conn_cbs.remove(cb)
+
+  def set_string_enum(self, flag):
+    pass
+
+  def wait_ready(self, timeout=None):
+    if not self.isinitialized:
+      if not self.isconnected:
+        self.do_initialize = True
+        self.connect(timeout or DEFAULT_TIMEOUT)
+      else:
+        self.get()
+        self.isinitialized = True
+    return True
+
+  def wait_condition(self, condition, timeout=None, check_first=True):
+    """ wait until condition() is True, re-checking on every monitor """
+    if not self.ismonitored:
+      self.monitor_start()
+    deadline = None if timeout is None or timeout < 0 else time.time() + timeout
+    with self._cond:
+      if check_first and condition():
+        return True
+      while True:
+        if deadline is None:
+          self._cond.wait(1.0)
+        else:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            return False
+          self._cond.wait(remaining)
+        if condition():
+          return True
+
+  def wait_for_value(self, value, timeout=None):
+    return self.wait_condition(lambda: self.value == value, timeout)
+
+  def wait_for_range(self, low, high, timeout=None):
+    return self.wait_condition(lambda: low <= self.value <= high, timeout)
+
+  def wait_until_change(self, timeout=None):
+    return self.wait_condition(lambda: True, timeout, check_first=False)
+
+
+_pv_cache = {}
+
+def add_pv_to_cache(name):
+  if name not in _pv_cache:
+    _pv_cache[name] = Pv(name)
+  return _pv_cache[name]
+
+def pv_get(name, timeout=DEFAULT_TIMEOUT, **kw):
+  return add_pv_to_cache(name).get(timeout=timeout)
+
+def pv_put(name, value, timeout=DEFAULT_TIMEOUT, **kw):
+  return add_pv_to_cache(name).put(value, timeout)
+
+def pv_wait_for_value(name, value, timeout=None):
+  return add_pv_to_cache(name).wait_for_value(value, timeout)
+
+def pv_wait_until_change(name, timeout=None):
+  return add_pv_to_cache(name).wait_until_change(timeout)
+
+def monitor_start(name):
+  add_pv_to_cache(name).monitor_start()
+
+def monitor_stop(name):
+  add_pv_to_cache(name).monitor_stop()
+
+def monitor_get(name):
+  return add_pv_to_cache(name).value
+
+def monitor_clear(name):
+  pass
+
+def monitor_stop_all():
+  for pv in _pv_cache.values():
+    pv.monitor_stop()
+
+
+class Entry(object):
+  """
+  stand-in for pyami.Entry. The accumulated readout is drawn when get()
+  is called: entries is the number of events at the DAQ rate since the
+  last clear, mean is the detector func plus noise/sqrt(entries).
+  """
+  def __init__(self, name, kind=None, filter=None, **kw):
+    self.name = name
+    self.kind = kind
+    self.filter = filter
+    self._t0 = time.time()
+
+  def clear(self):
+    self._t0 = time.time()
+
+  def get(self):
+    now = time.time()
+    n = int((now - self._t0)*server.daq_rate)
+    func, noise = server.detectors.get(self.name, (lambda: 1.0, 0.01))
+    value = func()
+    if n > 0:
+      mean = value + random.gauss(0, noise/math.sqrt(n))
+    else:
+      mean = float("nan")
+    return dict(entries=n, mean=mean, rms=noise, time=now)
+
+  def pstart(self):
+    self.clear()
+
+  def pget(self):
+    time.sleep(1./server.daq_rate)
+    return self.get()
+
+  def pstop(self):
+    pass
+
+def set_l3t(*args, **kw):
+  pass
+
+def clear_l3t(*args, **kw):
+  pass
+
+
+class Control(object):
+  """
+  stand-in for pydaq.Control. begin() starts a calib cycle that lasts
+  events/daq_rate (or duration) seconds plus server.daq_overhead; end()
+  blocks until it is over. The run number goes up with the first cycle
+  after a configure or endrun.
+  """
+  _run = [0]
+
+  def __init__(self, host=None, platform=0):
+    self.host = host
+    self.platform = platform
+    self._state = 0
+    self._events = 0
+    self._record = False
+    self._end = None
+    self._t0 = None
+    self._inrun = False
+    self.ncycles = 0
+
+  def state(self):
+    return self._state
+
+  def connect(self):
+    self._state = max(self._state, 1)
+
+  def disconnect(self):
+    self._state = 0
+    self._end = None
+
+  def configure(self, events=None, l3t_events=None, duration=None, record=None, **kw):
+    if record is not None:
+      self._record = bool(record)
+    self._events = events or l3t_events or 0
+    self._duration = duration
+    self._state = 2
+
+  def _cycle_time(self, events=None, duration=None):
+    if duration is not None:
+      return duration[0] + duration[1]*1e-9
+    if events is None:
+      events = self._events
+    return events/server.daq_rate
+
+  def begin(self, events=None, l3t_events=None, duration=None, **kw):
+    if not self._inrun:
+      Control._run[0] += 1
+      self._inrun = True
+    if events is None:
+      events = l3t_events
+    if duration is None and events is None:
+      duration = self._duration
+    self._t0 = time.time()
+    self._end = self._t0 + server.daq_overhead + self._cycle_time(events, duration)
+    self._state = 4
+    self.ncycles += 1
+
+  def end(self):
+    if self._end is not None:
+      remaining = self._end - time.time()
+      if remaining > 0:
+        time.sleep(remaining)
+    self._end = None
+    self._state = 3
+
+  def stop(self):
+    self._end = None
+    self._state = 3
+
+  def endrun(self):
+    self._inrun = False
+    self._end = None
+    self._state = 2
+
+  def runnumber(self):
+    return Control._run[0] if self._record else 0
+
+  def eventnum(self):
+    if self._t0 is None:
+      return 0
+    return int((time.time() - self._t0)*server.daq_rate)
+
+  def record(self):
+    return self._record
+
+  def experiment(self):
+    return "sim"
+
+  def dbkey(self):
+    return 1
+
+  def dbalias(self):
+    return "SIM"
+
+  def dbpath(self):
+    return ""
+
+  def partition(self):
+    return dict(nodes=[], l3path="", l3veto=False, l3tag=False)
+
+
+def _ensure_context(*args, **kw):
+  pass
+
+def _caget(name, *args, **kw):
+  return pv_get(name)
+
+
+_FAKES = ("psp", "psp.Pv", "psp.utils", "psp.caget", "pyca", "pydaq", "pyami")
+
+def _module(name, doc, **attrs):
+  mod = types.ModuleType(name, doc)
+  mod.__dict__.update(attrs)
+  mod.__simulated__ = True
+  sys.modules[name] = mod
+  return mod
+
+def install(latency=0.0, autocreate=True, beamline=True):
+  """
+  Install the simulated psp, pyca, pydaq and pyami modules and return
+  the SimServer. Raises RuntimeError if the real ones are already
+  imported. With beamline=True an empty beamline module is provided if
+  there is none, since Daq imports one.
+  """
+  global server
+  for name in _FAKES:
+    mod = sys.modules.get(name)
+    if mod is not None and not getattr(mod, "__simulated__", False):
+      raise RuntimeError("%s is already imported, install the simulation first" % name)
+  if server is not None:
+    return server
+  server = SimServer(latency, autocreate)
+  pvmod = _module("psp.Pv", "simulated psp.Pv", Pv=Pv,
+    DEFAULT_TIMEOUT=DEFAULT_TIMEOUT, get=pv_get, put=pv_put,
+    wait_for_value=pv_wait_for_value, wait_until_change=pv_wait_until_change,
+    add_pv_to_cache=add_pv_to_cache, monitor_start=monitor_start,
+    monitor_stop=monitor_stop, monitor_get=monitor_get,
+    monitor_clear=monitor_clear, monitor_stop_all=monitor_stop_all)
+  utils = _module("psp.utils", "simulated psp.utils", ensure_context=_ensure_context)
+  caget = _module("psp.caget", "simulated psp.caget", caget=_caget)
+  _module("psp", "simulated psp", Pv=pvmod, utils=utils, caget=caget)
+  _module("pyca", "simulated pyca", pyexc=pyexc, caexc=caexc,
+    attach_context=_ensure_context, pend_io=lambda t=None: None,
+    flush_io=lambda: None, pend_event=lambda t=None: None,
+    DBE_VALUE=1, DBE_LOG=2, DBE_ALARM=4)
+  _module("pydaq", "simulated pydaq", Control=Control)
+  _module("pyami", "simulated pyami", Entry=Entry, set_l3t=set_l3t,
+    clear_l3t=clear_l3t, connect=lambda *args, **kw: None)
+  if beamline and "beamline" not in sys.modules:
+    try:
+      __import__("beamline")
+    except ImportError:
+      _module("beamline", "empty beamline module for the simulation")
+  return server
@@ -0,0 +1,138 @@
+""" Batched PV reads for device status printouts.
+    A device taking part lists the PVs its status needs and formats its
+    status from their values:
+
+    class Gauge:
+      def status_pvs(self):
+        return {"on": self.pvname+":STATUSMON", "pressure": self.pvname+":PMON"}
+      def format_status(self,values):
+        ...
+      def status(self):
+        return snapshot.status(self)
+
+    snapshot([gauge1,gauge2,valve1,...]) connects to the PVs of all the
+    devices at once and waits for them on one deadline, so a printout costs
+    about one round trip instead of one per PV. A PV that does not answer
+    in time is None in values; if the device cannot format its status
+    without it, a line naming the missing PVs is shown instead and the
+    other devices are not affected.
+"""
+import time
+import threading
+import psp.Pv as Pv
+
+TIMEOUT = 2.0
+
+def read(names,timeout=TIMEOUT):
+  """ reads all pvs in names concurrently, waiting at most timeout seconds
+  in total; returns (values,errors), two dictionaries keyed by pv name:
+  errors has a message for each pv that could not be read """
+  names = list(set(names))
+  values = {}
+  errors = {}
+  cond = threading.Condition()
+  pvs = []
+
+  def value_cb_factory(name,pv):
+    def value_cb(e=None):
+      with cond:
+        if (name in values) or (name in errors):
+          return
+        if e is None:
+          values[name] = pv.value
+        else:
+          errors[name] = str(e)
+        cond.notify()
+    return value_cb
+
+  for name in names:
+    try:
+      pv = Pv.Pv(name,monitor=True)
+      pv.add_monitor_callback(value_cb_factory(name,pv))
+      pv.do_initialize = True
+      pv.connect()
+      pvs.append(pv)
+    except Exception, exc:
+      with cond:
+        errors[name] = str(exc)
+
+  deadline = time.time() + timeout
+  with cond:
+    while len(values)+len(errors) < len(names):
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        break
+      cond.wait(remaining)
+    values = dict(values)
+    errors = dict(errors)
+  for name in names:
+    if (name not in values) and (name not in errors):
+      errors[name] = "no reply within %.1f s" % timeout
+
+  for pv in pvs:
+    try:
+      pv.disconnect()
+    except Exception:
+      pass
+  return values,errors
+
+def read_dict(pvs,timeout=TIMEOUT):
+  """ as read for a dictionary key: pvname; returns key: value, None for
+  the pvs that could not be read """
+  values,errors = read([name for name in pvs.itervalues() if name is not None],timeout)
+  return dict( (key,values.get(name)) for key,name in pvs.iteritems() )
+
+def _device_name(device):
+  name = getattr(device,"name",None)
+  if not isinstance(name,basestring):
+    name = device.__class__.__name__
+  return name
+
+def _format(device,pvs,values,errors):
+  vals = dict( (key,values.get(name)) for key,name in pvs.iteritems() )
+  try:
+    return device.format_status(vals)
+  except Exception, exc:
+    missing = sorted(name for name in pvs.itervalues() if name in errors)
+    if missing:
+      return "%s: status not available, no value for %s" % (_device_name(device),", ".join(missing))
+    return "%s: status not available (%s)" % (_device_name(device),exc)
+
+def snapshot(devices,timeout=TIMEOUT,printit=False):
+  """ reads the status pvs of all devices in one batch and returns the
+  list of their status strings (printed one per line with printit) """
+  devpvs = [device.status_pvs() for device in devices]
+  names = set()
+  for pvs in devpvs:
+    names.update(name for name in pvs.itervalues() if name is not None)
+  values,errors = read(names,timeout)
+  out = [_format(device,pvs,values,errors) for device,pvs in zip(devices,devpvs)]
+  if printit:
+    print "\n".join(out)
+  return out
+
+def status(device,timeout=TIMEOUT):
+  """ status string of one device, its pvs read in one batch """
+  return snapshot([device],timeout)[0]
+
+
+def compare(devices,timeout=TIMEOUT):
+  """ time reading the status pvs of devices one Pv.get at a time against
+  one snapshot; returns the times in seconds """
+  names = set()
+  for device in devices:
+    names.update(name for name in device.status_pvs().itervalues() if name is not None)
+  names = sorted(names)
+  t0 = time.time()
+  nerr = 0
+  for name in names:
+    try:
+      Pv.get(name)
+    except Exception:
+      nerr += 1
+  t1 = time.time()
+  snapshot(devices,timeout)
+  t2 = time.time()
+  print "%d devices, %d pvs (%d not readable)" % (len(devices),len(names),nerr)
+  print "serial Pv.get %.3f s, snapshot %.3f s" % (t1-t0,t2-t1)
+  return dict(devices=len(devices),pvs=len(names),serial_s=t1-t0,snapshot_s=t2-t1)
@@ -0,0 +1,141 @@
+""" Lightweight timing spans, to see where the time of a scan goes.
+    Spans are (name, start, duration, thread) records kept in a bounded
+    in-memory ring. When disabled (the default, see config.SPANS) span()
+    returns a shared no-op context manager and timed() functions only pay
+    one flag test.
+
+    usage:
+    spans.enable()
+    with spans.span("motor.wait"):
+      ...
+    @spans.timed("daq.calibcycle")
+    def calibcycle(...):
+    t0 = spans.mark()
+    ...
+    spans.table(since=t0)              # count/mean/p95/max per span
+    spans.export_chrome("trace.json")  # open in chrome://tracing
+"""
+import time
+import json
+import thread
+import functools
+import collections
+from blutil import config
+
+enabled = config.SPANS
+_ring = collections.deque(maxlen=config.SPANS_size)
+
+def enable(size=None):
+  """ start recording spans; size changes the length of the ring """
+  global enabled,_ring
+  if (size is not None) and (size != _ring.maxlen):
+    _ring = collections.deque(_ring,maxlen=size)
+  enabled = True
+
+def disable():
+  global enabled
+  enabled = False
+
+def clear():
+  _ring.clear()
+
+def mark():
+  """ time stamp to pass as since= to records/summary/table """
+  return time.time()
+
+def add(name,start,duration):
+  """ record a span measured by the caller """
+  if enabled:
+    _ring.append( (name,start,duration,thread.get_ident()) )
+
+
+class _NullSpan(object):
+  def __enter__(self):
+    return self
+  def __exit__(self,*exc):
+    return False
+
+_null = _NullSpan()
+
+class _Span(object):
+  __slots__ = ("name","start")
+  def __init__(self,name):
+    self.name = name
+  def __enter__(self):
+    self.start = time.time()
+    return self
+  def __exit__(self,*exc):
+    t = time.time()
+    _ring.append( (self.name,self.start,t-self.start,thread.get_ident()) )
+    return False
+
+def span(name):
+  """ context manager timing its block as span `name` """
+  if enabled:
+    return _Span(name)
+  return _null
+
+def timed(name=None):
+  """ decorator timing every call of a function; name defaults to
+  module.function """
+  def deco(func):
+    sname = name or "%s.%s" % (func.__module__.split(".")[-1],func.__name__)
+    @functools.wraps(func)
+    def wrapper(*args,**kw):
+      if not enabled:
+        return func(*args,**kw)
+      t0 = time.time()
+      try:
+        return func(*args,**kw)
+      finally:
+        t = time.time()
+        _ring.append( (sname,t0,t-t0,thread.get_ident()) )
+    return wrapper
+  return deco
+
+
+def records(since=None):
+  """ list of (name,start,duration,thread) recorded after since """
+  recs = list(_ring)
+  if (since is not None):
+    recs = [r for r in recs if r[1] >= since]
+  return recs
+
+def summary(since=None):
+  """ {name: dict(count,total,mean,p95,max)} of the recorded spans,
+  durations in seconds """
+  durations = collections.defaultdict(list)
+  for name,start,dt,tid in records(since):
+    durations[name].append(dt)
+  out = {}
+  for name,dts in durations.iteritems():
+    dts.sort()
+    n = len(dts)
+    out[name] = dict(count=n,total=sum(dts),mean=sum(dts)/n,
+                     p95=dts[min(n-1,int(0.95*n))],max=dts[-1])
+  return out
+
+def table(since=None,sort="total"):
+  """ summary as a printable table (times in ms) """
+  summ = summary(since)
+  names = sorted(summ,key=lambda k: summ[k][sort],reverse=True)
+  ostr = "%-28s %7s %10s %10s %10s %10s\n" % ("span","count","total ms","mean ms","p95 ms","max ms")
+  for name in names:
+    s = summ[name]
+    ostr += "%-28s %7d %10.2f %10.3f %10.3f %10.3f\n" % (name,s["count"],
+      s["total"]*1e3,s["mean"]*1e3,s["p95"]*1e3,s["max"]*1e3)
+  return ostr
+
+def export_json(fname,since=None):
+  """ write the spans as a json list of {name,start,duration,thread} """
+  recs = [dict(name=n,start=s,duration=d,thread=t) for n,s,d,t in records(since)]
+  with open(fname,"w") as f:
+    json.dump(recs,f)
+
+def export_chrome(fname,since=None):
+  """ write the spans in the Chrome trace event format (chrome://tracing,
+  Perfetto) """
+  events = [dict(name=n,cat=n.split(".")[0],ph="X",ts=s*1e6,dur=d*1e6,pid=1,tid=t)
+            for n,s,d,t in records(since)]
+  with open(fname,"w") as f:
+    json.dump(dict(traceEvents=events,displayTimeUnit="ms"),f)
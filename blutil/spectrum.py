@@ -1,93 +1,131 @@
 from blutil.plot import Plot2D
-import struct
 import numpy as np
 import os
 
+NPIX = 3840 # pixels per spectrum, stored as 16 bit signed integers
+
 
 class SpectrumFile:
-  def __init__(self,nspec=1000,onlyvis=False):
-    self.plot=None
+  """ Reader for spectrometer files: consecutive records of an optional
+  header followed by NPIX int16 pixels. The file is memory mapped, so
+  spectra are only read from disk when they are used. """
+  def __init__(self,nspec=1000,onlyvis=False,header_bytes=0):
+    self.plotwin=None
     self.doplot=True
     self.__nspec=nspec
-    self.__ddark = np.zeros([3840])
-    self.__specs = np.zeros([self.__nspec,3840])
+    self.__ddark = np.zeros([NPIX])
+    self.__specs = None
     self.__minpix = 0
-    self.__maxpix = 3839
+    self.__maxpix = NPIX-1
     if (onlyvis):
       self.__minpix = 21
       self.__maxpix = 3830
+    self.__dtype = record_dtype(header_bytes)
     self.__havespecs = False
 
   def setdark(self, darkfile=None, av_start=0, n_av=1e6):
-    """ no inpur filename -> dark spectrum = equal flat 0 (again)"""
-    if (filename is None):
-      self._ddark =  np.zeros([3840])
+    """ no inpur filename -> dark spectrum = equal flat 0 (again)
+    otherwise the dark is the average of spectra av_start to
+    av_start+n_av of darkfile """
+    if (darkfile is None):
+      self.__ddark =  np.zeros([NPIX])
     else:
-      darksum =  np.zeros([3840])
-      ndark = 0
-      fin.open(darkfile,"rb")
-      while (fin):
-        for i in range(0,3839):
-          spec_val = struct.unpack('h',fin.read(2))[0]
-          if av_start <= ndark < (av_start+n_av):
-              darksum[i] = darksum[i] + specval
-        ndark = ndark+1
-      for i in range(0,3839):
-        self._ddark[i] = darksum[i]/min(ndark-av_start)
-      fin.close()
-      
+      specs = self.mapfile(darkfile)["pixels"]
+      stop = int(min(av_start+n_av, len(specs)))
+      dark = np.zeros([NPIX])
+      for chunk in iterchunks(specs, av_start, stop):
+        dark += chunk.sum(axis=0)
+      self.__ddark = dark/max(stop-av_start, 1)
+
+  def mapfile(self, infile):
+    """ returns the records of infile as a read only memmap """
+    nrec = os.stat(infile).st_size//self.__dtype.itemsize
+    return np.memmap(infile, dtype=self.__dtype, mode="r", shape=(nrec,))
+
   def getspecs(self, infile=None, nspec=None):
+    """ maps the first nspec spectra of infile (default: the nspec given at
+    creation, None for all) and returns them as a 2D (spectrum, pixel) view.
+    No data is read until it is used. """
     if (nspec is None):
       nspec=self.__nspec
+    if (infile is None):
+      return self.__specs
+    records = self.mapfile(infile)
+    self.__specs = records["pixels"][:nspec, self.__minpix:self.__maxpix]
+    self.__havespecs = True
+    return self.__specs
+
+  @property
+  def specs(self):
+    """ 2D (spectrum, pixel) view of the mapped spectra, without dark
+    subtraction """
+    return self.__specs
+
+  def __loaded(self):
+    if (self.__specs is None):
+      raise ValueError("no spectra loaded, call getspecs(infile) first")
+    return self.__specs
+
+  def chunks(self, chunk=1000, start=0, stop=None):
+    """ iterates over the mapped spectra in float arrays of at most chunk
+    spectra, with the dark subtracted """
+    specs = self.__loaded()
+    dark = self.__ddark[self.__minpix:self.__maxpix]
+    for block in iterchunks(specs, start, stop, chunk):
+      yield block - dark
+
+  def sum(self, start=0, stop=None, chunk=1000):
+    """ returns the dark subtracted sum of spectra start to stop, reading
+    chunk spectra at a time """
+    total = np.zeros(self.__loaded().shape[1])
+    for block in self.chunks(chunk, start, stop):
+      total += block.sum(axis=0)
+    return total
 
-      if (infile is None):
-        return
-    fin = open(infile,"rb")
-    
-    file_size = os.stat(infile)[6]
-    nspec_max = file_size/(3840*2)
-    print file_size, nspec_max
-
-    this_spec = 0
-    while True:
-      try:
-        for i in range(0,3839):
-          this_pixel = struct.unpack('h',fin.read(2))[0]
-          if (i>=self.__minpix):
-            self.__specs[this_spec,i-self.__minpix] = this_pixel
-        this_spec = this_spec+1
-        print this_spec
-        if (this_spec > nspec or this_spec >= nspec_max):
-          break
-      except EOFError:
-        print 'file end'
-    fin.close()
-    self.__havespec = True
+  def average(self, start=0, stop=None, chunk=1000):
+    """ returns the dark subtracted average of spectra start to stop """
+    nspec = len(self.__loaded())
+    if (stop is None): stop = nspec
+    stop = min(stop, nspec)
+    return self.sum(start, stop, chunk)/max(stop-start, 1)
 
   def writeASCII(self, outfile="out.txt", infile=None, nspec=None):
-    if (nspec is None):
-      nspec=self._nspec
     if (not self.__havespecs):
-      getspecs(infile, nspec)
-    fout.open(outfile,"w")
-    for ispec in range(0,nspec):
-      for ipix in range(self.__minpix,self.__maxpix):
-        fout.write("%h \t",self._specs[ispec,ipix])
-      fout.write("\n")
+      self.getspecs(infile, nspec)
+    if (nspec is None):
+      nspec=self.__nspec
+    specs = self.__loaded()
+    fout = open(outfile,"w")
+    for block in iterchunks(specs, 0, nspec):
+      np.savetxt(fout, block, fmt="%d", delimiter=" \t")
     fout.close()
 
   def plot(self, beg_spec=0):
+    specs = self.__loaded()
     plotid=self.__prepare_plot()
-    self.plot=Plot2D(plotid)
-    self.__y
-    for ipix in range(0,self.__maxpix-self.__minpix):
-      self.__y.append(self.specs[beg_spec,ipix])
-    self.plot.setdata(self.__x,self.__y)
+    self.plotwin=Plot2D(plotid)
+    self.__y=np.asarray(specs[beg_spec], dtype=float)
+    self.plotwin.setdata(self.__x,self.__y)
+    self.plotwin.close()
 
   def __prepare_plot(self):
     plotID=1
     self.__y=[]
-    self.__x=[]
-    for ipix in range(self.__minpix,self.__maxpix):
-      self.__x.append(ipix)
+    self.__x=np.arange(self.__minpix,self.__maxpix)
     return plotID
+
+
+def record_dtype(header_bytes=0):
+  """ structured dtype of one spectrum record """
+  fields = []
+  if (header_bytes > 0):
+    fields.append(("header", "V%d" % header_bytes))
+  fields.append(("pixels", np.int16, (NPIX,)))
+  return np.dtype(fields)
+
+def iterchunks(specs, start=0, stop=None, chunk=1000):
+  """ yields float copies of specs[start:stop] in blocks of chunk rows """
+  if (stop is None): stop = len(specs)
+  stop = min(stop, len(specs))
+  for i in range(int(start), int(stop), chunk):
+    yield np.asarray(specs[i:min(i+chunk, stop)], dtype=float)
@@ -8,6 +8,7 @@ import socket
 from blutil import config, estr, printnow
 from blbase import virtualmotor
 from blutil.user import warn
+from blutil.organize import DeviceRegistry
 
 import matplotlib
 matplotlib.use("Qt4Agg")
@@ -22,23 +23,21 @@ def warning(text):
     """Print text to screen in BOLD RED lettering."""
     print(estr(text, color="red", type="bold"))
 
-printnow("defining lcls_linac...")
-try:
+# Every device is declared below with the names it defines and the names it
+# needs. devices.build() at the end of this file builds them in parallel where
+# the dependencies allow it and prints how long each one took.
+devices = DeviceRegistry(globals(), export, warning)
+
+@devices.add("lcls_linac")
+def _lcls_linac():
     from blinst import linac
-    lcls_linac = linac.Linac()
-    export("lcls_linac")
-    printnow("...done\n")
-except Exception, exc:
-    lcls_linac = None
-    warning("Error loading lcls_linac!")
-    print exc
-
-printnow("defining motors...")
-try:
+    return dict(lcls_linac=linac.Linac())
+
+@devices.add("motors", "m")
+def _motors():
     from blbase import motorsfile
     motors = motorsfile.Motors()
     motors.import_epicsArch(config.epicsArch)
-    printnow("  adding xrt motors")
     motors.add(['XRT:DIA:MMS:12','pp_x'], ['XRT:DIA:MMS:15','pp_y'], group='xrt')
     motors.add( ["CXI:DG1:MMS:01","reflaser_y"],
                 ["CXI:DG1:PIC:03","rlaser1_x"],
@@ -46,67 +45,46 @@ try:
                 ["CXI:DG1:PIC:01","rlaser1_rx"],
                 ["CXI:DG1:PIC:02","rlaser1_ry"], 
                 group="rlaser")
-    m = motors.all.m
-    export("motors", "m")
-    printnow("...done\n")
-except Exception as exc:
-    motors = None
-    m = None
-    warning("Error loading motors!")
-    print exc
-
-printnow("defining DIA and DSB attenuators...")
-try:  
-    from blinst import lusiatt
-    att_dia = lusiatt.Lusiatt("XRT:DIA:ATT")
-    att_dsb = lusiatt.Lusiatt("CXI:DSB:ATT")
-    export("att_dia", "att_dsb")
-    printnow("...done\n")
-except Exception as exc:
-    att = None
-    warning("Error loading attenuators!")
-    print exc
-
-printnow("defining feeatt ...")
-try:	  
-  from blinst import feeatt
-  feeatt = feeatt.Feeatt(lcls_linac)
-  virtualmotor.VirtualMotor("feeA",feeatt.setTfast,feeatt.getTvalue,feeatt.wait,motorsobj=motors)
-  export("feeatt")
-  printnow("...done\n")
-except:
-  warning('there was a problem with the FEE attentuator definition!')
-
-printnow("Loading mcc vernier...")
-try:
-  from blinst import mccvernier
-  #vernier = mccvernier.MCCVernier(motors, "XPP:USER:MCC:EPHOT", "XCS:VARS:MCC:EPHOT_ULIM_LO", "XCS:VARS:MCC:EPHOT_ULIM_HI")
-  vernier = mccvernier.MCCVernier(motors, "MCC:USR:PHOTON:ENERGY", "XCS:VARS:MCC:EPHOT_ULIM_LO", "XCS:VARS:MCC:EPHOT_ULIM_HI")
-  export("vernier")
-  printnow(" done\n")
-except:
-  warn(" Problem loading mcc vernier!")
-
-printnow("defining feespec ...")
-try:
-  from blinst.feespec import feespec
-  export("feespec")
-  printnow("...done\n")
-except:
-  warning("Error in loading feespec!")
+    return dict(motors=motors, m=motors.all.m)
 
-printnow("defining cxistopper ...")
-try:
+@devices.add("att_dia", "att_dsb", desc="DIA and DSB attenuators",
+             error="Error loading attenuators!")
+def _attenuators():
+    from blinst import lusiatt
+    return dict(att_dia=lusiatt.Lusiatt("XRT:DIA:ATT"),
+                att_dsb=lusiatt.Lusiatt("CXI:DSB:ATT"))
+
+@devices.add("feeatt", deps=("lcls_linac", "motors"),
+             error='there was a problem with the FEE attentuator definition!')
+def _feeatt():
+    from blinst import feeatt as feeatt_module
+    feeatt = feeatt_module.Feeatt(lcls_linac)
+    virtualmotor.VirtualMotor("feeA",feeatt.setTfast,feeatt.getTvalue,feeatt.wait,motorsobj=motors)
+    return dict(feeatt=feeatt)
+
+@devices.add("vernier", deps=("motors",), desc="mcc vernier",
+             error=" Problem loading mcc vernier!")
+def _vernier():
+    from blinst import mccvernier
+    #vernier = mccvernier.MCCVernier(motors, "XPP:USER:MCC:EPHOT", "XCS:VARS:MCC:EPHOT_ULIM_LO", "XCS:VARS:MCC:EPHOT_ULIM_HI")
+    vernier = mccvernier.MCCVernier(motors, "MCC:USR:PHOTON:ENERGY", "XCS:VARS:MCC:EPHOT_ULIM_LO", "XCS:VARS:MCC:EPHOT_ULIM_HI")
+    return dict(vernier=vernier)
+
+@devices.add("feespec", error="Error in loading feespec!")
+def _feespec():
+    from blinst.feespec import feespec
+    return dict(feespec=feespec)
+
+@devices.add("cxistopper", "xrtstopper", "dg1stopper", "dg2stopper",
+             "s5stopper", desc="stoppers", error=" Problem loading stoppers")
+def _stoppers():
     from blbase import xraystopper
-    cxistopper = xraystopper.Xraystopper("PPS:FEH1:5:S5BSTPRSUM","cxi-xray-stopper")
-    xrtstopper = xraystopper.Xraystopper("STPR:XRT1:1:SH2_PPSSUM","xrt-xray-stopper")
-    dg1stopper=xraystopper.Xraystopper("HFX:UM6:STP_01:IN_DI_MPSC","dg1-xray-stopper")
-    dg2stopper=xraystopper.Xraystopper("HFX:DG2:STP_01:IN_DI_MPSC","dg2-xray-stopper")
-    s5stopper = xraystopper.Xraystopper("PPS:FEH1:5:S5STPRSUM","xcsmain-xray-stopper")
-    export("cxistopper","xrtstopper","dg1stopper","dg2stopper","s5stopper")
-    printnow("...done\n")
-except:
-    warn(" Problem loading stoppers")
+    return dict(
+        cxistopper=xraystopper.Xraystopper("PPS:FEH1:5:S5BSTPRSUM","cxi-xray-stopper"),
+        xrtstopper=xraystopper.Xraystopper("STPR:XRT1:1:SH2_PPSSUM","xrt-xray-stopper"),
+        dg1stopper=xraystopper.Xraystopper("HFX:UM6:STP_01:IN_DI_MPSC","dg1-xray-stopper"),
+        dg2stopper=xraystopper.Xraystopper("HFX:DG2:STP_01:IN_DI_MPSC","dg2-xray-stopper"),
+        s5stopper=xraystopper.Xraystopper("PPS:FEH1:5:S5STPRSUM","xcsmain-xray-stopper"))
 
 ### Placeholder --needs updating
 #printnow("Loading cxi reference lasers..."),
@@ -117,9 +95,10 @@ except:
 #except:
 #    warn(" Problem loading ref lasers")
 
-printnow("Loading cxi slits..."),
 # SLITS
-try:
+@devices.add("dg1slit", "kb1slitus", "kb1slitds", "dg2slit", "dsbslit",
+             deps=("m",), desc="cxi slits", error=" Problem loading slits")
+def _slits():
     from blinst.lusislit import LusiSlit
 #    s0 = xcss0 = LusiSlit(motors.s0_u,motors.s0_d,motors.s0_n,motors.s0_s,"s0")   # FEE Mask Slits
 #    xpps1 = h2s1 = LusiSlit(motors.h2s1_u,motors.h2s1_d,motors.h2s1_n,motors.h2s1_s,"xpps1")  # Slit on XPP SB1 (SXR)
@@ -130,23 +109,19 @@ try:
 #    s4 = xcss4 = LusiSlit(motors.s4_u,motors.s4_d,motors.s4_n,motors.s4_s,"s4")
 #    s5 = xcss5 = LusiSlit(motors.s5_u,motors.s5_d,motors.s5_n,motors.s5_s,"s5")
 #    s6 = xcss6 = LusiSlit(motors.s6_u,motors.s6_d,motors.s6_n,motors.s6_s,"s6")
-    dg1slit = LusiSlit(m.dg1slit_u,m.dg1slit_d,m.dg1slit_n,m.dg1slit_s,"dg1slit")
-    kb1slitus = LusiSlit(m.kb1slitus_u,m.kb1slitus_d,m.kb1slitus_n,m.kb1slitus_s,"kb1slitus")
-    kb1slitds = LusiSlit(m.kb1slitds_u,m.kb1slitds_d,m.kb1slitds_n,m.kb1slitds_s,"kb1slitds")
-    dg2slit = LusiSlit(m.dg2slit_u,m.dg2slit_d,m.dg2slit_n,m.dg2slit_s,"dg2slit")
-    dsbslit = LusiSlit(m.dsbslit_u,m.dsbslit_d,m.dsbslit_n,m.dsbslit_s,"dsbslit")
+    return dict(
+        dg1slit=LusiSlit(m.dg1slit_u,m.dg1slit_d,m.dg1slit_n,m.dg1slit_s,"dg1slit"),
+        kb1slitus=LusiSlit(m.kb1slitus_u,m.kb1slitus_d,m.kb1slitus_n,m.kb1slitus_s,"kb1slitus"),
+        kb1slitds=LusiSlit(m.kb1slitds_u,m.kb1slitds_d,m.kb1slitds_n,m.kb1slitds_s,"kb1slitds"),
+        dg2slit=LusiSlit(m.dg2slit_u,m.dg2slit_d,m.dg2slit_n,m.dg2slit_s,"dg2slit"),
+        dsbslit=LusiSlit(m.dsbslit_u,m.dsbslit_d,m.dsbslit_n,m.dsbslit_s,"dsbslit"))
 
 #    dg1hg = virtualmotor.VirtualMotor("dg1hg",dg1slit.mv_hg,dg1slit.wm_hg,dg1slit.waith,dg1slit.set_hg,motorsobj=motors)
-    
-    export("dg1slit","kb1slitus","kb1slitds","dg2slit","dsbslit")
-    printnow("...done\n")
-except:
-    warn(" Problem loading slits")
 
-from blinst import lusiipm
-from blinst.ipimb import ipimb
-printnow("defining ipms:")
-try:
+@devices.add("ipimb_dg2", desc="ipms",
+             error="one of our CXI IPIMB boxes is missing!")
+def _ipms():
+  from blinst.ipimb import ipimb
   ipimb_dg2 = ipimb("CXI:DG2:IMB:01","CXI:IPM:IOC","CXI:IPM:EVR:CTRL.DG2E","ipimb_dg2")
 #  ipimb3 = ipimb("XPP:SB3:IPM:01","XPP:IPM:IOC","XPP:IPM:EVR:CTRL.DG3E","ipimb3")
 #  lombpm_ipimb = ipimb("XPP:MON:IPM:01","XPP:IPM:IOC","XPP:IPM:EVR:CTRL.DG0E","lombpm_ipimb")
@@ -155,8 +130,7 @@ try:
 #  diode3_ipimb = ipimb("XPP:SB4:IPM:01","XPP:IPM:IOC","XPP:IPM:EVR:CTRL.DG5E","diode3_ipimb")
 #  diodeU_ipimb = ipimb("XPP:USR:IPM:01","XPP:IPM:IOC","XPP:IPM:EVR:CTRL.DG6E","diodeU_ipimb")
 #  diodeU2_ipimb = ipimb("XPP:USR:IPM:02","XPP:IPM:IOC","XPP:IPM:EVR:CTRL.DG7E","diodeU2_ipimb")
-except:
-    warning("one of our CXI IPIMB boxes is missing!")
+  return dict(ipimb_dg2=ipimb_dg2)
 #try:
 #  printnow("xppipm2,")
 #  dg2ipm = lusiipm.IPM("XPP:SB2:IPM",
@@ -175,12 +149,13 @@ except:
 
 
 
-printnow("defining cxi evr ...")
-from blbase import controlevr
-xrtevr = controlevr.ControlEVR("CXI:R48:EVR:41","XRT_R48")
-cxilaserevr = controlevr.ControlEVR("LAS:R52B:EVR:31","CXI_R52B")
-cxievr_user = controlevr.ControlEVR("CXI:R52:EVR:01","CXI_R52A")
-export("xrtevr","cxilaserevr","cxievr_user")
+@devices.add("xrtevr", "cxilaserevr", "cxievr_user", desc="cxi evr")
+def _evr():
+  from blbase import controlevr
+  return dict(
+    xrtevr=controlevr.ControlEVR("CXI:R48:EVR:41","XRT_R48"),
+    cxilaserevr=controlevr.ControlEVR("LAS:R52B:EVR:31","CXI_R52B"),
+    cxievr_user=controlevr.ControlEVR("CXI:R52:EVR:01","CXI_R52A"))
 
 #def evr_laser_setup(evr=xppevr_scoperack.t0):
 #  evr.eventcode(40)
@@ -188,48 +163,40 @@ export("xrtevr","cxilaserevr","cxievr_user")
 #  evr.enable()
 #  evr.width(10e-6)
 #  evr.delay(875.383e-6)
-printnow("...done\n")
 
-printnow("defining event sequencer (event) ...")
-from blbase import eventsequencer
 local_iocbase = '{:}:ECS:IOC:01'.format(INSTRUMENT)
-print local_iocbase
-try:
-  event = eventsequencer.EventSequencer( local_iocbase=local_iocbase, sequence_group=5)
-  export("event")
-  printnow("...done\n")
 
-  printnow("Loading Pulse Picker...")
+@devices.add("event", desc="event sequencer (event)",
+             error='issue with EventSequencer, we also will not have the pulse picker')
+def _event():
+  from blbase import eventsequencer
+  return dict(event=eventsequencer.EventSequencer( local_iocbase=local_iocbase, sequence_group=5))
+
+@devices.add("pp", deps=("event", "xrtevr", "lcls_linac", "m"),
+             desc="pulse picker", error="Problem loading the pulse picker")
+def _pulsepicker():
   #from pp_nogui_working import PPicker
   # Start using default pulse picker setting of taking 2nd pulse with 8 ms delay 
   # (instead of aggressively taking next pulse with 0.89 msec delay)
-  try:
-    from blinst.pulsepicker import PulsePicker
-    picker_codes = dict(daq=187,drop=196,pp=185,slowdaq=179,ppsingleopen=180,
-                        ppsingleclose=181,lshut=184,singleshotana=192)
-    cxipulsepicker = PulsePicker(xrtevr.t0,
-                            lcls_linac,
-                            sequencer=event,
-                            polarity="Normal",
-                            xstage=m.pp_x,
-                            ystage=m.pp_y,
-                            rotPVbase='XRT:DIA:MMS:16',
-                            presetPVbase='CXI:XRT:PP',
-                            burstdelay=0.89e-3,
-                            flipflopdelay=0.89e-3,
-                            followerdelay=0.89e-3,
-                            codes=picker_codes)
-    pp = cxipulsepicker
-    export("pp")
-    printnow("defining pulse picker...\n")
-  except ImportError:
-    warning("Module is not available")
-  printnow("... done\n")
-except:
-  warning('issue with EventSequencer, we also will not have the pulse picker')
+  if event is None:
+    raise Exception("no EventSequencer")
+  from blinst.pulsepicker import PulsePicker
+  picker_codes = dict(daq=187,drop=196,pp=185,slowdaq=179,ppsingleopen=180,
+                      ppsingleclose=181,lshut=184,singleshotana=192)
+  cxipulsepicker = PulsePicker(xrtevr.t0,
+                          lcls_linac,
+                          sequencer=event,
+                          polarity="Normal",
+                          xstage=m.pp_x,
+                          ystage=m.pp_y,
+                          rotPVbase='XRT:DIA:MMS:16',
+                          presetPVbase='CXI:XRT:PP',
+                          burstdelay=0.89e-3,
+                          flipflopdelay=0.89e-3,
+                          followerdelay=0.89e-3,
+                          codes=picker_codes)
+  return dict(pp=cxipulsepicker)
 
-printnow("defining cxilaser ...")
-from blbase import lasersystem
 # LaserSystem does not work because LAS:FS5:REG:Angle:Shift:rd no longer exists
 #try:
 #  cxilaser=lasersystem.LaserSystem(system=5,beamline="cxi")
@@ -238,54 +205,21 @@ from blbase import lasersystem
 #  export("cxilaser", "laser", "las")
 #except:
 #  warning('Problems with the lasersystem, likely PVs etc')
-try:
-  vitara = lasersystem.Vitara(edm=config.EPICS_HUTCH_SCREENS+"vitara_screen")
-  export("vitara")
-except Exception, exc:
-  print exc
-  warning('Problems with the vitara, likely PVs etc')
-
-try:
-  def clear_sequencer():
-    """Clear sequencer of old values.
-    """
-    for seqstep in range(20):
-        event.setstep(seqstep, 0, 0,fiducial=0,comment=' ');seqstep+=1
-    event.update()
-  
-  export("clear_sequencer")
-except:
-  warning("importing clear_sequencer function failed ... \n")
-
-try:
-  def setLaserDrop(NshotsPerDrop, NshotsOff=1, seq=event, codes=dict(lason=183,lasoff=184)):
-    if NshotsPerDrop<1:
-      print 'this should be a positive integer!'
-      return
-    seqstep = 0
-    seq.setstep(seqstep,codes['lason'],1,fiducial=0,comment='LaserOn');seqstep+=1
-    for shotNo in range(NshotsOff):
-      seq.setstep(seqstep,codes['lasoff'],1,fiducial=0,comment='LaserOff');seqstep+=1
-    for shotNo in range(NshotsPerDrop-1):
-      seq.setstep(seqstep,codes['lason'],1,fiducial=0,comment='LaserOn');seqstep+=1
-    seq.setnsteps(seqstep)
-    seq.update()
-    printnow("... done\n")
-  export("setLaserDrop")
-except:
-  warning("importing laser drop function failed ... \n")
-
-try:
-  printnow("Defining laser_sequencer macros...")
+@devices.add("vitara", lazy=True,
+             error='Problems with the vitara, likely PVs etc')
+def _vitara():
+  from blbase import lasersystem
+  return dict(vitara=lasersystem.Vitara(edm=config.EPICS_HUTCH_SCREENS+"vitara_screen"))
+
+@devices.add("laser_sequence", deps=("event",), desc="laser_sequencer macros",
+             error="defining laser_sequencer macros failed!")
+def _laser_sequence():
   from blbase.lasersequence import LaserSequence
-  laser_sequence = LaserSequence(event, on_code=183, off_code=184)
-  export("laser_sequence")
-  printnow("... done\n")
-except:
-  warning("defining laser_sequencer macros failed!")
+  return dict(laser_sequence=LaserSequence(event, on_code=183, off_code=184))
 
-printnow("defining daq...")
-try:
+@devices.add("daq", "daqfit", deps=("lcls_linac", "event"),
+             error="Error loading daq!")
+def _daq():
     from blbase import daq
     pvbase = "{0}:SCAN:".format(config.hutch.upper())
     feedbackPVs = dict(
@@ -297,24 +231,13 @@ try:
         var2_min=(pvbase + "MIN02",0), Nshots=(pvbase + "NSHOTS",0),
         Nsteps=(pvbase + "NSTEPS",0))
     daq = daq.Daq(host=config.host, platform=4, lcls=lcls_linac, feedbackPVs=feedbackPVs, sequencer=event)
-    export("daq")
     from blutil.fit import DaqFit
-    daqfit = DaqFit(daq)
-    export("daqfit")
-    printnow("...done\n")
-except Exception, exc:
-    daq = None
-    warning("Error loading daq!")
-    print exc
-
-printnow("defining lcls_event (bykik) ...")
-try:
+    return dict(daq=daq, daqfit=DaqFit(daq))
+
+@devices.add("lcls_event", desc="lcls_event (bykik)", error="Failed!")
+def _lcls_event():
     import blbase.lcls_event
-    lcls_event = blbase.lcls_event.LclsEvent()
-    export("lcls_event")
-    printnow("...done \n")
-except:
-    warning("Failed!")
+    return dict(lcls_event=blbase.lcls_event.LclsEvent())
 
 # EVR currently broken -- will not load if not available
 #printnow("defining OPO shifter...")
@@ -332,15 +255,40 @@ except:
 #    warning("Error loading opo_shifter")
 #    print exc
 
+@devices.add("epicsarchive", lazy=True, desc="epics archiver",
+             error="Error loading epics archiver!")
+def _epicsarchive():
+    from blutil import epicsarchive_new
+    return dict(epicsarchive=epicsarchive_new.EpicsArchive())
 
+devices.build(parallel=config.STARTUP_PARALLEL)
 
-printnow("defining epics archiver...")
 try:
-    from blutil import epicsarchive_new
-    epicsarchive = epicsarchive_new.EpicsArchive()
-    export("epicsarchive")
-    printnow("...done\n")
-except Exception, exc:
-    warning("Error loading epics archiver!")
-    print exc
+  def clear_sequencer():
+    """Clear sequencer of old values.
+    """
+    for seqstep in range(20):
+        event.setstep(seqstep, 0, 0,fiducial=0,comment=' ');seqstep+=1
+    event.update()
+  
+  export("clear_sequencer")
+except:
+  warning("importing clear_sequencer function failed ... \n")
 
+try:
+  def setLaserDrop(NshotsPerDrop, NshotsOff=1, seq=event, codes=dict(lason=183,lasoff=184)):
+    if NshotsPerDrop<1:
+      print 'this should be a positive integer!'
+      return
+    seqstep = 0
+    seq.setstep(seqstep,codes['lason'],1,fiducial=0,comment='LaserOn');seqstep+=1
+    for shotNo in range(NshotsOff):
+      seq.setstep(seqstep,codes['lasoff'],1,fiducial=0,comment='LaserOff');seqstep+=1
+    for shotNo in range(NshotsPerDrop-1):
+      seq.setstep(seqstep,codes['lason'],1,fiducial=0,comment='LaserOn');seqstep+=1
+    seq.setnsteps(seqstep)
+    seq.update()
+    printnow("... done\n")
+  export("setLaserDrop")
+except:
+  warning("importing laser drop function failed ... \n")
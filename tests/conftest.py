@@ -0,0 +1,13 @@
+import os
+import sys
+
+# the packages live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use("Agg")
+
+# device modules import psp, pyca, ...: run them against the simulated
+# backend
+from blutil import simulation
+simulation.install()
@@ -0,0 +1,119 @@
+import calendar
+import datetime
+import threading
+import urllib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import numpy as np
+import pytest
+import simplejson as json
+
+from blutil import epicsarchive_new
+from blutil.epicsarchive_new import EpicsArchive, datetime_to_epoch
+
+# one point every 10 s, the first at T0
+T0 = datetime_to_epoch(datetime.datetime(2020, 3, 1, 12))
+POINTS = [(int(T0) + 10 * i, 1000 * i, float(i)) for i in range(100)]
+
+
+def parse_time(arg):
+    dt = datetime.datetime.strptime(urllib.unquote(arg), "%Y-%m-%dT%H:%M:%S.%fZ")
+    return calendar.timegm(dt.timetuple()) + dt.microsecond * 1e-6
+
+
+class ArchiverHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ serves POINTS like the archiver's getData.json: the points between
+    from and to, preceded by the last point before from """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        start = parse_time(query["from"][0])
+        end = parse_time(query["to"][0])
+        self.server.queries.append((start, end))
+        t = [s + n * 1e-9 for s, n, v in POINTS]
+        inside = [i for i in range(len(t)) if start <= t[i] <= end]
+        before = [i for i in range(len(t)) if t[i] < start]
+        if before:
+            inside.insert(0, before[-1])
+        data = [{"secs": POINTS[i][0], "nanos": POINTS[i][1], "val": POINTS[i][2]}
+                for i in inside]
+        body = json.dumps([{"meta": {"name": query["pv"][0]}, "data": data}])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ArchiverServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # EpicsArchive keeps its connections open, serve each in a thread
+    daemon_threads = True
+
+
+@pytest.fixture
+def archiver():
+    server = ArchiverServer(("127.0.0.1", 0), ArchiverHandler)
+    server.queries = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_archive(archiver, tmpdir, use_cache=True):
+    url = "http://127.0.0.1:{0}/retrieval/data/getData.json".format(archiver.server_port)
+    return EpicsArchive(use_cache=use_cache, cache_path=str(tmpdir), url=url)
+
+
+def at(seconds):
+    return datetime.datetime.fromtimestamp(T0 + seconds)
+
+
+def get(arch, start, end):
+    return arch.get_points("SIM:PV", at(start), at(end), arrays=True)
+
+
+def assert_same(a, b):
+    for x, y in zip(a, b):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_first_point_is_last_before_start(archiver, tmpdir):
+    arch = make_archive(archiver, tmpdir)
+    secs, nanos, vals = get(arch, 105, 305)
+    assert list(vals) == [float(i) for i in range(10, 31)]
+    assert secs[0] == int(T0) + 100
+
+
+def test_cached_range_keeps_point_before_start(archiver, tmpdir):
+    direct = make_archive(archiver, tmpdir.join("direct"), use_cache=False)
+    arch = make_archive(archiver, tmpdir.join("cache"))
+    get(arch, 5, 505)
+    nqueries = len(archiver.queries)
+    for start, end in [(5, 505), (105, 305), (255, 505), (5, 15)]:
+        assert_same(get(arch, start, end), get(direct, start, end))
+    # the direct archive made one query per range, the cache none
+    assert len(archiver.queries) == nqueries + 4
+
+
+def test_extended_range_fetches_only_the_gap(archiver, tmpdir):
+    direct = make_archive(archiver, tmpdir.join("direct"), use_cache=False)
+    arch = make_archive(archiver, tmpdir.join("cache"))
+    get(arch, 105, 305)
+    del archiver.queries[:]
+    cached = get(arch, 55, 505)
+    assert len(archiver.queries) == 2
+    assert_same(cached, get(direct, 55, 505))
+
+
+def test_no_point_before_first_fetch(archiver, tmpdir):
+    arch = make_archive(archiver, tmpdir)
+    secs, nanos, vals = get(arch, -50, 25)
+    assert list(vals) == [0., 1., 2.]
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from blutil import simulation
+from blbase import eventsequencer
+from blbase.eventsequencer import EventSequencer
+
+IOC = "ECS:SYS0:4"
+
+
+def play(server, nplays, period=0.02):
+  """ what the EVG does on PLYCTL=1: play, count, then stop """
+  def run():
+    server.set(IOC + ":PLSTAT", 2)
+    for n in range(1, nplays+1):
+      time.sleep(period)
+      server.set(IOC + ":PLYCNT", n)
+      server.set(IOC + ":TPLCNT", server.get(IOC + ":TPLCNT") + 1)
+    server.set(IOC + ":PLSTAT", 0)
+  def hook(value):
+    if value == 1:
+      t = threading.Thread(target=run)
+      t.daemon = True
+      t.start()
+  return hook
+
+
+@pytest.fixture
+def seq(monkeypatch):
+  server = simulation.server
+  monkeypatch.setattr(server, "autocreate", False)
+  monkeypatch.setattr(eventsequencer, "guessBeamline", lambda: "xcs")
+  server.add(IOC + ":HUTCH_ID", eventsequencer.hutch_dict["xcs"])
+  for field in ("LEN", "PLYMOD", "PLYCNT", "PLSTAT", "REPCNT", "TPLCNT",
+                "SEQ.PROC", "SYNCMARKER", "BEAMPULSEREQ"):
+    server.add("%s:%s" % (IOC, field), 0)
+  for field in "ABCD":
+    server.add("%s:SEQ.%s" % (IOC, field), (0,)*8)
+  s = EventSequencer("XCS:ECS:IOC:01", 4)
+  s.server = server
+  return s
+
+
+def test_wait_once(seq):
+  server = seq.server
+  server.add(IOC + ":TPLCNT", 5)
+  seq.modeOnce()
+  # the hook plays one pass of the sequence
+  server.add(IOC + ":PLYCTL", 0, play(server, 1))
+  seq.start()
+  seen = []
+  assert seq.wait(timeout=2, progress=lambda n, ntodo: seen.append((n, ntodo)))
+  assert server.get(IOC + ":PLSTAT") == 0
+  assert server.get(IOC + ":TPLCNT") == 6
+  assert seen[-1][1] == 1
+
+
+def test_wait_repeat(seq):
+  server = seq.server
+  seq.modeNtimes(4)
+  assert seq.getmode() == "Repeat N Times"
+  hook = play(server, 4)
+  server.add(IOC + ":PLYCTL", 0, hook)
+  seen = []
+  seq.start()
+  assert seq.wait(timeout=2, progress=lambda n, ntodo: seen.append(n))
+  assert server.get(IOC + ":TPLCNT") == 4
+  # only changes of the play count are reported
+  assert seen == sorted(set(seen))
+
+
+def test_wait_timeout(seq):
+  server = seq.server
+  seq.modeOnce()
+  # started, but the sequence never finishes
+  server.add(IOC + ":PLYCTL", 0, lambda value: server.set(IOC + ":PLSTAT", 2))
+  seq.start()
+  t0 = time.time()
+  assert not seq.wait(timeout=0.2)
+  assert 0.2 <= time.time() - t0 < 1
+
+
+def test_wait_forever_returns(seq):
+  seq.modeForever()
+  assert seq.wait(timeout=0.1)
+
+
+def test_done_runs_without_lock(seq):
+  # done() may do a blocking get, the monitor callbacks must not wait on it
+  owned = []
+  calls = [0]
+  def done():
+    owned.append(seq._cond._is_owned())
+    calls[0] += 1
+    return calls[0] > 3
+  assert seq._wait_until(done, timeout=1, progress=lambda: owned.append(seq._cond._is_owned()))
+  assert owned and not any(owned)
+
+
+def test_codemap_invalidation(seq):
+  seq.setnsteps(3)
+  seq.setstep(0, 40, 0)
+  seq.setstep(1, 41, 1)
+  seq.setstep(2, 40, 1)
+  forward, reverse = seq.codemap()
+  assert forward == [40, 41, 40]
+  assert reverse == {40: [0, 2], 41: [1]}
+  assert seq.codemap() is seq.codemap()
+  assert seq.steps_with_code(40) == [0, 2]
+  seq.setstep(1, 42, 1)
+  assert seq.codemap()[0] == [40, 42, 40]
+  assert seq.steps_with_code(41) == []
+  seq.setnsteps(2)
+  assert seq.codemap()[0] == [40, 42]
+  assert seq.steps_with_code(40) == [0]
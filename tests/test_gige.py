@@ -0,0 +1,111 @@
+import time
+import numpy as np
+import pytest
+
+from blutil import simulation
+from blbase.gige import GigeCam, ImageRing, encode_lstr, decode_lstr
+
+SHAPE = (4, 6)
+
+
+@pytest.fixture
+def camera(request):
+    sim = simulation.server
+    name = "SIM:GIGE:%s" % request.node.name.upper()
+    cam = sim.add_camera(name, shape=SHAPE, rate=100.)
+    yield cam
+    cam.stop()
+
+
+def test_connects_concurrently(camera, monkeypatch):
+    monkeypatch.setattr(simulation.server, "latency", 0.02)
+    t0 = time.time()
+    GigeCam(camera.pvname)
+    t = time.time() - t0
+    # about 50 pvs, one after another this would take a second
+    assert t < 0.5
+
+
+def test_missing_pv_reported(camera, monkeypatch, capsys):
+    sim = simulation.server
+    GigeCam(camera.pvname)
+    missing = "%s:JPEG1:FileNumber" % camera.pvname
+    del sim._values[missing]
+    monkeypatch.setattr(sim, "autocreate", False)
+    monkeypatch.setattr(sim, "latency", 0.001)
+    t0 = time.time()
+    GigeCam(camera.pvname, timeout=0.2)
+    assert time.time() - t0 < 1.
+    out = capsys.readouterr()[0]
+    assert "1 PVs of %s did not connect: %s" % (camera.pvname, missing) in out
+
+
+def test_lstr_round_trip():
+    for s in ["", "a", "/reg/d/psdm/xpp/data", "x" * 256]:
+        arr = encode_lstr(s)
+        assert arr.dtype == np.uint8 and len(arr) == 256
+        assert decode_lstr(arr) == s
+    assert decode_lstr(tuple(encode_lstr("abc", 10).tolist())) == "abc"
+    with pytest.raises(ValueError):
+        encode_lstr("x" * 257)
+
+
+def test_put_str(camera):
+    cam = GigeCam(camera.pvname)
+    cam.filename = "run12"
+    value = simulation.server.get("%s:JPEG1:FileName" % camera.pvname)
+    assert decode_lstr(value) == "run12"
+    with pytest.raises(ValueError):
+        cam.filepath = "/" * 300
+
+
+def test_get_frames_in_order(camera):
+    cam = GigeCam(camera.pvname)
+    camera.start()
+    frames, times, ids = cam.get_frames(5, timeout=2.)
+    assert frames.shape == (5,) + SHAPE
+    assert list(ids) == range(ids[0], ids[0] + 5)
+    assert np.all(np.diff(times) >= 0)
+    # the simulated frame n starts with pixel value n % 1024
+    assert list(frames[:, 0, 0]) == [i % 1024 for i in ids]
+    frames2, times2, ids2 = cam.get_frames(3, timeout=2.)
+    assert ids2[0] > ids[-1]
+
+
+def test_dropped_frames(camera):
+    camera.drop_every = 4
+    cam = GigeCam(camera.pvname)
+    ring = cam.start_stream(size=64)
+    camera.start()
+    assert ring.wait(30, timeout=3.)
+    camera.stop()
+    frames, times, ids = ring.latest(ring.count)
+    assert not any(i % 4 == 0 for i in ids)
+    gaps = np.diff(ids) - 1
+    assert cam.stream_stats()["dropped"] == gaps.sum() > 0
+
+
+def test_stream_stats_rate(camera):
+    cam = GigeCam(camera.pvname)
+    assert cam.stream_stats() is None
+    cam.start_stream(size=32)
+    camera.start()
+    assert cam.ring.wait(20, timeout=3.)
+    stats = cam.stream_stats()
+    assert stats["frames"] >= 20
+    assert stats["dropped"] == 0
+    assert 50. < stats["rate"] < 150.
+    cam.stop_stream()
+
+
+def test_ring_wraps():
+    ring = ImageRing((2, 2), size=4)
+    for i in range(10):
+        ring.put(np.full(4, i), uid=i + 1, t=float(i))
+    frames, times, ids = ring.latest(6)
+    assert list(ids) == [7, 8, 9, 10]
+    assert list(frames[:, 0, 0]) == [6, 7, 8, 9]
+    assert ring.rate() == 1.
+    ring.put(np.zeros(4), uid=15, t=10.)
+    assert ring.dropped == 4
+    assert not ring.wait(20, timeout=0.01)
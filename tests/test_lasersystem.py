@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from blutil import simulation
+from blbase import lasersystem
+from blbase.lasersystem import TimingModel, TimingPlan
+
+
+def timing_par_scalar(model, delay):
+  """ reference: the per tick loop of the original get_timing_par/get_dt """
+  def get_dt(n, t):
+    tc = model.fs_cen
+    op = model.osc_period
+    dt = (t-tc)- np.round((n-model.evr0_las)*model.evr_tick/op)*op
+    while dt>(model.phase_shifter_max-tc):
+      dt-=op
+    while dt < -tc:
+      dt+=op
+    return dt
+  n0 = model.evr0_las
+  nmin = model.n_min(delay)
+  nmax = model.n_max(delay)
+  if nmin<=n0<=nmax:
+    n = 1.*n0
+  else:
+    ns  = np.arange(nmin,nmax+1)
+    dts = [abs(get_dt(nn,delay)-model.fs_cen) for nn in ns]
+    n = ns[np.argmin(dts)]
+  return n, get_dt(n,delay)
+
+
+def random_model(rnd):
+  fsmin = rnd.uniform(-2e-9, 2e-9)
+  fsmax = fsmin + rnd.uniform(1e-9, 20e-9)
+  return TimingModel(rnd.randint(0, 200000), rnd.randint(0, 200000),
+                     (-fsmin-fsmax)/2+rnd.uniform(-5e-9, 5e-9), abs(fsmin-fsmax)/2, 0.)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_timing_par_matches_loop(seed):
+  rnd = np.random.RandomState(seed)
+  for trial in range(50):
+    m = random_model(rnd)
+    delays = m.fs_cen + rnd.uniform(-1e-6, 1e-6, size=20)
+    delays[:5] = m.fs_cen + rnd.uniform(-m.fs_rad, m.fs_rad, size=5)
+    n, dt = m.timing_par(delays)
+    for i, d in enumerate(delays):
+      try:
+        nref, dtref = timing_par_scalar(m, d)
+      except ValueError:
+        # no tick reaches the delay: the loop fails on the empty range
+        assert np.isnan(n[i])
+        continue
+      assert abs(dt[i]-dtref) <= 1e-18
+      # ticks a whole number of oscillator periods apart give the same dt;
+      # which one the loop picks depends on rounding, any of them is fine
+      assert n[i] == nref or m.n_min(d) <= n[i] <= m.n_max(d)
+
+
+def test_timing_par_scalar_and_shape():
+  m = TimingModel(1000, 1010, 5e-9, 10e-9, 1e-9)
+  n, dt = m.timing_par(2e-7)
+  assert isinstance(n, float) and isinstance(dt, float)
+  assert (n, dt) == pytest.approx(timing_par_scalar(m, 2e-7), rel=0, abs=1e-18)
+  delays = np.linspace(-1e-7, 1e-7, 12).reshape(3, 4)
+  n, dt = m.timing_par(delays)
+  assert n.shape == dt.shape == (3, 4)
+
+
+def test_get_dt_in_range():
+  m = TimingModel(1000, 1010, 5e-9, 10e-9, 1e-9)
+  evr = np.arange(900, 1100)
+  dt = m.get_dt(evr, 3e-8)
+  assert np.all(dt > -m.fs_cen)
+  assert np.all(dt <= m.phase_shifter_max-m.fs_cen)
+
+
+def test_plan():
+  m = TimingModel(1000, 1010, 5e-9, 10e-9, 1e-9)
+  t0delays = np.linspace(-1e-9, 1e-6, 101)
+  plan = m.plan(t0delays)
+  assert len(plan) == 101
+  for i in (0, 3, 100):
+    n, dt = timing_par_scalar(m, m.fs_offset-t0delays[i])
+    pn, gate, dial, move = plan.point(t0delays[i])
+    assert pn == n
+    assert gate == 1010-1000+n
+    assert dial == pytest.approx(dt+m.fs_cen, rel=0, abs=1e-18)
+    assert move == (abs(t0delays[i]) <= 200e-9)
+  # a delay that was not planned is computed on the fly
+  n, dt = timing_par_scalar(m, m.fs_offset-1.23e-8)
+  assert plan.point(1.23e-8)[0] == n
+
+
+def test_unreachable_delay_raises():
+  m = TimingModel(1000, 1000, 5e-9, 2e-9, 0.)
+  n, dt = m.timing_par(0.)
+  assert np.isnan(n)
+  with pytest.raises(ValueError):
+    TimingPlan(m, [0.])
+  with pytest.raises(ValueError):
+    m.plan([1e-9, 0.])
+
+
+def test_set_timing_unreachable_writes_nothing(monkeypatch):
+  las = lasersystem.LaserSystem.__new__(lasersystem.LaserSystem)
+  model = TimingModel(1000, 1000, 5e-9, 2e-9, 0.)
+  monkeypatch.setattr(las, "timing_model", lambda: model)
+  puts = simulation.server.counts["put"]
+  with pytest.raises(ValueError):
+    las.set_timing(0.)
+  assert simulation.server.counts["put"] == puts
@@ -0,0 +1,137 @@
+import time
+import tempfile
+import threading
+import SocketServer
+import numpy as np
+import pytest
+
+from blbase.marccd import marccd
+
+N = 64
+
+
+class FakeMarccdHandler(SocketServer.StreamRequestHandler):
+  """ answers the marccd_server_socket commands used by marccd: get_size,
+  get_state (the codes in server.states, one per query, the last one
+  repeated), get_image (sent in fragments of server.chunk bytes) and
+  readout, which queues server.readout_states """
+  def handle(self):
+    srv = self.server
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      cmd = line.strip().split(",")
+      srv.commands.append(line.strip())
+      if cmd[0] == "get_size":
+        self.wfile.write("%d,%d\n" % (srv.n, srv.n))
+      elif cmd[0] == "get_state":
+        with srv.lock:
+          code = srv.states[0]
+          if len(srv.states) > 1:
+            srv.states.pop(0)
+        self.wfile.write("%d\n" % code)
+      elif cmd[0] == "get_image":
+        img = srv.image if cmd[1] == "1" else srv.raw
+        data = img.astype("<u2").tostring()
+        if srv.truncate:
+          data = data[:len(data)//2]
+        for i in range(0, len(data), srv.chunk):
+          self.wfile.write(data[i:i+srv.chunk])
+          self.wfile.flush()
+          time.sleep(0.0005)
+        if srv.truncate:
+          return
+        self.wfile.write("\n")
+      elif cmd[0] == "readout":
+        with srv.lock:
+          srv.states = list(srv.readout_states)
+
+
+class FakeMarccd(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+@pytest.fixture
+def server(monkeypatch, tmpdir):
+  # error messages go to the error log in the temp folder
+  monkeypatch.setattr(tempfile, "tempdir", str(tmpdir))
+  srv = FakeMarccd(("127.0.0.1", 0), FakeMarccdHandler)
+  srv.n = N
+  srv.image = (np.arange(N*N) % 65536).astype(np.uint16).reshape(N, N)
+  srv.raw = srv.image[::-1].copy()
+  srv.states = [0]
+  srv.readout_states = [0]
+  srv.chunk = 1000
+  srv.truncate = False
+  srv.commands = []
+  srv.lock = threading.Lock()
+  thread = threading.Thread(target=srv.serve_forever)
+  thread.daemon = True
+  thread.start()
+  yield srv
+  srv.shutdown()
+  srv.server_close()
+
+
+@pytest.fixture
+def ccd(server):
+  ccd = marccd("127.0.0.1:%d" % server.server_address[1])
+  ccd.retries = 2
+  return ccd
+
+
+def test_image(server, ccd):
+  img = ccd.image()
+  assert isinstance(img, np.ndarray)
+  assert img.dtype == np.uint16 and img.shape == (N, N)
+  np.testing.assert_array_equal(img, server.image)
+  raw = ccd.raw_image()
+  np.testing.assert_array_equal(raw, server.raw)
+  assert server.commands == ["get_size", "get_image,1", "get_size", "get_image,0"]
+
+
+def test_fragmented_reads(server, ccd):
+  for chunk in (101, 577, 4097):
+    server.chunk = chunk
+    np.testing.assert_array_equal(ccd.image(), server.image)
+  # the trailing newline was drained, the next query gets its own reply
+  assert ccd.state_code() == 0
+
+
+def test_truncated_image(server, ccd):
+  server.truncate = True
+  assert ccd.image() is None
+  assert server.commands.count("get_image,1") == 2
+
+
+def test_unknown_size(server, ccd):
+  server.n = 0
+  img = ccd.get_image()
+  np.testing.assert_array_equal(img, server.image.ravel())
+
+
+def test_wait_state(server, ccd):
+  server.states = [0x300, 0x300, 0x3000, 0x3000, 0]
+  assert ccd.wait_state(0x3300, timeout=2.)
+  assert server.commands.count("get_state") == 5
+  server.states = [0, 0, 0x100]
+  assert ccd.wait_state(0x300, active=True, timeout=2.)
+  assert ccd.is_reading()
+
+
+def test_wait_state_timeout(server, ccd):
+  server.states = [0x200]
+  t0 = time.time()
+  assert not ccd.wait_state(0x200, timeout=0.1)
+  assert 0.1 <= time.time() - t0 < 0.5
+
+
+def test_read_image(server, ccd):
+  server.readout_states = [0x100, 0x200, 0x2000, 0]
+  img = ccd.read_image()
+  np.testing.assert_array_equal(img, server.image)
+  assert server.commands[0] == "readout,0"
+  # one query sees the readout queued, three more until it is done
+  assert server.commands.count("get_state") == 4
@@ -0,0 +1,76 @@
+import os
+import pytest
+
+from blutil import simulation
+from blbase import motorsfile
+
+PVS = ["SIM:MF:MMS:01", "SIM:MF:MMS:02"]
+
+
+@pytest.fixture
+def arch(monkeypatch, tmpdir):
+    server = simulation.server
+    monkeypatch.setattr(server, "autocreate", False)
+    monkeypatch.setattr(motorsfile, "rtyp_cache_dir", str(tmpdir.join("cache")))
+    # not motors, so import_epicsArch reports them instead of making Motors
+    for pv in PVS:
+        server.add(pv + ".RTYP", "ao")
+    path = tmpdir.join("epicsArch.txt")
+    path.write("".join("*m{0}\n{1}\n".format(i, pv) for i, pv in enumerate(PVS)))
+    return str(path)
+
+
+def reasons(motors):
+    return [r[2] for r in motors.import_report]
+
+
+def set_rtyp(rtyp):
+    for pv in PVS:
+        simulation.server.set(pv + ".RTYP", rtyp)
+
+
+def test_rtyp_cached(arch):
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1)
+    assert reasons(m) == ["record type ao"] * 2
+    set_rtyp("bo")
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1)
+    assert reasons(m) == ["record type ao"] * 2
+
+
+def test_rtyp_refresh(arch):
+    motorsfile.Motors().import_epicsArch(arch, timeout=1)
+    set_rtyp("bo")
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1, refresh=True)
+    assert reasons(m) == ["record type bo"] * 2
+
+
+def test_rtyp_expires(arch, monkeypatch):
+    motorsfile.Motors().import_epicsArch(arch, timeout=1)
+    set_rtyp("bo")
+    monkeypatch.setattr(motorsfile, "rtyp_cache_ttl", 0)
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1)
+    assert reasons(m) == ["record type bo"] * 2
+
+
+def test_rtyp_dropped_when_file_changes(arch):
+    motorsfile.Motors().import_epicsArch(arch, timeout=1)
+    set_rtyp("bo")
+    mtime = os.path.getmtime(arch)
+    os.utime(arch, (mtime + 10, mtime + 10))
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1)
+    assert reasons(m) == ["record type bo"] * 2
+
+
+def test_old_cache_entries_ignored(arch):
+    cache = motorsfile.RtypCache(arch)
+    cache._data["rtyp"] = dict((pv, "ao") for pv in PVS)
+    cache.save()
+    set_rtyp("bo")
+    m = motorsfile.Motors()
+    m.import_epicsArch(arch, timeout=1)
+    assert reasons(m) == ["record type bo"] * 2
@@ -0,0 +1,85 @@
+import gc
+import weakref
+
+from blutil import organize
+
+
+class Stage(object):
+    """ a motor stage """
+
+
+class Device(object):
+    """ a device """
+    def __init__(self, part):
+        self.part = part
+        self.reads = 0
+
+    @property
+    def value(self):
+        """ pv backed value """
+        self.reads += 1
+        return 1.5
+
+    def move(self, pos, wait=False):
+        """ move to pos """
+        self.pos = pos
+
+
+def test_alias_forwards():
+    dev = Device(Stage())
+    alias = organize.alias_object(dev, value="val", move=["mv", "go"])
+    assert alias.val == 1.5
+    alias.mv(3.)
+    assert dev.pos == 3.
+    alias.part = "other"
+    assert dev.part == "other"
+
+
+def test_docs_do_not_evaluate():
+    dev = Device(Stage())
+    alias = organize.alias_object(dev, value="val")
+    cls = alias.__class__
+    assert cls.val.__doc__ == " pv backed value "
+    assert "move to pos" in cls.move.__doc__
+    assert cls.part.__doc__ == " a motor stage "
+    assert cls.reads.__doc__ == "type int"
+    assert dev.reads == 0
+
+
+def test_cached_class_does_not_keep_objects():
+    # a class of its own, so that the proxy classes are made here
+    class Fresh(Device):
+        pass
+    dev = Fresh(Stage())
+    ref = weakref.ref(dev)
+    alias = organize.alias_object(dev, value="val")
+    merged = organize.object_merge("merged", dev, Fresh(Stage()))
+    classes = alias.__class__, merged.__class__
+    del dev, alias, merged
+    gc.collect()
+    assert ref() is None
+    assert classes[0].part.__doc__ == " a motor stage "
+    assert classes[1].part.__doc__ == " a motor stage "
+
+
+def test_instance_attribute_types_in_key():
+    a = organize.alias_object(Device(Stage()), value="val")
+    b = organize.alias_object(Device(Stage()), value="val")
+    c = organize.alias_object(Device("stage name"), value="val")
+    assert a.__class__ is b.__class__
+    assert c.__class__ is not a.__class__
+    assert c.__class__.part.__doc__ == "type str"
+
+
+def test_proxy_property_keeps_source():
+    dev = Device(Stage())
+    prop = organize.proxy_property(dev, "value")
+    Holder = type("Holder", (object,), {"value": prop})
+    assert Holder().value == 1.5
+    assert prop.__doc__ == " pv backed value "
+
+
+def test_benchmark_evaluates_nothing():
+    res = organize.benchmark(nattrs=10, nobjs=5)
+    assert res["evaluations"] == 0
+    assert res["doc_evaluations"] == 0
@@ -0,0 +1,26 @@
+import numpy as np
+
+from blutil.plot import Plot2D
+
+
+def test_close_stops_timer():
+  plot = Plot2D(1, max_rate=1000.)
+  timer = plot._Plot2D__timer
+  assert timer is not None
+  assert plot.update in [cb[0] for cb in timer.callbacks]
+  plot.close()
+  assert plot._Plot2D__timer is None
+  assert plot.update not in [cb[0] for cb in timer.callbacks]
+  plot.close()
+
+
+def test_close_draws_pending_points():
+  plot = Plot2D(2, max_rate=1e-3)
+  plot.setdata([0., 1., 2.], [1., 2., 1.])
+  plot.append(3., 0.)
+  x, y = plot.line.get_data()
+  assert len(x) == 3
+  plot.close()
+  x, y = plot.line.get_data()
+  np.testing.assert_array_equal(x, [0., 1., 2., 3.])
+  np.testing.assert_array_equal(y, [1., 2., 1., 0.])
@@ -0,0 +1,42 @@
+import pytest
+
+from blutil import simulation, snapshot
+from blbase import stateioc, motorsfile
+
+
+@pytest.fixture
+def sim(monkeypatch):
+  server = simulation.server
+  monkeypatch.setattr(server, "autocreate", False)
+  server.add("SNAP:A", 1.5)
+  server.add("SNAP:B", "out")
+  server.add("SNAP:MMS:01.RTYP", "motor")
+  server.add("SNAP:MMS:02.RTYP", "ims")
+  return server
+
+
+def test_read(sim):
+  values, errors = snapshot.read(["SNAP:A", "SNAP:B", "SNAP:A"], 0.5)
+  assert values == {"SNAP:A": 1.5, "SNAP:B": "out"}
+  assert errors == {}
+
+
+def test_read_missing_pv(sim):
+  values, errors = snapshot.read(["SNAP:A", "SNAP:NONE"], 0.5)
+  assert values == {"SNAP:A": 1.5}
+  assert list(errors) == ["SNAP:NONE"]
+
+
+def test_read_dict(sim):
+  v = snapshot.read_dict({"a": "SNAP:A", "none": "SNAP:NONE", "unset": None}, 0.5)
+  assert v == {"a": 1.5, "none": None, "unset": None}
+
+
+def test_connect_all(sim):
+  assert stateioc.connect_all(["SNAP:A", "SNAP:B", "SNAP:NONE"], 0.5) == \
+    {"SNAP:A": 1.5, "SNAP:B": "out"}
+
+
+def test_get_rtyps(sim):
+  assert motorsfile.get_rtyps(["SNAP:MMS:01", "SNAP:MMS:02", "SNAP:MMS:03"], 0.5) == \
+    {"SNAP:MMS:01": "motor", "SNAP:MMS:02": "ims"}
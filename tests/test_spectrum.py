@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from blutil import spectrum
+from blutil.spectrum import SpectrumFile, NPIX
+
+
+def write_specs(path, nspec, header_bytes=0, seed=0):
+    """ synthetic spectrometer file in the existing layout: records of an
+    optional header followed by NPIX native int16 pixels """
+    rnd = np.random.RandomState(seed)
+    pixels = rnd.randint(-2000, 30000, size=(nspec, NPIX)).astype(np.int16)
+    with open(str(path), "wb") as f:
+        for row in pixels:
+            if header_bytes:
+                f.write(b"\xab" * header_bytes)
+            row.tofile(f)
+    return pixels
+
+
+def test_getspecs_maps_all_pixels(tmpdir):
+    path = tmpdir.join("run.dat")
+    pixels = write_specs(path, 25)
+    sf = SpectrumFile(nspec=None)
+    specs = sf.getspecs(str(path))
+    assert isinstance(specs.base, np.memmap) or isinstance(specs, np.memmap)
+    assert specs.shape == (25, NPIX-1)
+    assert np.array_equal(specs, pixels[:, :NPIX-1])
+    assert sf.specs is specs
+
+
+def test_nspec_and_onlyvis(tmpdir):
+    path = tmpdir.join("run.dat")
+    pixels = write_specs(path, 10)
+    sf = SpectrumFile(nspec=4, onlyvis=True)
+    specs = sf.getspecs(str(path))
+    assert np.array_equal(specs, pixels[:4, 21:3830])
+    assert sf.getspecs(str(path), nspec=100).shape[0] == 10
+
+
+def test_header(tmpdir):
+    path = tmpdir.join("run.dat")
+    pixels = write_specs(path, 7, header_bytes=12)
+    sf = SpectrumFile(nspec=None, header_bytes=12)
+    assert np.array_equal(sf.getspecs(str(path)), pixels[:, :NPIX-1])
+
+
+def test_chunks_sum_average(tmpdir):
+    path = tmpdir.join("run.dat")
+    pixels = write_specs(path, 23).astype(float)[:, :NPIX-1]
+    sf = SpectrumFile(nspec=None)
+    sf.getspecs(str(path))
+    blocks = list(sf.chunks(chunk=5, start=2, stop=20))
+    assert [len(b) for b in blocks] == [5, 5, 5, 3]
+    assert np.array_equal(np.concatenate(blocks), pixels[2:20])
+    assert np.allclose(sf.sum(chunk=4), pixels.sum(axis=0))
+    assert np.allclose(sf.average(3, 100, chunk=6), pixels[3:].mean(axis=0))
+
+
+def test_dark_subtraction(tmpdir):
+    dark_path = tmpdir.join("dark.dat")
+    path = tmpdir.join("run.dat")
+    dark = write_specs(dark_path, 9, seed=1).astype(float)
+    pixels = write_specs(path, 6, seed=2).astype(float)
+    sf = SpectrumFile(nspec=None)
+    sf.setdark(str(dark_path), av_start=2, n_av=5)
+    sf.getspecs(str(path))
+    expected = pixels[:, :NPIX-1] - dark[2:7].mean(axis=0)[:NPIX-1]
+    assert np.allclose(np.concatenate(list(sf.chunks(chunk=4))), expected)
+    assert np.allclose(sf.average(), expected.mean(axis=0))
+
+
+def test_write_ascii(tmpdir):
+    path = tmpdir.join("run.dat")
+    out = tmpdir.join("out.txt")
+    pixels = write_specs(path, 3)
+    sf = SpectrumFile(nspec=3)
+    sf.writeASCII(str(out), str(path))
+    assert np.array_equal(np.loadtxt(str(out)), pixels[:, :NPIX-1])
+
+
+def test_not_loaded():
+    sf = SpectrumFile()
+    with pytest.raises(ValueError):
+        list(sf.chunks())
+    with pytest.raises(ValueError):
+        sf.sum()
+    with pytest.raises(ValueError):
+        sf.average()
+
+
+def test_iterchunks_empty():
+    specs = np.zeros((0, 4), dtype=np.int16)
+    assert list(spectrum.iterchunks(specs)) == []
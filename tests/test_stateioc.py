@@ -0,0 +1,80 @@
+import time
+import pytest
+
+from blutil import simulation
+from blbase import stateioc
+
+PREFIX = "SIM:STATES"
+STATES = ["OUT", "IN", "YAG"]
+
+
+@pytest.fixture
+def sim(monkeypatch, tmpdir):
+    server = simulation.server
+    monkeypatch.setattr(server, "autocreate", False)
+    monkeypatch.setattr(stateioc, "cache_dir", str(tmpdir))
+    server.add(PREFIX, 1)
+    server.add(PREFIX + ":GO", 0)
+    for i, state in enumerate(STATES):
+        fld = stateioc.stateiocDevice._strFields[i]
+        server.add("{0}.{1}".format(PREFIX, fld), state)
+        server.add("{0}:GO.{1}".format(PREFIX, fld), state)
+        server.add("{0}:{1}".format(PREFIX, state), int(i == 1))
+        server.add("{0}:{1}_SET".format(PREFIX, state), 10. * i)
+        server.add("{0}:{1}_DELTA".format(PREFIX, state), 0.5)
+    for fld in stateioc.stateiocDevice._strFields[len(STATES):]:
+        server.add("{0}.{1}".format(PREFIX, fld), "")
+        server.add("{0}:GO.{1}".format(PREFIX, fld), "")
+    return server
+
+
+def test_states(sim):
+    dev = stateioc.stateiocDevice(PREFIX)
+    assert dev.statesAll() == STATES
+    assert dev.statePosAll() == {"OUT": 0., "IN": 10., "YAG": 20.}
+    assert dev.stateDelta("YAG") == 0.5
+    assert dev.state() == "IN"
+    assert dev.is_in()
+    dev.move_yag()
+    assert sim.get(PREFIX + ":GO") == 2
+
+
+def test_table_cached(sim):
+    stateioc.stateiocDevice(PREFIX)
+    sim.set(PREFIX + ":IN_SET", 11.)
+    # the cached table gives the old value, the monitor the new one
+    dev = stateioc.stateiocDevice(PREFIX)
+    assert dev.getPos_in() == 11.
+    assert stateioc.load_table(PREFIX)["pos"]["IN"] == 10.
+
+
+def test_connects_concurrently(sim, monkeypatch):
+    stateioc.stateiocDevice(PREFIX)
+    monkeypatch.setattr(sim, "latency", 0.02)
+    t0 = time.time()
+    dev = stateioc.stateiocDevice(PREFIX)
+    warm = time.time() - t0
+    # 7 pvs one after another would take 0.14 s
+    assert warm < 0.1
+    assert dev.statePos("YAG") == 20.
+
+
+def test_missing_pv(sim, monkeypatch):
+    del sim._values[PREFIX + ":YAG_DELTA"]
+    monkeypatch.setattr(sim, "latency", 0.001)
+    t0 = time.time()
+    dev = stateioc.stateiocDevice(PREFIX, timeout=0.2)
+    assert time.time() - t0 < 1.
+    assert dev.statePos("YAG") == 20.
+    assert dev.stateDelta("IN") == 0.5
+
+
+def test_refresh_disconnects_old_monitors(sim):
+    dev = stateioc.stateiocDevice(PREFIX)
+    old = dev._setPVs + dev._deltaPVs
+    oldPos = dev._pos
+    dev.refresh()
+    assert not any(p.ismonitored for p in old)
+    sim.set(PREFIX + ":OUT_SET", -5.)
+    assert oldPos[0] == 0.
+    assert dev.getPos_out() == -5.
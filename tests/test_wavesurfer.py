@@ -0,0 +1,175 @@
+import socket
+import struct
+import threading
+import SocketServer
+import numpy as np
+import pytest
+
+from blbase import wavesurfer
+from blbase.wavesurfer import Wavesurfer, WaveformRing, parse_waveform, VICP_DATA, VICP_EOI
+
+DESC_LEN = 346
+
+
+def make_waveform(y, order="<", comm_type=1, gain=0.01, offset=0.5,
+                  interval=1e-9, t0=-2e-8, user_text=""):
+  """ a WF? ALL reply in the LECROY_2_3 format with raw data y """
+  dtype = np.dtype(order + ("i2" if comm_type == 1 else "i1"))
+  data = np.asarray(y, dtype=dtype).tostring()
+  desc = bytearray(DESC_LEN)
+  desc[0:8] = "WAVEDESC"
+  desc[16:26] = "LECROY_2_3"
+  values = dict(comm_type=comm_type, comm_order=int(order == "<"),
+    wave_descriptor=DESC_LEN, user_text=len(user_text), res_desc1=0,
+    trigtime_array=0, ris_time_array=0, res_array1=0, wave_array_1=len(data),
+    wave_array_count=len(y), first_valid_pnt=0, last_valid_pnt=len(y)-1,
+    vertical_gain=gain, vertical_offset=offset, horiz_interval=interval,
+    horiz_offset=t0)
+  for name, pos, fmt in wavesurfer.WAVEDESC_FIELDS:
+    struct.pack_into(order + fmt, desc, pos, values[name])
+  block = str(desc) + user_text + data
+  return "C1:WF ALL,#9%09d" % len(block) + block + "\n"
+
+
+class FakeVICPHandler(SocketServer.BaseRequestHandler):
+  """ a scope speaking VICP: replies to WF? are cut into server.blocks
+  blocks with EOI only on the last, TRMD? answers SINGLE for
+  server.single queries after each TRMD SINGLE """
+  def recv_exact(self, n):
+    data = ""
+    while len(data) < n:
+      chunk = self.request.recv(n - len(data))
+      if not chunk:
+        raise EOFError
+      data += chunk
+    return data
+
+  def reply(self, data):
+    nblocks = self.server.blocks
+    size = -(-len(data) // nblocks)
+    parts = [data[i:i+size] for i in range(0, len(data), size)] or [""]
+    for i, part in enumerate(parts):
+      op = VICP_DATA | (VICP_EOI if i == len(parts)-1 else 0)
+      self.request.sendall(struct.pack(">BBBBI", op, 1, 1, 0, len(part)) + part)
+
+  def handle(self):
+    srv = self.server
+    self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    pending = 0
+    while True:
+      try:
+        op, version, seq, spare, n = struct.unpack(">BBBBI", self.recv_exact(8))
+        cmd = self.recv_exact(n)
+      except EOFError:
+        return
+      srv.commands.append(cmd)
+      if cmd.endswith(":WF? ALL"):
+        self.reply(srv.waveforms[srv.nread % len(srv.waveforms)])
+        srv.nread += 1
+      elif cmd == "TRMD SINGLE":
+        pending = srv.single
+      elif cmd == "TRMD?":
+        if pending > 0 or srv.never_trigger:
+          pending -= 1
+          self.reply("TRMD SINGLE\n")
+        else:
+          self.reply("TRMD STOP\n")
+
+
+class FakeVICP(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+@pytest.fixture
+def scope():
+  srv = FakeVICP(("127.0.0.1", 0), FakeVICPHandler)
+  srv.blocks = 3
+  srv.single = 2
+  srv.never_trigger = False
+  srv.waveforms = [make_waveform(np.arange(100) - 50)]
+  srv.nread = 0
+  srv.commands = []
+  thread = threading.Thread(target=srv.serve_forever, args=(0.05,))
+  thread.daemon = True
+  thread.start()
+  ws = Wavesurfer("127.0.0.1", srv.server_address[1])
+  yield srv, ws
+  ws.close()
+  srv.shutdown()
+  srv.server_close()
+
+
+@pytest.mark.parametrize("order", ["<", ">"])
+@pytest.mark.parametrize("comm_type", [0, 1])
+def test_parse_waveform(order, comm_type):
+  y = np.arange(-60, 60, 3)
+  reply = make_waveform(y, order, comm_type, user_text="note")
+  desc, raw = parse_waveform(bytearray(reply))
+  assert desc["order"] == order
+  assert desc["comm_type"] == comm_type
+  assert desc["wave_array_count"] == len(y)
+  assert desc["vertical_gain"] == pytest.approx(0.01)
+  assert desc["horiz_offset"] == -2e-8
+  assert raw.dtype.itemsize == (2 if comm_type == 1 else 1)
+  np.testing.assert_array_equal(raw, y)
+
+
+def test_parse_waveform_no_desc():
+  with pytest.raises(ValueError):
+    parse_waveform("C1:WF ALL,#9000000000\n")
+
+
+@pytest.mark.parametrize("blocks", [1, 2, 7])
+def test_get_waveform_blocks(scope, blocks):
+  srv, ws = scope
+  srv.blocks = blocks
+  t, y = ws.get_waveform(1)
+  np.testing.assert_allclose(y, (np.arange(100) - 50)*0.01 - 0.5, rtol=0, atol=1e-6)
+  np.testing.assert_allclose(t, np.arange(100)*1e-9 - 2e-8, rtol=0, atol=1e-14)
+  assert ws.wavedesc["wave_array_count"] == 100
+  assert srv.commands == ["CFMT DEF9,WORD,BIN", "CORD LO", "C1:WF? ALL"]
+  # the reply was read completely, the next one is in sync
+  assert ws.query("TRMD?") == "TRMD STOP"
+
+
+def test_get_waveform_big_endian_bytes(scope):
+  srv, ws = scope
+  srv.waveforms = [make_waveform([1, -2, 3], ">", 0, gain=1., offset=0.)]
+  t, y = ws.get_waveform("F1")
+  np.testing.assert_array_equal(y, [1, -2, 3])
+  assert srv.commands[-1] == "F1:WF? ALL"
+
+
+def test_stream_waveforms(scope):
+  srv, ws = scope
+  srv.waveforms = [make_waveform(np.full(10, i), gain=1., offset=0.) for i in range(5)]
+  ring = ws.stream_waveforms(5)
+  assert ring.count == 5
+  np.testing.assert_array_equal(ring.latest()[:, 0], range(5))
+  assert srv.commands.count("TRMD SINGLE") == 5
+  assert srv.commands.count("TRMD?") == 5*3
+
+
+def test_stream_waveforms_timeout(scope):
+  srv, ws = scope
+  srv.never_trigger = True
+  ring = ws.stream_waveforms(3, timeout=0.05)
+  assert ring is None
+  assert srv.nread == 0
+
+
+def test_waveform_ring():
+  ring = WaveformRing(4, 5)
+  for i in range(6):
+    ring.append(np.full(8, float(i)), t0=i*1e-3)
+  assert ring.data.shape == (4, 5)
+  np.testing.assert_array_equal(ring.latest()[:, 0], [2, 3, 4, 5])
+  np.testing.assert_array_equal(ring.latest(2)[:, 0], [4, 5])
+  assert list(ring.t0) == [4e-3, 5e-3, 2e-3, 3e-3]
+  stats = ring.stats()
+  assert stats["count"] == 6
+  assert stats["dropped"] == 2
+  assert ring.nbytes == 6*8*8
+  assert stats["rate"] == pytest.approx(6/stats["elapsed"])
+  assert stats["mbps"] == pytest.approx(ring.nbytes/stats["elapsed"]/1e6)